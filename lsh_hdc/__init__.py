@@ -8,15 +8,20 @@ import re
 import sys
 import random
 import collections
+import numpy as np
 from math import log1p
 from operator import itemgetter
-from heapq import nsmallest
-from logging import getLogger
+from logging import getLogger, DEBUG
 from itertools import imap, izip, islice, chain, combinations
 from abc import abstractmethod
 from pymaptools.iter import cycle, take, shinglify, isiterable
-from lsh_hdc.utils import wrap_scalar, tsorted, fill_with_last
-from lsh_hdc.ext import hashable, VarlenHash, PHashCombiner as HashCombiner
+from lsh_hdc.utils import tsorted
+from lsh_hdc.ext import hashable, VarlenHash, PHashCombiner as HashCombiner, \
+    bottom_k_minhashes, bottom_k_minhashes_many, hash_shingles, \
+    hash_text_shingles, mix_hashes_64, one_permutation_minhashes, \
+    hash_combine_murmur_64
+from lsh_hdc.hashes import UniversalHashFamily, MurmurHashFamily
+from lsh_hdc.preprocess import RegexTokenizer
 
 # Various hash functions
 from metrohash import metrohash64, metrohash128
@@ -40,6 +45,94 @@ HASH_FUNC_TABLE = {
 }
 
 
+# Hash families hash each feature once with a base hash function and derive
+# the rest of the signature from the base value, which allows batch signing
+HASH_FAMILY_TABLE = {
+    "universal": (UniversalHashFamily, metrohash64, False),
+    "murmur":    (MurmurHashFamily,    metrohash64, False),
+}
+
+
+# LSH bands computed so far, keyed by (width, bandwidth, scheme)
+_SIG_BANDS_CACHE = {}
+
+
+# Maximum number of features to hash at once when signing in batches
+BATCH_MAX_FEATURES = 1 << 16
+
+
+# Integer LSH keys are packed as [16-bit prefix | 48-bit value], where prefix
+# is a band index (or a signature position when LSH is not used)
+KEY_PREFIX_BITS = 16
+KEY_VALUE_BITS = 64 - KEY_PREFIX_BITS
+KEY_VALUE_MASK = (1 << KEY_VALUE_BITS) - 1
+
+
+def pack_key(prefix, value):
+    """Pack a band index and a band hash into a 64-bit integer key
+
+    >>> pack_key(1, 2)
+    281474976710658
+    >>> pack_key(0, 2 ** 64 - 1) == KEY_VALUE_MASK
+    True
+    """
+    return (prefix << KEY_VALUE_BITS) | (value & KEY_VALUE_MASK)
+
+
+def pack_keys(prefixes, values):
+    """Vectorized version of pack_key
+
+    :param prefixes: band indices
+    :type prefixes: numpy.ndarray
+    :param values: band hashes (broadcastable against prefixes)
+    :type values: numpy.ndarray
+    :rtype: numpy.ndarray
+
+    >>> pack_keys(np.array([1, 2], dtype=np.uint64),
+    ...           np.array([2, 2 ** 64 - 1], dtype=np.uint64)).tolist()
+    [281474976710658L, 844424930131967L]
+    """
+    prefixes = np.left_shift(np.asarray(prefixes, dtype=np.uint64),
+                             np.uint64(KEY_VALUE_BITS))
+    values = np.bitwise_and(np.asarray(values, dtype=np.uint64),
+                            np.uint64(KEY_VALUE_MASK))
+    return prefixes | values
+
+
+def format_key(prefix, value):
+    """Format a band index and a band hash as a string key
+
+    >>> format_key(1, 2)
+    '1:2'
+    """
+    return "{}:{}".format(prefix, value)
+
+
+KEY_FORMATS = {
+    "int": pack_key,
+    "str": format_key,
+}
+
+
+def get_key_maker(key_format, num_prefixes):
+    """Return a function for creating LSH keys in a given format
+
+    :param key_format: either "int" (packed 64-bit integers) or "str"
+                       (compatibility format of form "prefix:value")
+    :type key_format: str
+    :param num_prefixes: number of distinct prefixes the keys will have
+    :type num_prefixes: int
+    :rtype: callable
+    """
+    try:
+        make_key = KEY_FORMATS[key_format]
+    except KeyError:
+        raise ValueError("Invalid key format: %s" % key_format)
+    if key_format == "int" and num_prefixes > (1 << KEY_PREFIX_BITS):
+        raise ValueError("Too many bands for integer keys: %d" % num_prefixes)
+    return make_key
+
+
 def mshinglify(iterable, span, skip=0):
     """Same as shingligy except repeatedly mask one word
 
@@ -193,6 +286,31 @@ def cntuplesx(m, n, kmin=1):
     return map(tsorted, iterable)
 
 
+def _first_band_with_key(width, bandwidth, key, positions):
+    """Return the smallest band having values of key at given positions
+
+    A band is a sorted tuple of ``bandwidth`` distinct indices less than
+    ``width``. Returns None if no band has ``key`` at ``positions``.
+    """
+    band = []
+    prev_value = -1
+    prev_pos = -1
+    for value, pos in izip(key, positions):
+        # fill the gap between previous fixed position and this one with
+        # smallest available values
+        if value - prev_value < pos - prev_pos:
+            return None
+        band.extend(xrange(prev_value + 1, prev_value + pos - prev_pos))
+        band.append(value)
+        prev_value = value
+        prev_pos = pos
+    num_left = bandwidth - 1 - prev_pos
+    if width - 1 - prev_value < num_left:
+        return None
+    band.extend(xrange(prev_value + 1, prev_value + 1 + num_left))
+    return tuple(band)
+
+
 def lsh_combinations(width, bandwidth, ramp):
     """Generate indices for overlapping LSH band selectors
 
@@ -207,19 +325,26 @@ def lsh_combinations(width, bandwidth, ramp):
     :return: a sequence of tuples with elements representing indices
     :rtype: list
 
+    For every ``ramp``-combination of signature indices (a key), one band
+    containing the key is chosen: among the ``ramp``-combinations of band
+    positions, the first one (in lexicographic order) at which the key can
+    occur is taken, and the band is the lexicographically smallest of all
+    ``bandwidth``-combinations having the key at those positions. Bands are
+    constructed directly, without enumerating all ``bandwidth``-combinations
+    of indices.
+
+    >>> lsh_combinations(4, 3, 2)
+    [(0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)]
     """
-    master = list(combinations(range(width), bandwidth))
-    cols = set(range(bandwidth))
-    left_cols = list(combinations(cols, ramp))
-    right_cols = [tsorted(cols - s) for s in imap(set, left_cols)]
-    left_getters = create_getters(left_cols)
-    right_getters = create_getters(right_cols)
-    mapping = collections.defaultdict(list)
-    for get_left, get_right in izip(left_getters, right_getters):
-        for element in master:
-            mapping[tsorted(wrap_scalar(get_left(element)))].append(
-                tsorted(wrap_scalar(get_right(element))))
-    return sorted(set(tsorted(k + v[0]) for k, v in mapping.iteritems()))
+    all_positions = list(combinations(range(bandwidth), ramp))
+    bands = set()
+    for key in combinations(range(width), ramp):
+        for positions in all_positions:
+            band = _first_band_with_key(width, bandwidth, key, positions)
+            if band is not None:
+                bands.add(band)
+                break
+    return sorted(bands)
 
 
 def create_lsh_bands(width, bandwidth):
@@ -242,19 +367,35 @@ def create_lsh_bands(width, bandwidth):
     return zip(*(iter(xrange(width)),) * bandwidth)
 
 
-def create_sig_selectors(width, bandwidth, scheme):
-    """Generate indices for LSH band selectors
+def create_sig_bands(width, bandwidth, scheme):
+    """Generate LSH bands as tuples of signature indices
 
-    :param width:
+    Results are memoized per (width, bandwidth, scheme), and can be saved to
+    a file with ``save_sig_bands`` and loaded (into the same cache) with
+    ``load_sig_bands``.
+
+    :param width: signature length
     :type width: int
-    :param bandwidth:
+    :param bandwidth: band size
     :type bandwidth: int
-    :param scheme:
+    :param scheme: banding scheme (see ``LSHC``)
     :type scheme: str
-    :return:
-    :rtype: tuple
+    :return: a list of (band index, band) tuples
+    :rtype: list
 
+    >>> create_sig_bands(6, 2, "a0")
+    [(0, (0, 1)), (1, (2, 3)), (2, (4, 5))]
     """
+    cache_key = (width, bandwidth, scheme)
+    sig_bands = _SIG_BANDS_CACHE.get(cache_key)
+    if sig_bands is None:
+        sig_bands = _SIG_BANDS_CACHE[cache_key] = \
+            _create_sig_bands(width, bandwidth, scheme)
+    return list(sig_bands)
+
+
+def _create_sig_bands(width, bandwidth, scheme):
+    """Uncached version of create_sig_bands"""
     split_res = re.split(r'\b([a-zA-Z]+)(?=\d+\b)', scheme)
     _, scheme_code, ramp = split_res
     ramp = int(ramp)
@@ -284,8 +425,64 @@ def create_sig_selectors(width, bandwidth, scheme):
         indices = range(len(bands))
     else:
         raise ValueError("Invalid scheme")
-    LOG.info("Choosing LSH bands: " + ", ".join("{}: {}".format(idx, band)
-                                                for idx, band in izip(indices, bands)))
+    LOG.info("Choosing %d LSH bands (width=%d, bandwidth=%d, scheme=%s)",
+             len(bands), width, bandwidth, scheme)
+    if LOG.isEnabledFor(DEBUG):
+        LOG.debug("LSH bands: " + ", ".join("{}: {}".format(idx, band)
+                                            for idx, band in izip(indices, bands)))
+    return zip(indices, bands)
+
+
+def save_sig_bands(filename, width, bandwidth, scheme):
+    """Save LSH bands for given parameters to a NumPy .npz file
+
+    :param filename: file name or file object
+    :type filename: str, file
+    """
+    indices, bands = zip(*create_sig_bands(width, bandwidth, scheme))
+    np.savez(filename, params=np.array([width, bandwidth]),
+             scheme=np.array(scheme), indices=np.array(indices, dtype=np.intp),
+             bands=np.array(bands, dtype=np.intp))
+
+
+def load_sig_bands(filename):
+    """Load LSH bands saved with ``save_sig_bands``
+
+    Loaded bands are also stored in the cache used by ``create_sig_bands``,
+    so that signers with the same parameters are created without computing
+    bands again.
+
+    :param filename: file name or file object
+    :type filename: str, file
+    :return: a list of (band index, band) tuples
+    :rtype: list
+    """
+    archive = np.load(filename)
+    try:
+        width, bandwidth = archive['params'].tolist()
+        scheme = str(archive['scheme'])
+        sig_bands = zip(archive['indices'].tolist(),
+                        map(tuple, archive['bands'].tolist()))
+    finally:
+        archive.close()
+    _SIG_BANDS_CACHE[(width, bandwidth, scheme)] = sig_bands
+    return list(sig_bands)
+
+
+def create_sig_selectors(width, bandwidth, scheme):
+    """Generate indices for LSH band selectors
+
+    :param width:
+    :type width: int
+    :param bandwidth:
+    :type bandwidth: int
+    :param scheme:
+    :type scheme: str
+    :return:
+    :rtype: tuple
+
+    """
+    indices, bands = zip(*create_sig_bands(width, bandwidth, scheme))
     return zip(indices, create_getters(bands))
 
 
@@ -297,7 +494,7 @@ class Shingler(object):
     }
 
     def __init__(self, span=3, skip=0, kmin=0, algorithm="standard", unique=True,
-                 tokenizer=None, normalizer=None):
+                 tokenizer=None, normalizer=None, hashed=False):
         """
         :param span: How many words should a shingle span
         :type span: int
@@ -311,8 +508,15 @@ class Shingler(object):
         :type tokenizer: Tokenizer
         :param normalizer: instance of Normalizer class
         :type normalizer: Normalizer
+        :param hashed: whether to return shingles as a NumPy array of 64-bit
+                       hashes instead of tuples of tokens (only supported
+                       by the standard algorithm)
+        :type hashed: bool
 
         """
+        if hashed and algorithm != "standard":
+            raise ValueError("Hashed shingles require standard algorithm")
+        self._hashed = hashed
         self._algorithm = algorithm
         self._shinglify = self._algorithms[algorithm]
         self._span = span
@@ -329,8 +533,9 @@ class Shingler(object):
         :type input_text: collections.Iterable
         :param prefix: an object to prepend to token sequence
         :type prefix: object
-        :return: A set of shingles (tuples)
-        :rtype: set, list
+        :return: A set of shingles (tuples), or an array of shingle hashes
+                 if the shingler was created with ``hashed=True``
+        :rtype: set, list, numpy.ndarray
 
         """
         normalizer = self._normalizer
@@ -350,6 +555,11 @@ class Shingler(object):
             if append_num > 0:
                 tokens = take(token_count + append_num, cycle(tokens))
         final_it = tokens if prefix is None else chain([prefix], tokens)
+        if self._hashed:
+            if not isinstance(final_it, (list, tuple)):
+                final_it = list(final_it)
+            shingles = hash_shingles(final_it, span, skip=self._skip)
+            return np.unique(shingles) if unique else shingles
         shingles = self._shinglify(final_it, span, skip=self._skip)
         result = set(shingles) if unique else list(shingles)
         return result
@@ -417,8 +627,11 @@ class Signature(object):
 class MinHashSignature(Signature):
     """Obtain minhash signature"""
 
+    # whether perturbed signatures can be generated for multi-probe LSH
+    multi_probe = True
+
     def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1,
-                 seed=0, hashfun='metrohash'):
+                 seed=0, hashfun='metrohash', key_format='int'):
         if width % kmin != 0:
             raise ValueError("width must be a multiple of kmin")
         if type(kmin) != int:
@@ -431,11 +644,22 @@ class MinHashSignature(Signature):
             raise ValueError("kmin must be >= 1")
         self.width = width / kmin
         self.kmin = kmin
-        self.hashfun, self.complex_types = HASH_FUNC_TABLE[hashfun]
 
         self.lsh_hasher = lsh_hasher
         self.seed = seed
         self.universe_size = universe_size
+        # used for making keys when signatures are not hashed with LSH
+        self._make_key = get_key_maker(key_format, width)
+
+        if hashfun in HASH_FAMILY_TABLE:
+            family_class, self.hashfun, self.complex_types = \
+                HASH_FAMILY_TABLE[hashfun]
+            self.hash_family = family_class(
+                self.width, universe_size, seed=seed, hashfun=self.hashfun,
+                complex_types=self.complex_types)
+        else:
+            self.hashfun, self.complex_types = HASH_FUNC_TABLE[hashfun]
+            self.hash_family = None
 
         self._sketch_getter = None
         self._simhash_sketcher = None
@@ -491,9 +715,13 @@ class MinHashSignature(Signature):
     def create_hash_functions(self):
         """Return a list of length self.width of different hash functions
         """
+        if self.hash_family is not None:
+            return self.hash_family.create_hash_functions()
         # draw a sample of unique random integers from pool of [0, sys.maxint]
         random.seed(self.seed)
         seeds = random.sample(xrange(sys.maxint), self.width)
+        # used for hashing pre-hashed features
+        self._seeds = np.array(seeds, dtype=np.uint64)
         hash_factory = create_hash_factory(
             self.hashfun,
             complex_types=self.complex_types,
@@ -501,21 +729,53 @@ class MinHashSignature(Signature):
         )
         return map(hash_factory, seeds)
 
+    def _base_hashes(self, vec):
+        """Return base hashes of a feature vector (requires a hash family)
+
+        Feature vectors given as NumPy arrays (for example, by a hashed
+        Shingler) are assumed to be hashed already.
+
+        :rtype: numpy.ndarray
+        """
+        if isinstance(vec, np.ndarray):
+            return vec.astype(np.uint64) if len(vec) > 0 \
+                else np.zeros(1, dtype=np.uint64)
+        # support empty sets by treating them as empty strings
+        features = vec if len(vec) > 0 else [""]
+        if not isinstance(features, (list, tuple)):
+            features = list(features)
+        return self.hash_family.hash_base_many(features)
+
+    def _hash_matrix(self, vec):
+        """Hash a feature vector with every hash function
+
+        :returns: a matrix of shape (width, number of features)
+        :rtype: numpy.ndarray
+        """
+        if self.hash_family is not None:
+            return self.hash_family.permute(self._base_hashes(vec))
+        if isinstance(vec, np.ndarray):
+            base = vec.astype(np.uint64) if len(vec) > 0 \
+                else np.zeros(1, dtype=np.uint64)
+            hashes = mix_hashes_64(base, self._seeds)
+            if self.universe_size is not None:
+                hashes %= np.uint64(self.universe_size)
+            return hashes
+        # support empty sets by treating them as empty strings
+        features = vec if len(vec) > 0 else [""]
+        if not isinstance(features, (list, tuple)):
+            features = list(features)
+        return np.array([map(f, features) for f in self.hashes],
+                        dtype=np.uint64)
+
     def _get_minhashes_kmin1p(self, vec):
         """Returns minhash signature from a feature vector
         :returns: a signature vector
         :rtype: list
         """
-        kmin = self.kmin
-        # Choose k smallest hashes
-        if len(vec) > 0:
-            sig_fun = lambda f: fill_with_last(nsmallest(kmin, imap(f, vec)), kmin)
-        else:
-            # support empty sets by treating them as empty strings
-            sig_fun = lambda f: fill_with_last([f("")], kmin)
-
-        # flatten list of lists
-        return sum(imap(sig_fun, self.hashes), [])
+        # Choose k smallest hashes (computed natively without the GIL)
+        hashes = self._hash_matrix(vec)
+        return bottom_k_minhashes(hashes, self.kmin).ravel().tolist()
 
     def _get_minhashes_kmin1(self, vec):
         """Returns minhash signature from a feature vector
@@ -523,7 +783,9 @@ class MinHashSignature(Signature):
         :rtype: list
         """
         # Choose one minimal hash
-        if len(vec) > 0:
+        if isinstance(vec, np.ndarray):
+            return self._hash_matrix(vec).min(axis=1).tolist()
+        elif len(vec) > 0:
             sig_fun = lambda f: min(imap(f, vec))
         else:
             # support empty sets by treating them as empty strings
@@ -536,16 +798,169 @@ class MinHashSignature(Signature):
         sketch = sum(1 << idx for idx, bit in enumerate(bits) if bit > 0)
         return sketch
 
+    def _get_minhashes_batch(self, vecs):
+        """Returns minhash signatures for a list of feature vectors
+
+        Every feature is hashed only once by the hash family, and minima are
+        then taken over the resulting matrix.
+
+        :returns: a matrix of shape (number of vectors, width * kmin)
+        :rtype: numpy.ndarray
+        """
+        bases = [self._base_hashes(vec) for vec in vecs]
+        lengths = [len(base) for base in bases]
+        hashes = self.hash_family.permute(np.concatenate(bases))
+        offsets = np.cumsum([0] + lengths[:-1])
+        kmin = self.kmin
+        if kmin == 1:
+            minima = np.minimum.reduceat(hashes, offsets, axis=1)
+            return minima.T
+        smallest = bottom_k_minhashes_many(hashes, offsets, kmin)
+        return smallest.reshape(len(vecs), -1)
+
+    def get_minhashes_batch(self, vecs):
+        """Returns raw minhashes for a sequence of feature vectors
+
+        Minhashes are computed in bulk when the signer uses a hash family
+        (see ``get_signatures_batch``).
+
+        :param vecs: feature vectors
+        :type vecs: collections.Iterable
+        :returns: a matrix of shape (number of vectors, width * kmin)
+        :rtype: numpy.ndarray
+        """
+        sig_length = self.width * self.kmin
+        if self.hash_family is None:
+            minhashes = [self._get_minhashes(vec) for vec in vecs]
+            return np.array(minhashes, dtype=np.uint64).reshape(-1, sig_length)
+        chunks = []
+        chunk = []
+        num_features = 0
+        for vec in vecs:
+            chunk.append(vec)
+            num_features += len(vec) or 1
+            if num_features >= BATCH_MAX_FEATURES:
+                chunks.append(self._get_minhashes_batch(chunk))
+                chunk = []
+                num_features = 0
+        if chunk:
+            chunks.append(self._get_minhashes_batch(chunk))
+        if not chunks:
+            return np.empty((0, sig_length), dtype=np.uint64)
+        return np.concatenate(chunks)
+
+    def get_keys_batch(self, minhashes):
+        """Returns integer LSH keys for a matrix of minhashes
+
+        :param minhashes: matrix of shape (number of signatures, width * kmin)
+        :type minhashes: numpy.ndarray
+        :returns: a matrix with one row of keys per signature
+        :rtype: numpy.ndarray
+        """
+        minhashes = np.asarray(minhashes, dtype=np.uint64)
+        lsh = self.lsh_hasher
+        if lsh is None:
+            positions = np.arange(minhashes.shape[1], dtype=np.uint64)
+            return pack_keys(positions, minhashes)
+        return lsh.hash_batch(minhashes)
+
+    def get_signatures_batch(self, vecs, with_sketch=False):
+        """Returns minhash signatures for a sequence of feature vectors
+
+        The output is the same as that of calling ``get_signature`` on every
+        vector. When the signer uses a hash family (for example, when created
+        with ``hashfun="universal"``), the minhashes are computed in bulk using
+        vectorized operations. Otherwise vectors are signed one by one.
+
+        :param vecs: feature vectors to sign
+        :type vecs: collections.Iterable
+        :returns: a list of signature vectors (or of tuples containing a
+                  signature vector and a sketch if ``with_sketch`` is set)
+        :rtype: list
+        """
+        if self.hash_family is None:
+            return [self.get_signature(vec, with_sketch=with_sketch)
+                    for vec in vecs]
+        return [self._signature_from_minhashes(minhashes, with_sketch)
+                for minhashes in self.get_minhashes_batch(vecs).tolist()]
+
+    def get_minhashes(self, vec):
+        """Returns raw minhashes from a feature vector (before LSH)
+
+        :returns: a vector of length ``width * kmin``
+        :rtype: list
+        """
+        return self._get_minhashes(vec)
+
+    def get_minhashes_with_probes(self, vec, num_probes):
+        """Returns raw minhashes from a feature vector along with
+        perturbations of them for multi-probe LSH
+
+        A perturbation replaces the largest of the ``kmin`` minhashes of one
+        hash function with the next smallest hash value of that function
+        (found in the same bottom-``(kmin + 1)`` pass). The smaller the gap
+        between the two values, the more likely a similar document is to have
+        the runner-up value in place of the minhash, so perturbations with
+        the smallest gaps are returned first.
+
+        :param num_probes: maximum number of perturbations to return
+        :type num_probes: int
+        :returns: a tuple of raw minhashes (same as ``get_minhashes``) and a
+                  list of (signature position, replacement value) tuples
+        :rtype: tuple
+        """
+        if not self.multi_probe:
+            raise ValueError("%s does not support multi-probe LSH"
+                             % self.__class__.__name__)
+        kmin = self.kmin
+        smallest = bottom_k_minhashes(self._hash_matrix(vec), kmin + 1)
+        minhashes = smallest[:, :kmin].ravel().tolist()
+        gaps = smallest[:, kmin] - smallest[:, kmin - 1]
+        # hash functions without a distinct runner-up can't be perturbed
+        funcs = np.flatnonzero(gaps)
+        funcs = funcs[np.argsort(gaps[funcs], kind='mergesort')[:num_probes]]
+        runners_up = smallest[funcs, kmin].tolist()
+        perturbations = [(func * kmin + kmin - 1, value)
+                         for func, value in izip(funcs.tolist(), runners_up)]
+        return minhashes, perturbations
+
+    def get_probe_keys(self, minhashes, perturbations):
+        """Returns LSH keys of perturbed signatures
+
+        Only keys of bands covering a perturbed position are returned, since
+        the remaining ones are the same as those of the original signature.
+
+        :param minhashes: raw minhashes
+        :type minhashes: list
+        :param perturbations: (signature position, replacement value) tuples
+                              (see ``get_minhashes_with_probes``)
+        :type perturbations: list
+        :rtype: list
+        """
+        lsh = self.lsh_hasher
+        if not perturbations:
+            return []
+        elif lsh is None:
+            make_key = self._make_key
+            return [make_key(pos, value) for pos, value in perturbations]
+        return lsh.hash_probes(minhashes, perturbations)
+
     def get_signature(self, vec, with_sketch=False):
         """Returns minhash signature from a feature vector (with optional LSH)
 
         :returns: a signature vector
         :rtype: list
         """
-        minhashes = self._get_minhashes(vec)
+        return self._signature_from_minhashes(
+            self._get_minhashes(vec), with_sketch)
+
+    def _signature_from_minhashes(self, minhashes, with_sketch=False):
+        """Turn minhashes into a signature vector (with optional LSH)
+        """
         lsh = self.lsh_hasher
         if lsh is None:
-            sig_vector = ["{}:{}".format(idx, minhash)
+            make_key = self._make_key
+            sig_vector = [make_key(idx, minhash)
                           for idx, minhash in enumerate(minhashes)]
         else:
             sig_vector = list(lsh.hash(minhashes))
@@ -584,6 +999,271 @@ class MinHashSketchSignature(MinHashSignature):
         return self._minhash_sketch(minhash_sample)
 
 
+class SingleHashSignature(MinHashSignature):
+    """Base class for signatures that hash every feature only once
+
+    Subclasses derive the whole signature from a vector of base hashes (see
+    ``_base_hashes``) instead of evaluating ``width`` hash functions, and so
+    do not support multi-probe LSH.
+    """
+
+    multi_probe = False
+
+    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1,
+                 seed=0, hashfun='metrohash', key_format='int'):
+        if kmin != 1:
+            raise ValueError("%s requires kmin=1" % self.__class__.__name__)
+        MinHashSignature.__init__(self, width, lsh_hasher=lsh_hasher,
+                                  universe_size=universe_size, kmin=kmin,
+                                  seed=seed, hashfun=hashfun,
+                                  key_format=key_format)
+        # only the base hash function of a family is used
+        self.hash_family = None
+
+    def create_hash_functions(self):
+        """Signatures derived from base hashes use a single hash function
+        """
+        random.seed(self.seed)
+        # used for hashing pre-hashed features
+        self._seeds = np.array([random.randint(0, sys.maxint)],
+                               dtype=np.uint64)
+        return []
+
+    def _base_hashes(self, vec):
+        """Hash every feature of a vector once
+
+        :rtype: numpy.ndarray
+        """
+        if isinstance(vec, np.ndarray):
+            base = vec.astype(np.uint64) if len(vec) > 0 \
+                else np.zeros(1, dtype=np.uint64)
+            return mix_hashes_64(base, self._seeds)[0]
+        # support empty sets by treating them as empty strings
+        features = vec if len(vec) > 0 else [""]
+        if not self.complex_types:
+            features = imap(hashable, features)
+        hashfun = self.hashfun
+        seed = self.seed
+        return np.fromiter((hashfun(feature, seed) for feature in features),
+                           dtype=np.uint64, count=len(vec) or 1)
+
+
+class OnePermutationSignature(SingleHashSignature):
+    """Obtain minhash signature using one-permutation hashing
+
+    Instead of evaluating ``width`` hash functions per feature, every feature
+    is hashed once and assigned to one of ``width`` bins, keeping the minimum
+    hash in each bin. Bins that receive no features are filled by optimal
+    densification, so that the probability of two signatures agreeing at any
+    position still equals the Jaccard similarity of the underlying sets.
+
+    Signatures can be used wherever signatures produced by
+    ``MinHashSignature`` can (with ``kmin`` fixed at 1).
+
+    >>> signer = OnePermutationSignature(
+    ...     12, lsh_hasher=LSHC(3, width=12, scheme="a0"))
+    >>> sig = signer.get_signature(set(["ab", "bc", "cd"]))
+    >>> len(sig)
+    4
+    """
+
+    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1,
+                 seed=0, hashfun='metrohash', key_format='int'):
+        SingleHashSignature.__init__(self, width, lsh_hasher=lsh_hasher,
+                                     universe_size=universe_size, kmin=kmin,
+                                     seed=seed, hashfun=hashfun,
+                                     key_format=key_format)
+        self._get_minhashes = self._get_minhashes_oph
+
+    def _get_minhashes_oph(self, vec):
+        """Returns densified one-permutation minhashes from a feature vector
+        :returns: a signature vector
+        :rtype: list
+        """
+        minhashes = one_permutation_minhashes(
+            self._base_hashes(vec), self.width, self.seed)
+        if self.universe_size is not None:
+            minhashes %= np.uint64(self.universe_size)
+        return minhashes.tolist()
+
+
+class WeightedMinHashSignature(SingleHashSignature):
+    """Obtain weighted minhash signature using Improved Consistent Weighted
+    Sampling (Ioffe, 2010)
+
+    The probability of two signatures agreeing at any position equals the
+    weighted Jaccard similarity of the underlying feature vectors (the sum of
+    element-wise minima of weights over the sum of element-wise maxima).
+    Feature vectors can be given as mappings of features to positive weights,
+    or as sequences in which features are weighted by their number of
+    occurrences (such as non-unique output of ``Shingler``), in which case
+    there is no need to pad short inputs with ``kmin``.
+
+    Random variables of the sampling scheme are derived from base hashes of
+    features, and samples for all signature positions are computed at once
+    with vectorized NumPy operations.
+
+    >>> signer = WeightedMinHashSignature(
+    ...     12, lsh_hasher=LSHC(3, width=12, scheme="a0"))
+    >>> signer.get_signature({"ab": 2.0, "bc": 1.0}) == \\
+    ...     signer.get_signature(["ab", "bc", "ab"])
+    True
+    """
+
+    # number of uniform random variables per feature per signature position
+    _NUM_UNIFORMS = 5
+
+    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1,
+                 seed=0, hashfun='metrohash', key_format='int'):
+        SingleHashSignature.__init__(self, width, lsh_hasher=lsh_hasher,
+                                     universe_size=universe_size, kmin=kmin,
+                                     seed=seed, hashfun=hashfun,
+                                     key_format=key_format)
+        random.seed(seed)
+        self._sample_seeds = np.array(
+            [random.getrandbits(64)
+             for _ in xrange(self._NUM_UNIFORMS * self.width)],
+            dtype=np.uint64)
+        self._get_minhashes = self._get_minhashes_weighted
+
+    @staticmethod
+    def _feature_weights(vec):
+        """Return features of a vector and their weights
+
+        :returns: a tuple of features and an array of positive weights
+        :rtype: tuple
+        """
+        if isinstance(vec, collections.Mapping):
+            items = [(feature, weight) for feature, weight in vec.iteritems()
+                     if weight > 0]
+            features = [feature for feature, _ in items]
+            weights = np.array([weight for _, weight in items],
+                               dtype=np.float64)
+        elif isinstance(vec, np.ndarray):
+            features, counts = np.unique(vec, return_counts=True)
+            weights = counts.astype(np.float64)
+        else:
+            counts = collections.Counter(vec)
+            features = counts.keys()
+            weights = np.array(counts.values(), dtype=np.float64)
+        if len(weights) == 0:
+            # support empty sets by treating them as empty strings
+            features = [""]
+            weights = np.ones(1, dtype=np.float64)
+        return features, weights
+
+    def _get_minhashes_weighted(self, vec):
+        """Returns weighted minhashes from a feature vector
+        :returns: a signature vector
+        :rtype: list
+        """
+        features, weights = self._feature_weights(vec)
+        base = self._base_hashes(features)
+        width = self.width
+
+        # uniform random variables in (0, 1) from top 53 bits of mixed hashes
+        uniforms = (mix_hashes_64(base, self._sample_seeds) >>
+                    np.uint64(11)).astype(np.float64)
+        uniforms += 0.5
+        uniforms *= 2.0 ** -53
+        uniforms = uniforms.reshape(self._NUM_UNIFORMS, width, len(base))
+
+        # r, c ~ Gamma(2, 1), beta ~ Uniform(0, 1)
+        r = -np.log(uniforms[0] * uniforms[1])
+        log_c = np.log(-np.log(uniforms[2] * uniforms[3]))
+        beta = uniforms[4]
+        t = np.floor(np.log(weights) / r + beta)
+        # log(a) where a = c / (y * exp(r)) and y = exp(r * (t - beta))
+        log_a = log_c - r * (t - beta) - r
+
+        selected = log_a.argmin(axis=1)
+        positions = np.arange(width)
+        sampled_t = t[positions, selected].astype(np.int64).view(np.uint64)
+        minhashes = [hash_combine_murmur_64(feature, sample)
+                     for feature, sample
+                     in izip(base[selected].tolist(), sampled_t.tolist())]
+        if self.universe_size is not None:
+            universe_size = self.universe_size
+            minhashes = [minhash % universe_size for minhash in minhashes]
+        return minhashes
+
+
+# Signature types that can be selected by name (e.g. from configuration)
+SIGNATURE_TABLE = {
+    "minhash":  MinHashSignature,
+    "oph":      OnePermutationSignature,
+    "weighted": WeightedMinHashSignature,
+}
+
+
+class TextSigner(object):
+    """Fused tokenizer, shingler, and minhash signer for raw text
+
+    Gives the same signatures as tokenizing text with ``tokenizer``,
+    shingling tokens with ``Shingler(span, skip, hashed=True)``, and signing
+    shingles with ``signer``, but tokenizes and hashes shingles in a single
+    native pass without creating intermediate token or shingle objects.
+
+    >>> signer = MinHashSignature(12, lsh_hasher=LSHC(3, width=12, scheme="a0"))
+    >>> text_signer = TextSigner(signer)
+    >>> shingler = Shingler(span=3, tokenizer=RegexTokenizer(), hashed=True)
+    >>> text = u"the quick brown fox jumps over the lazy dog"
+    >>> shingles = shingler.get_shingles(text)
+    >>> text_signer.get_signature(text) == signer.get_signature(shingles)
+    True
+    """
+    def __init__(self, signer, span=3, skip=0, tokenizer=None):
+        """
+        :param signer: signer to use
+        :type signer: MinHashSignature
+        :param span: How many words should a shingle span
+        :type span: int
+        :param skip: How many words should a shingle skip
+        :type skip: int
+        :param tokenizer: a RegexTokenizer instance (its pattern must be of
+                          form ``X+`` where ``X`` matches one character)
+        :type tokenizer: lsh_hdc.preprocess.RegexTokenizer
+        """
+        if tokenizer is None:
+            tokenizer = RegexTokenizer()
+        self.signer = signer
+        self._span = span
+        self._skip = skip
+        self._char_table = tokenizer.get_char_table()
+
+    def get_shingles(self, text, prefix=None):
+        """Return a deduplicated array of shingle hashes from a text
+
+        :rtype: numpy.ndarray
+        """
+        return np.unique(hash_text_shingles(
+            text, self._char_table, self._span, self._skip, prefix))
+
+    def get_signature(self, text, prefix=None, with_sketch=False):
+        """Return signature of a text (see ``MinHashSignature.get_signature``)
+        """
+        return self.signer.get_signature(self.get_shingles(text, prefix),
+                                         with_sketch=with_sketch)
+
+    def get_keys_batch(self, texts, prefixes=None):
+        """Return integer LSH keys for a sequence of texts
+
+        :param texts: input texts
+        :type texts: collections.Iterable
+        :param prefixes: an optional sequence of prefixes (one per text)
+        :type prefixes: collections.Iterable
+        :returns: a matrix with one row of keys per text
+        :rtype: numpy.ndarray
+        """
+        if prefixes is None:
+            shingles = [self.get_shingles(text) for text in texts]
+        else:
+            shingles = [self.get_shingles(text, prefix)
+                        for text, prefix in izip(texts, prefixes)]
+        signer = self.signer
+        return signer.get_keys_batch(signer.get_minhashes_batch(shingles))
+
+
 class SimHashSignature(Signature):
 
     def __init__(self, bit_depth=64, seed=0, hashfun_map=((64, chash64), (128, chash128))):
@@ -619,6 +1299,45 @@ class SimHashSignature(Signature):
         :rtype: long
         :raises: OverflowError
         """
+        return self._sig_with_weights(*self._hash_features(tokens, features))
+
+    def get_signatures_batch(self, docs):
+        """SimHash signatures of a sequence of word vectors
+
+        Gives the same result as calling ``get_signature`` on every vector,
+        but unpacks feature bits for all vectors at once.
+
+        :param docs: vectors of length-weighted tokens
+        :type docs: collections.Iterable
+        :return: a list of SimHash signatures
+        :rtype: list
+        """
+        all_features = []
+        all_weights = []
+        lengths = []
+        for tokens in docs:
+            hashed_features, feature_weights = self._hash_features(tokens)
+            pairs = zip(hashed_features, feature_weights)
+            lengths.append(len(pairs))
+            all_features.extend(feature for feature, _ in pairs)
+            all_weights.extend(log1p(weight) for _, weight in pairs)
+        bits = self._feature_bits(all_features)
+        weights = np.array(all_weights, dtype=np.float64)
+        result = []
+        start = 0
+        for length in lengths:
+            stop = start + length
+            result.append(self._vote(bits[start:stop], weights[start:stop]))
+            start = stop
+        return result
+
+    def _hash_features(self, tokens, features=()):
+        """Return hashed features and their weights
+
+        :returns: a tuple of iterables of hashed features and of their
+                  (unscaled) weights
+        :rtype: tuple
+        """
         hashfun = self.hashfun
         seed = self.seed
         token_weights = (log1p(sum(imap(len, token))) for token in tokens)
@@ -630,7 +1349,51 @@ class SimHashSignature(Signature):
         else:
             fin_features = (hashfun(feature, seed) for feature in tokens)
             fin_weights = token_weights
-        return self._sig_with_weights(fin_features, fin_weights)
+        return fin_features, fin_weights
+
+    def _feature_bits(self, hashed_features):
+        """Unpack hashed features into a boolean matrix
+
+        Features are reduced modulo 2 ** bit_depth and split into 64-bit words
+        before being unpacked.
+
+        :param hashed_features: a list of hashed features
+        :type hashed_features: list
+        :returns: matrix of shape (number of features, bit_depth) where
+                  element (j, i) is bit i of feature j
+        :rtype: numpy.ndarray
+        """
+        bit_depth = len(self.bits)
+        mod_base = 1 << bit_depth
+        num_words = (bit_depth + 63) // 64
+        reduced = [feature % mod_base for feature in hashed_features]
+        if num_words == 1:
+            words = np.array(reduced, dtype=np.uint64).reshape(-1, 1)
+        else:
+            mask = (1 << 64) - 1
+            words = np.array([[(feature >> (64 * k)) & mask
+                               for k in xrange(num_words)]
+                              for feature in reduced],
+                             dtype=np.uint64).reshape(-1, num_words)
+        shifts = np.arange(64, dtype=np.uint64)
+        bits = (words[:, :, None] >> shifts) & np.uint64(1)
+        bits = bits.reshape(len(words), num_words * 64)
+        return bits[:, :bit_depth].astype(bool)
+
+    @staticmethod
+    def _vote(bits, scaled_weights):
+        """Compute SimHash signature from feature bits and scaled weights
+
+        Votes are accumulated sequentially over features (as opposed to
+        pairwise summation), so the result is exactly the same as that of
+        adding weights up one feature at a time.
+        """
+        if not len(bits):
+            return 0
+        weights = scaled_weights[:, None]
+        votes = np.where(bits, weights, -weights)
+        totals = np.add.accumulate(votes, axis=0)[-1]
+        return sum(1 << int(i) for i in np.flatnonzero(totals > 0))
 
     def _sig_with_weights(self, hashed_features, feature_weights):
         """SimHash signature from a list of hashes and corresponding weights
@@ -641,19 +1404,11 @@ class SimHashSignature(Signature):
                                 meaning feature not considered)
         :type feature_weights: collections.Iterable
         """
-        bits = self.bits
-        bit_depth = len(bits)
-        mod_base = 1 << bit_depth
-        vec = [0] * bit_depth
-        for feature, weight in izip(hashed_features, feature_weights):
-            scaled_weight = log1p(weight)
-            mod_feature = feature % mod_base
-            for i in bits:
-                if mod_feature & (1 << i):
-                    vec[i] += scaled_weight
-                else:
-                    vec[i] -= scaled_weight
-        return sum(1 << i for i in bits if vec[i] > 0)
+        pairs = zip(hashed_features, feature_weights)
+        bits = self._feature_bits([feature for feature, _ in pairs])
+        weights = np.array([log1p(weight) for _, weight in pairs],
+                           dtype=np.float64)
+        return self._vote(bits, weights)
 
 
 class LSHC(object):
@@ -661,7 +1416,8 @@ class LSHC(object):
 
     Use a banding approach to hash similar signatures to the same buckets.
     """
-    def __init__(self, bandwidth, width, scheme="a1", seed=0):
+    def __init__(self, bandwidth, width, scheme="a1", seed=0, key_format="int",
+                 combine_mode="polynomial"):
         """
         :param bandwidth: Band size
         :type bandwidth: int
@@ -671,16 +1427,32 @@ class LSHC(object):
                 When following number is zero, get non-overlapping bands.
                 When following number is equal to bandwidth, get all possible combinations
         :type scheme: str
+        :param key_format: Format of emitted keys: "int" for 64-bit integers
+                           packing band index and band hash, or "str" for
+                           strings of form "band_index:band_hash"
+        :type key_format: str
+        :param combine_mode: How band values are combined into a band hash:
+                             "polynomial" or "murmur" (see ``PHashCombiner``)
+        :type combine_mode: str
         """
-        self.selectors = create_sig_selectors(width, bandwidth, scheme)
-        self.combiner = HashCombiner(bandwidth)
+        self.bandwidth = bandwidth
+        self.width = width
+        indices, bands = zip(*create_sig_bands(width, bandwidth, scheme))
+        self.selectors = zip(indices, create_getters(bands))
+        self.combiner = HashCombiner(bandwidth, mode=combine_mode)
+        self.key_format = key_format
+        self._make_key = get_key_maker(key_format, len(self.selectors))
+
+        # index arrays for hashing signatures in batches
+        self._band_prefixes = np.array(indices, dtype=np.uint64)
+        self._band_matrix = np.array(bands, dtype=np.intp)
 
     def hash(self, sig):
         """Get combinatorial sketches from a signature
 
         :param sig: signature to process
         :type sig: collections.Iterable
-        :return: 64-bit hash digest
+        :return: LSH keys (one per band)
         :rtype: collections.Iterable
 
         Note: we use XOR-ing because it seems to be the fastest way to combine
@@ -694,5 +1466,58 @@ class LSHC(object):
         """
         list_sig = sig if isinstance(sig, list) else list(sig)
         hash_combine = self.combiner.combine
+        make_key = self._make_key
         for prefix, selector in self.selectors:
-            yield '{}:{}'.format(prefix, hash_combine(selector(list_sig)))
+            yield make_key(prefix, hash_combine(selector(list_sig)))
+
+    def hash_batch(self, sigs):
+        """Get LSH keys for a matrix of signatures
+
+        Gives the same keys as ``hash`` (in integer format), but processes
+        multiple signatures at once using vectorized operations.
+
+        :param sigs: signature matrix of shape (number of signatures, width)
+        :type sigs: numpy.ndarray
+        :return: key matrix of shape (number of signatures, number of bands)
+        :rtype: numpy.ndarray
+        """
+        if self.key_format != "int":
+            raise ValueError("Batch hashing requires integer key format")
+        sigs = np.asarray(sigs, dtype=np.uint64)
+        if sigs.ndim != 2 or sigs.shape[1] != self.width:
+            raise ValueError("Expected a matrix with %d columns" % self.width)
+        band_matrix = self._band_matrix
+        # gather band values into rows of shape (bandwidth,) and combine them
+        # all in one native pass
+        band_values = sigs[:, band_matrix].reshape(-1, band_matrix.shape[1])
+        band_hashes = self.combiner.combine_many(band_values)
+        return pack_keys(self._band_prefixes,
+                         band_hashes.reshape(len(sigs), len(band_matrix)))
+
+    def hash_probes(self, sig, perturbations):
+        """Get LSH keys of perturbed copies of a signature
+
+        Each perturbation replaces one signature position with a new value.
+        Only keys of bands covering the perturbed position are returned,
+        since the remaining ones are the same as those of ``sig``.
+
+        :param sig: signature to perturb
+        :type sig: collections.Iterable
+        :param perturbations: (signature position, replacement value) tuples
+        :type perturbations: list
+        :return: keys of perturbed bands, in order of perturbations
+        :rtype: list
+        """
+        if not perturbations:
+            return []
+        positions, values = zip(*perturbations)
+        positions = np.array(positions, dtype=np.intp)
+        sigs = np.tile(np.asarray(sig, dtype=np.uint64), (len(positions), 1))
+        sigs[np.arange(len(positions)), positions] = values
+        if self.key_format == "int":
+            keys = self.hash_batch(sigs)
+        else:
+            keys = np.array([list(self.hash(row)) for row in sigs.tolist()],
+                            dtype=object)
+        covered = (self._band_matrix == positions[:, None, None]).any(axis=2)
+        return keys[covered].tolist()
@@ -0,0 +1,235 @@
+"""
+Compact storage for LSH buckets
+"""
+
+from array import array
+from heapq import nsmallest
+from collections import Counter
+from operator import itemgetter
+
+
+class BucketIndex(object):
+    """A mapping of LSH keys to buckets of integer document ids
+
+    Buckets holding a single member (the majority of buckets in practice) are
+    stored as plain integers, and larger buckets are stored as growable arrays
+    of 32-bit integers. This avoids allocating a container for every bucket
+    and keeps the per-member cost at four bytes.
+
+    >>> index = BucketIndex()
+    >>> index.add(42, 0)
+    (0,)
+    >>> list(index.add(42, 1))
+    [0, 1]
+    >>> list(index.add(42, 1))
+    [0, 1]
+    >>> len(index)
+    1
+    """
+
+    def __init__(self, typecode='i', max_size=None, track_access=False,
+                 hot_size=None):
+        """
+        :param typecode: array type code to use for storing document ids
+        :type typecode: str
+        :param max_size: maximum bucket size (when exceeded, oldest members
+                         are dropped from a bucket)
+        :type max_size: int
+        :param track_access: whether to remember when each bucket was last
+                             added to (required for evicting buckets)
+        :type track_access: bool
+        :param hot_size: bucket size at which a bucket is considered hot (hot
+                         buckets stop growing, and only a sample of their
+                         members is returned on insertion)
+        :type hot_size: int
+        """
+        self._typecode = typecode
+        self._buckets = {}
+        self._max_size = max_size
+        self._touched = {} if track_access else None
+        self._hot_size = hot_size
+        self._hot_hits = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, key):
+        return key in self._buckets
+
+    def __iter__(self):
+        return iter(self._buckets)
+
+    def get(self, key, sample=None):
+        """Return members of a bucket
+
+        :param key: LSH key
+        :param sample: number of members to return if bucket is hot (all if
+                       None)
+        :type sample: int
+        :returns: a sequence of document ids (empty if no such bucket)
+        :rtype: collections.Sequence
+        """
+        members = self._buckets.get(key)
+        if members is None:
+            return ()
+        elif isinstance(members, array):
+            hot_size = self._hot_size
+            if sample is not None and hot_size is not None and \
+                    len(members) >= hot_size:
+                return members[:sample]
+            return members
+        else:
+            return (members,)
+
+    def add(self, key, member, unique=True, tick=None, sample=1):
+        """Add a document id to a bucket
+
+        :param key: LSH key
+        :param member: document id
+        :type member: int
+        :param unique: whether to check if the bucket already contains the
+                       member (pass False when the member is known to be new)
+        :type unique: bool
+        :param tick: logical time of insertion (used for bucket eviction)
+        :type tick: int
+        :param sample: number of members to return if bucket is hot (the
+                       first one being the canonical member of the bucket)
+        :type sample: int
+        :returns: bucket members after insertion (or a sample of members
+                  if the bucket is hot, in which case no insertion is done)
+        :rtype: collections.Sequence
+        """
+        if self._touched is not None:
+            self._touched[key] = tick
+        buckets = self._buckets
+        members = buckets.get(key)
+        if members is None:
+            buckets[key] = member
+            return (member,)
+        elif isinstance(members, array):
+            hot_size = self._hot_size
+            if hot_size is not None and len(members) >= hot_size:
+                self._hot_hits += 1
+                return members[:sample]
+            if not (unique and member in members):
+                members.append(member)
+                max_size = self._max_size
+                if max_size is not None and len(members) > max_size:
+                    del members[:len(members) - max_size]
+            return members
+        elif unique and members == member:
+            return (member,)
+        elif self._max_size == 1:
+            buckets[key] = member
+            return (member,)
+        else:
+            members = array(self._typecode, [members, member])
+            buckets[key] = members
+            return members
+
+    def stats(self):
+        """Return bucket size statistics
+
+        :returns: a dictionary containing number of buckets, total number of
+                  members, mean and maximum bucket size, number of hot
+                  buckets, number of insertions into hot buckets (which were
+                  short-circuited), and a histogram of bucket sizes binned by
+                  powers of two (bin ``n`` counts buckets with sizes in the
+                  range ``[2 ** (n - 1), 2 ** n)``)
+        :rtype: dict
+
+        >>> index = BucketIndex(hot_size=2)
+        >>> _ = [index.add(1, i) for i in range(3)] + [index.add(2, 0)]
+        >>> stats = index.stats()
+        >>> stats['max_size'], stats['hot_buckets'], stats['hot_hits']
+        (2, 1, 1)
+        >>> sorted(stats['histogram'].items())
+        [(1, 1), (2, 1)]
+        """
+        histogram = Counter()
+        num_members = 0
+        max_size = 0
+        hot_size = self._hot_size
+        num_hot = 0
+        for members in self._buckets.itervalues():
+            size = len(members) if isinstance(members, array) else 1
+            histogram[size.bit_length()] += 1
+            num_members += size
+            if size > max_size:
+                max_size = size
+            if hot_size is not None and size >= hot_size:
+                num_hot += 1
+        num_buckets = len(self._buckets)
+        return {
+            'buckets': num_buckets,
+            'members': num_members,
+            'mean_size': float(num_members) / num_buckets if num_buckets else 0.0,
+            'max_size': max_size,
+            'hot_buckets': num_hot,
+            'hot_hits': self._hot_hits,
+            'histogram': dict(histogram),
+        }
+
+    def iteritems(self):
+        """Generate (key, members) pairs
+        """
+        get = self.get
+        for key in self._buckets:
+            yield key, get(key)
+
+    def _remove(self, key):
+        del self._buckets[key]
+        if self._touched is not None:
+            del self._touched[key]
+
+    def evict_stale(self, min_tick):
+        """Remove buckets that were not added to since a given time
+
+        :param min_tick: buckets last touched before this time are removed
+        :type min_tick: int
+        :returns: number of buckets removed
+        :rtype: int
+        """
+        stale = [key for key, tick in self._touched.iteritems()
+                 if tick < min_tick]
+        for key in stale:
+            self._remove(key)
+        return len(stale)
+
+    def evict_lru(self, max_buckets):
+        """Remove least recently used buckets until at most max_buckets remain
+
+        :param max_buckets: number of buckets to keep
+        :type max_buckets: int
+        :returns: number of buckets removed
+        :rtype: int
+        """
+        num_excess = len(self._buckets) - max_buckets
+        if num_excess <= 0:
+            return 0
+        lru = nsmallest(num_excess, self._touched.iteritems(), key=itemgetter(1))
+        for key, _ in lru:
+            self._remove(key)
+        return len(lru)
+
+    def remap(self, mapping):
+        """Renumber bucket members, dropping buckets left empty
+
+        :param mapping: a sequence mapping old ids to new ones, with negative
+                        values for ids that should be dropped
+        :type mapping: collections.Sequence
+        """
+        typecode = self._typecode
+        buckets = self._buckets
+        for key, members in buckets.items():
+            if isinstance(members, array):
+                remapped = [mapping[member] for member in members]
+                remapped = [member for member in remapped if member >= 0]
+            else:
+                remapped = [mapping[members]] if mapping[members] >= 0 else []
+            if not remapped:
+                self._remove(key)
+            elif len(remapped) == 1:
+                buckets[key] = remapped[0]
+            else:
+                buckets[key] = array(typecode, remapped)
@@ -1,13 +1,21 @@
 import operator
+import numpy as np
 from math import floor
 from functools import partial
-from itertools import imap
-from collections import defaultdict, Counter
-from pymaptools.unionfind import UnionFind
+from itertools import imap, islice, izip, chain
+from multiprocessing import Pool
+from array import array
+from collections import Counter, deque
 from pymaptools.bitwise import hamming
+from metrohash import metrohash128
 from lsh_hdc.preprocess import RegexTokenizer
+from lsh_hdc.unionfind import UnionFind
+from lsh_hdc.buckets import BucketIndex
+from lsh_hdc.index import LSHIndex
+from lsh_hdc.utils import LRUCache
+from lsh_hdc.ext import hashable
 from lsh_hdc import Shingler, SimHashSignature, MinHashSketchSignature, \
-    MinHashSignature, LSHC
+    SIGNATURE_TABLE, LSHC
 from logging import getLogger
 
 LOG = getLogger(__name__)
@@ -17,6 +25,52 @@ OPERATOR_MAP = {
     'or': operator.__or__
 }
 
+# Maximum number of input chunks per worker process submitted for mapping
+# but not yet consumed
+MAX_CHUNKS_PER_WORKER = 2
+
+# Fraction of buckets evicted in addition to the excess when the maximum
+# number of buckets is exceeded
+LRU_EVICT_FRACTION = 0.1
+
+# Rows of blocks emitted by HDClustering.batch_mapper
+KEY_BLOCK_DTYPE = np.dtype([('key', np.uint64),
+                            ('doc_id', np.int64),
+                            ('sketch', np.uint64)])
+
+# Rows of edges emitted by HDClustering.batch_reducer
+EDGE_DTYPE = np.dtype([('doc_id', np.int64),
+                       ('other_id', np.int64),
+                       ('support', np.int32)])
+
+
+def _bucket_pairs(size, hot_size=None, sample=1):
+    """Return positions of pairs of bucket members to compare
+
+    All pairs among the first ``hot_size`` members are returned, and every
+    further member is paired with the first ``sample`` members only.
+
+    :returns: a tuple of arrays of positions of earlier and later members
+    :rtype: tuple
+    """
+    full = size if hot_size is None else min(size, hot_size)
+    first, second = np.triu_indices(full, 1)
+    if full < size:
+        sample = min(sample, full)
+        first = np.concatenate((first, np.tile(np.arange(sample), size - full)))
+        second = np.concatenate((second, np.repeat(np.arange(full, size),
+                                                   sample)))
+    return first, second
+
+
+def _hamming_many(sketches, other_sketches):
+    """Return Hamming distances between two arrays of 64-bit sketches
+
+    :rtype: numpy.ndarray
+    """
+    xored = np.bitwise_xor(sketches, other_sketches)
+    return np.unpackbits(xored.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
 
 class Cluster(object):
     """Clusters sets with Jaccard similarity above threshold with high
@@ -26,18 +80,68 @@ class Cluster(object):
     1. Generate set signature
     2. Use LSH to map similar signatures to same buckets
     3. Use UnionFind to merge buckets containing same values
+
+    For clustering unbounded streams, memory use can be bounded by capping
+    bucket sizes (``max_bucket_size``), by evicting buckets not added to
+    within the last ``window`` items, and by evicting least recently used
+    buckets once there are more than ``max_buckets`` of them. Eviction never
+    undoes merges already made. Calling ``flush`` periodically emits finished
+    clusters and frees memory used by their members.
+
+    To avoid quadratic insertion cost when many items share an LSH key (e.g.
+    boilerplate or empty content), buckets reaching ``hot_bucket_size`` are
+    switched to a representative-only mode: they stop growing, and new items
+    are matched only against the first member of the bucket (or against its
+    first ``hot_sample_size`` members when ``min_support`` is greater than
+    one).
+
+    When ``dedupe`` is set, items whose LSH keys and sketch are identical to
+    those of an earlier item (exact duplicates) are merged with the first such
+    item directly and are not inserted into buckets. The number of items
+    handled this way is kept in ``duplicates_collapsed``.
+
+    Setting ``num_probes`` enables multi-probe LSH (requires a signer with
+    ``multi_probe`` set, such as ``MinHashSignature``): besides its own keys,
+    every item looks up keys of up to ``num_probes`` perturbed signatures
+    (see ``MinHashSignature.get_minhashes_with_probes``). Probe keys are not
+    added to buckets, but items found under them count towards support.
+    This gives recall similar to that of a larger number of bands while
+    storing fewer keys.
     """
     def __init__(self, signer=None, sketch_dist_fn=None, max_dist=0,
                  min_support=1, sketch_operator=operator.__and__,
-                 sketch_bits=0):
+                 sketch_bits=0, max_bucket_size=None, max_buckets=None,
+                 window=None, hot_bucket_size=None, hot_sample_size=8,
+                 dedupe=False, num_probes=0):
+        if num_probes and not getattr(signer, 'multi_probe', False):
+            raise ValueError("Multi-probe LSH requires a minhash signer")
         self.union_find = UnionFind()
         self.signer = signer
-        self.buckets = defaultdict(dict)
+        self.buckets = BucketIndex(
+            max_size=max_bucket_size,
+            track_access=(window is not None or max_buckets is not None),
+            hot_size=hot_bucket_size)
         self.sketch_dist_fn = sketch_dist_fn
         self.sketch_bits = sketch_bits
         self.max_dist = max_dist
         self.min_support = min_support
         self.sketch_operator = sketch_operator
+        self.max_buckets = max_buckets
+        self.window = window
+        self.num_probes = num_probes
+        # when counting support, hot buckets must return more than one member
+        self._hot_sample_size = 1 if min_support <= 1 else hot_sample_size
+
+        # buckets store integer ids (interned by union_find); these map ids
+        # to sketches
+        self._sketches = []
+        # logical time (number of items added) and time each id was last seen
+        self._tick = 0
+        self._last_seen = array('l')
+
+        # maps digests of (keys, sketch) tuples to ids of first occurrences
+        self._digests = {} if dedupe else None
+        self.duplicates_collapsed = 0
 
     def _closeness_measure(self, sketch):
         min_support = self.min_support
@@ -52,33 +156,89 @@ class Cluster(object):
                 logical_op(support >= min_support,
                            distance_from(matched_sketch) <= max_dist)
 
+    def _register(self, label, sketch):
+        """Get integer id for a label (creating one if needed)
+
+        :returns: a tuple of id and a flag indicating whether id is new
+        :rtype: tuple
+        """
+        union_find = self.union_find
+        num_ids = len(union_find)
+        doc_id = union_find.add(label)
+        if doc_id == num_ids:
+            self._sketches.append(sketch)
+            self._last_seen.append(self._tick)
+            return doc_id, True
+        else:
+            self._sketches[doc_id] = sketch
+            self._last_seen[doc_id] = self._tick
+            return doc_id, False
+
+    def _advance(self):
+        """Advance logical time by one item, evicting buckets as needed
+        """
+        self._tick = tick = self._tick + 1
+        window = self.window
+        if window is not None and tick % window == 0:
+            self.buckets.evict_stale(tick - window)
+        max_buckets = self.max_buckets
+        if max_buckets is not None and len(self.buckets) > max_buckets:
+            # evict a bit more than necessary so as to do it less often
+            self.buckets.evict_lru(int(max_buckets * (1.0 - LRU_EVICT_FRACTION)))
+
     def add_item(self, item, label=None, sketch=None):
         # Set default label for this set
         if label is None:
             label = item
 
         # Add to union-find structure
-        union_find = self.union_find
-        union_find.__getitem__(label)
+        doc_id, is_new = self._register(label, sketch)
 
         # Get signature vector and hash it
-        keys = item \
-            if self.signer is None \
-            else self.signer.get_signature(item)
+        signer = self.signer
+        probe_keys = ()
+        if signer is None:
+            keys = item
+        elif self.num_probes:
+            minhashes, perturbations = signer.get_minhashes_with_probes(
+                item, self.num_probes)
+            keys = signer._signature_from_minhashes(minhashes)
+            probe_keys = signer.get_probe_keys(minhashes, perturbations)
+        else:
+            keys = signer.get_signature(item)
+
+        # Merge exact duplicates without going through buckets
+        digests = self._digests
+        if digests is not None:
+            keys = list(keys)
+            first_id = digests.setdefault(
+                metrohash128(repr((keys, sketch))), doc_id)
+            if first_id != doc_id:
+                self.union_find.union(first_id, doc_id)
+                self.duplicates_collapsed += 1
+                self._advance()
+                return
 
         # Unite labels with same LSH keys
         counter = Counter()
-        sketches = dict()
-        for bucket in imap(self.buckets.__getitem__, keys):
-            bucket[label] = sketch
-            counter.update(bucket.keys())
-            sketches.update(bucket)
+        add_to_bucket = self.buckets.add
+        check_unique = not is_new
+        tick = self._tick
+        sample = self._hot_sample_size
+        for key in keys:
+            counter.update(add_to_bucket(key, doc_id, check_unique, tick, sample))
+        get_bucket = self.buckets.get
+        for key in probe_keys:
+            counter.update(get_bucket(key, sample))
 
         is_close = self._closeness_measure(sketch)
-        for matched_label, support in counter.iteritems():
-            if matched_label != label and \
-                    is_close(support, sketches[matched_label]):
-                union_find.union(matched_label, label)
+        union = self.union_find.union
+        sketches = self._sketches
+        for matched_id, support in counter.iteritems():
+            if matched_id != doc_id and \
+                    is_close(support, sketches[matched_id]):
+                union(matched_id, doc_id)
+        self._advance()
 
     def add_key(self, key, label=None, sketch=None):
         """Add one LSH key only (with associated info).
@@ -91,21 +251,21 @@ class Cluster(object):
             label = key
 
         # Add to union-find structure
-        union_find = self.union_find
-        union_find.__getitem__(label)
+        doc_id, is_new = self._register(label, sketch)
 
         # Unite labels with same LSH keys
-        bucket = self.buckets[key]
-        bucket[label] = sketch
+        members = self.buckets.add(key, doc_id, not is_new, self._tick)
 
         is_close = self._closeness_measure(sketch)
-        for matched_label in bucket.keys():
-            if matched_label != label:
-                matched_sketch = bucket[matched_label]
+        union = self.union_find.union
+        sketches = self._sketches
+        for matched_id in members:
+            if matched_id != doc_id:
                 # Note: large improvement in precision when also ensuring that
                 # distance > 0 below:
-                if is_close(matched_sketch):
-                    union_find.union(matched_label, label)
+                if is_close(1, sketches[matched_id]):
+                    union(matched_id, doc_id)
+        self._advance()
 
     def get_clusters(self):
         """Returns a list of sets representing clusters
@@ -114,10 +274,98 @@ class Cluster(object):
         """
         return self.union_find.sets()
 
+    def get_cluster_labels(self):
+        """Returns cluster assignments as an array
+
+        This is a compact alternative to ``get_clusters`` for large inputs.
+
+        :returns: a tuple of a list of item labels and an array of the same
+                  length containing cluster id of each item
+        :rtype: tuple
+        """
+        union_find = self.union_find
+        labels = [union_find.get_label(idx) for idx in xrange(len(union_find))]
+        return labels, union_find.labels()
+
+    def bucket_stats(self):
+        """Returns bucket size statistics (see ``BucketIndex.stats``)
+
+        :rtype: dict
+        """
+        return self.buckets.stats()
+
+    def flush(self, force=False):
+        """Emit finished clusters and forget about their members
+
+        A cluster is considered finished when none of its members was added
+        within the last ``window`` items. If ``force`` is set, all clusters
+        are considered finished. Merges already made between members of
+        unfinished clusters are kept.
+
+        :param force: whether to emit all clusters
+        :type force: bool
+        :returns: a list of finished clusters
+        :rtype: list
+        :raises: ValueError if no window was configured and ``force`` is not
+                 set (as any cluster could still grow)
+        """
+        window = self.window
+        if window is None and not force:
+            raise ValueError("Flushing unfinished clusters requires a window")
+        groups = self.union_find.groups()
+        if force:
+            finished, unfinished = groups, []
+        else:
+            finished, unfinished = [], []
+            min_tick = self._tick - window
+            last_seen = np.frombuffer(self._last_seen, dtype=np.dtype(
+                self._last_seen.typecode))
+            for group in groups:
+                if last_seen[group].max() < min_tick:
+                    finished.append(group)
+                else:
+                    unfinished.append(group)
+        get_label = self.union_find.get_label
+        clusters = [[get_label(idx) for idx in group] for group in finished]
+        self._retain(unfinished)
+        return clusters
+
+    def _retain(self, groups):
+        """Rebuild internal state so that it only contains given groups of ids
+        """
+        old_union_find = self.union_find
+        old_sketches = self._sketches
+        old_last_seen = self._last_seen
+        union_find = UnionFind()
+        sketches = []
+        last_seen = array('l')
+        mapping = array('l', [-1]) * len(old_union_find)
+        for group in groups:
+            first_id = None
+            for old_id in group:
+                new_id = union_find.add(old_union_find.get_label(old_id))
+                if first_id is None:
+                    first_id = new_id
+                else:
+                    union_find.union(first_id, new_id)
+                mapping[old_id] = new_id
+                sketches.append(old_sketches[old_id])
+                last_seen.append(old_last_seen[old_id])
+        self.buckets.remap(mapping)
+        digests = self._digests
+        if digests is not None:
+            self._digests = {digest: mapping[old_id]
+                             for digest, old_id in digests.iteritems()
+                             if mapping[old_id] >= 0}
+        self.union_find = union_find
+        self._sketches = sketches
+        self._last_seen = last_seen
+
 
 class MinHashCluster(Cluster):
     def __init__(self, width=12, bandwidth=3, lsh_scheme="a0",
-                 universe_size=None, kmin=1, seed=0, hashfun='metrohash'):
+                 universe_size=None, kmin=1, seed=0, hashfun='metrohash',
+                 key_format='int', signature='minhash', **kwargs):
         """
 
         :param width: Number of bands
@@ -129,17 +377,54 @@ class MinHashCluster(Cluster):
         :param universe_size: A prime number of size close to token universe
                               cardinality
         :type universe_size: long
+        :param hashfun: Name of hash function or hash family (e.g.
+                        "metrohash", "universal" or "murmur")
+        :type hashfun: str
+        :param key_format: Format of LSH keys ("int" or "str")
+        :type key_format: str
+        :param signature: Signature type ("minhash", "oph" for
+                          one-permutation hashing, or "weighted" for
+                          weighted minhash)
+        :type signature: str
+
+        Remaining keyword arguments are passed to Cluster constructor.
         """
-        lsh_hasher = LSHC(bandwidth, width=width, scheme=lsh_scheme) \
+        lsh_hasher = LSHC(bandwidth, width=width, scheme=lsh_scheme,
+                          key_format=key_format) \
             if bandwidth > 1 \
             else None
-        signer = MinHashSignature(width,
-                                  lsh_hasher=lsh_hasher,
-                                  universe_size=universe_size,
-                                  kmin=kmin,
-                                  seed=seed,
-                                  hashfun=hashfun)
-        super(MinHashCluster, self).__init__(signer=signer)
+        signer = SIGNATURE_TABLE[signature](width,
+                                            lsh_hasher=lsh_hasher,
+                                            universe_size=universe_size,
+                                            kmin=kmin,
+                                            seed=seed,
+                                            hashfun=hashfun,
+                                            key_format=key_format)
+        super(MinHashCluster, self).__init__(signer=signer, **kwargs)
+
+
+# HDClustering instance used by worker processes (set by _init_worker)
+_WORKER_MODEL = None
+
+
+def _init_worker(model):
+    """Initialize worker process with a model to run mapper tasks on
+
+    On POSIX systems worker processes are forked, so the model is inherited
+    by workers as is and does not need to be pickled.
+    """
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+
+def _map_chunk(chunk):
+    """Map a list of (obj, body, label, prefix) tuples in a worker process
+    """
+    map_item = _WORKER_MODEL._map_item
+    result = []
+    for obj, body, label, prefix in chunk:
+        result.extend(map_item(obj, body, label, prefix))
+    return result
 
 
 class SketchModel(object):
@@ -159,15 +444,26 @@ class HDClustering(object):
     def __init__(self, cfg, trace_every=0,
                  content_field='content',
                  get_body=None, get_label=None, get_prefix=None, min_support=None,
-                 seed=0, tokenizer=None):
+                 seed=0, tokenizer=None, workers=1, chunk_size=1000):
+
+        """Read configuration
 
-        """Read configuration"""
+        :param workers: number of processes to use for tokenizing, shingling,
+                        and signing input data (clustering itself always
+                        happens in the calling process)
+        :type workers: int
+        :param chunk_size: number of input items to send to a worker process
+                           at a time (ignored when workers <= 1)
+        :type chunk_size: int
+        """
         self.cfg = cfg
         self._get_body = get_body
         self._get_label = get_label
         self._get_prefix = get_prefix
 
         self.trace_every = trace_every
+        self.workers = workers
+        self.chunk_size = chunk_size
         self.get_content = operator.itemgetter(content_field)
 
         # Set options
@@ -179,9 +475,12 @@ class HDClustering(object):
         # Configure minhash signer
         sig_width = cfg['sig_width']
         lsh_hasher = LSHC(width=sig_width, **cfg['lsh_options'])
-        self.signer = MinHashSignature(sig_width,
-                                       lsh_hasher=lsh_hasher,
-                                       kmin=cfg['kmin'])
+        signature = cfg.get('signature', 'minhash')
+        self.signer = SIGNATURE_TABLE[signature](
+            sig_width,
+            lsh_hasher=lsh_hasher,
+            kmin=cfg['kmin'],
+            hashfun=cfg.get('hashfun', 'metrohash'))
 
         # Configure shingler
         cfg_key_shingle = cfg['shingler']
@@ -192,6 +491,7 @@ class HDClustering(object):
         self.sketch_enabled = cfg_sketch['enabled']
         self.sketch_dist_fn = None
         self.max_dist = None
+        self.sketch_operator = OPERATOR_MAP['and']
         if self.sketch_enabled:
             algorithm_name = cfg_sketch['algorithm']
             try:
@@ -222,33 +522,121 @@ class HDClustering(object):
                           (1.0 - float(cfg_sketch['resemblance']))))
             self.sketch_dist_fn = hamming
             self.sketch_operator = OPERATOR_MAP[cfg_sketch.get('operator', 'and')]
+        # Configure bounded-memory (streaming) mode
+        cfg_streaming = cfg.get('streaming', {})
         self.cluster_builder = Cluster(sketch_dist_fn=self.sketch_dist_fn,
                                        max_dist=self.max_dist,
                                        min_support=self.min_support,
-                                       sketch_operator=self.sketch_operator)
-
-    def _map_iter(self, data):
-        """Find clusters in an iterable"""
+                                       sketch_operator=self.sketch_operator,
+                                       max_bucket_size=cfg_streaming.get('max_bucket_size'),
+                                       max_buckets=cfg_streaming.get('max_buckets'),
+                                       window=cfg_streaming.get('window'),
+                                       hot_bucket_size=cfg.get('hot_bucket_size'),
+                                       hot_sample_size=cfg.get('hot_sample_size', 8),
+                                       dedupe=cfg.get('dedupe', False))
+
+        # Optional cache of (keys, sketch) tuples keyed by content fingerprint
+        # (in parallel mode, every worker process keeps its own cache)
+        cache_size = cfg.get('signature_cache_size')
+        self.signature_cache = None \
+            if cache_size is None \
+            else LRUCache(cache_size)
+
+    def _iter_items(self, data, start=0):
+        """Generate (obj, body, label, prefix) tuples from an iterable
+
+        :param start: default label of the first item (labels default to
+                      item positions when no label getter is given)
+        :type start: int
+        """
 
         get_body = self._get_body
         get_label = self._get_label
         get_prefix = self._get_prefix
 
-        for i, obj in enumerate(data):
+        for i, obj in enumerate(data, start):
             body = obj if get_body is None else get_body(obj)
             label = i if get_label is None else get_label(obj)
             prefix = None if get_prefix is None else get_prefix(obj)
+            yield obj, body, label, prefix
 
+    def _map_iter(self, data, start=0):
+        """Find clusters in an iterable"""
+
+        if self.workers > 1:
+            for feat in self._map_iter_parallel(data, start):
+                yield feat
+            return
+
+        for obj, body, label, prefix in self._iter_items(data, start):
             for feat in self._map_item(obj, body, label, prefix):
                 yield feat
 
-    def _map_item(self, obj, body, label, prefix=None):
+    def _map_iter_parallel(self, data, start=0):
+        """Same as _map_iter except mapping is done by a pool of processes
 
-        # Extract features
+        Input is sent to workers in chunks, and results are yielded in the
+        same order as the input. At most ``MAX_CHUNKS_PER_WORKER`` chunks per
+        worker are in flight at a time, so input is read only as fast as
+        results are consumed.
+        """
+        items = self._iter_items(data, start)
+        chunk_size = self.chunk_size
+        chunks = iter(lambda: list(islice(items, chunk_size)), [])
+        max_pending = MAX_CHUNKS_PER_WORKER * self.workers
+        pool = Pool(processes=self.workers, initializer=_init_worker,
+                    initargs=(self,))
+        try:
+            pending = deque(pool.apply_async(_map_chunk, (chunk,))
+                            for chunk in islice(chunks, max_pending))
+            while pending:
+                results = pending.popleft().get()
+                for feat in results:
+                    yield feat
+                for chunk in islice(chunks, 1):
+                    pending.append(pool.apply_async(_map_chunk, (chunk,)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _get_features(self, obj, prefix=None):
+        """Return (tokens, shingles) tuple for an input object"""
         obj_content = self.get_content(obj)
         content_tokens = self.tokenizer.tokenize(obj_content)
-
         features = self.shingler.get_shingles(content_tokens, prefix=prefix)
+        return content_tokens, features
+
+    def _fingerprint(self, obj, prefix=None):
+        """Return a 128-bit fingerprint of object content and prefix"""
+        return metrohash128(hashable(self.get_content(obj))), prefix
+
+    def cache_stats(self):
+        """Return signature cache counters (see ``LRUCache.stats``)
+
+        :returns: a dictionary of counters or None if cache is disabled
+        :rtype: dict
+        """
+        cache = self.signature_cache
+        return None if cache is None else cache.stats()
+
+    def _map_item(self, obj, body, label, prefix=None):
+        cache = self.signature_cache
+        if cache is None:
+            keys, sketch = self._sign_item(obj, prefix)
+        else:
+            fingerprint = self._fingerprint(obj, prefix)
+            signed = cache.get(fingerprint)
+            if signed is None:
+                signed = self._sign_item(obj, prefix)
+                cache.put(fingerprint, signed)
+            keys, sketch = signed
+        yield (keys, (label, sketch))
+
+    def _sign_item(self, obj, prefix=None):
+        """Return (keys, sketch) tuple for an input object"""
+
+        # Extract features
+        content_tokens, features = self._get_features(obj, prefix)
         if self.sketch_enabled and (self.sketch_shingler is None or self.sketch_signer is None):
             keys, sketch = self.signer.get_signature(features, with_sketch=True)
         elif self.sketch_enabled and (self.sketch_shingler is not None and self.sketch_signer is not None):
@@ -258,7 +646,37 @@ class HDClustering(object):
         else:
             keys = self.signer.get_signature(features)
             sketch = None
-        yield (keys, (label, sketch))
+        return keys, sketch
+
+    def build_index(self, data, index=None):
+        """Build a persistent LSH index from an iterable
+
+        The index uses the same signature parameters as the clustering model,
+        and can be saved with ``LSHIndex.save`` and later queried for
+        near-duplicates of new documents.
+
+        :param data: input data
+        :type data: collections.Iterable
+        :param index: an existing index to add to (an ``LSHIndex`` is created
+                      if not given, but an ``LSHForest`` can also be passed
+                      for querying at variable thresholds)
+        :type index: lsh_hdc.index.LSHIndex
+        :rtype: lsh_hdc.index.LSHIndex
+        """
+        if index is None:
+            cfg = self.cfg
+            lsh_options = cfg['lsh_options']
+            index = LSHIndex(width=cfg['sig_width'],
+                             bandwidth=lsh_options['bandwidth'],
+                             lsh_scheme=lsh_options.get('scheme', 'a1'),
+                             kmin=cfg['kmin'],
+                             hashfun=cfg.get('hashfun', 'metrohash'),
+                             signature=cfg.get('signature', 'minhash'))
+        for obj, _, label, prefix in self._iter_items(data):
+            _, features = self._get_features(obj, prefix)
+            index.add(features, label)
+        index.commit()
+        return index
 
     def clusters_from_iter(self, data):
         """Find clusters in an iterable"""
@@ -277,6 +695,48 @@ class HDClustering(object):
 
         return cluster_builder.get_clusters()
 
+    def iter_clusters(self, data, flush_every=10000):
+        """Find clusters in a (possibly unbounded) stream
+
+        Finished clusters are emitted every ``flush_every`` items (see
+        ``Cluster.flush``), and all remaining ones are emitted at the end.
+        Requires a streaming window to be configured, since without one
+        there is no telling which clusters are finished.
+
+        :param data: input stream
+        :type data: collections.Iterable
+        :param flush_every: how often to flush finished clusters
+        :type flush_every: int
+        :returns: a generator of clusters
+        :rtype: collections.Iterable
+        :raises: ValueError if no streaming window is configured
+        """
+        if self.cluster_builder.window is None:
+            raise ValueError("Streaming clustering requires a window "
+                             "(set streaming.window in configuration)")
+        return self._iter_clusters(data, flush_every)
+
+    def _iter_clusters(self, data, flush_every):
+        """Generate clusters for ``iter_clusters``"""
+        cluster_builder = self.cluster_builder
+        trace_every = self.trace_every
+        for i, obj in enumerate(self._map_iter(data), start=1):
+            if trace_every > 0 and (not i % trace_every):
+                LOG.info("Processing line " + str(i))
+
+            keys, val = obj
+            label, sketch = val \
+                if isinstance(val, tuple) \
+                else (val, None)
+            cluster_builder.add_item(keys, label=label, sketch=sketch)
+
+            if not i % flush_every:
+                for cluster in cluster_builder.flush():
+                    yield cluster
+
+        for cluster in cluster_builder.flush(force=True):
+            yield cluster
+
     def mapper(self, obj):
         """Perform a mapper task in MR"""
         get_body = self._get_body
@@ -309,3 +769,148 @@ class HDClustering(object):
 
         # create a dict mappipng a label to a sketch
         return key, dict(tuple_gen).items()
+
+    def batch_mapper(self, data, first_id=0):
+        """Perform a mapper task in MR on a block of documents
+
+        Unlike ``mapper``, which emits one record per LSH key, this emits a
+        single columnar block of fixed-size rows: an LSH key, the id of the
+        document it belongs to, and the document sketch (zero when sketches
+        are disabled). Rows are sorted by key so that blocks can be merged
+        with ``batch_reducer``. Documents in a block are given consecutive
+        integer ids starting from ``first_id``, which is up to the caller to
+        keep distinct across blocks (for example, by using input offsets).
+        When no label getter is configured, document ids also serve as
+        labels.
+
+        :param data: input documents
+        :type data: collections.Iterable
+        :param first_id: id of the first document in the block
+        :type first_id: int
+        :returns: a tuple of a structured array of ``KEY_BLOCK_DTYPE`` and a
+                  list of labels of documents in the block (in order of id)
+        :rtype: tuple
+        """
+        if self.signer.lsh_hasher.key_format != "int":
+            raise ValueError("Batch mapping requires integer LSH keys")
+        if self.sketch_enabled and self.sketch_bits > 64:
+            raise ValueError("Batch mapping requires sketches of up to 64 bits")
+        doc_keys = []
+        labels = []
+        sketches = []
+        for keys, (label, sketch) in self._map_iter(data, first_id):
+            doc_keys.append(keys)
+            labels.append(label)
+            sketches.append(sketch or 0)
+        num_keys = np.fromiter(imap(len, doc_keys), dtype=np.intp,
+                               count=len(doc_keys))
+        block = np.empty(num_keys.sum(), dtype=KEY_BLOCK_DTYPE)
+        block['key'] = np.fromiter(chain.from_iterable(doc_keys),
+                                   dtype=np.uint64, count=len(block))
+        block['doc_id'] = np.repeat(
+            np.arange(first_id, first_id + len(labels), dtype=np.int64),
+            num_keys)
+        block['sketch'] = np.repeat(np.array(sketches, dtype=np.uint64),
+                                    num_keys)
+        return block[np.argsort(block['key'], kind='mergesort')], labels
+
+    def batch_reducer(self, blocks):
+        """Perform a reducer task in MR on blocks emitted by ``batch_mapper``
+
+        Blocks are merge-joined on LSH key, and pairs of documents sharing
+        keys are checked against support and sketch distance criteria the
+        same way ``Cluster`` checks them. When ``hot_bucket_size`` is
+        configured, documents under a key beyond the first
+        ``hot_bucket_size`` ones are paired only with a sample of the first
+        ones (as in ``Cluster``), which avoids emitting a quadratic number of
+        pairs for keys shared by many documents.
+
+        :param blocks: sorted key blocks (in order of document ids)
+        :type blocks: collections.Iterable
+        :returns: a structured array of ``EDGE_DTYPE`` holding one row per
+                  pair of documents to be merged, sorted by document ids
+        :rtype: numpy.ndarray
+        """
+        blocks = [block for block in blocks if len(block)]
+        if not blocks:
+            return np.empty(0, dtype=EDGE_DTYPE)
+        merged = np.concatenate(blocks)
+        # stable sort of concatenated sorted runs amounts to merging them
+        # (and keeps rows under the same key in order of document ids)
+        merged = merged[np.argsort(merged['key'], kind='mergesort')]
+        keys = merged['key']
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        sizes = np.diff(np.append(starts, len(keys)))
+        shared = sizes > 1
+
+        hot_size = self.cfg.get('hot_bucket_size')
+        sample = 1 if self.min_support <= 1 \
+            else self.cfg.get('hot_sample_size', 8)
+        firsts = []
+        seconds = []
+        for start, size in izip(starts[shared].tolist(), sizes[shared].tolist()):
+            first, second = _bucket_pairs(size, hot_size, sample)
+            firsts.append(first + start)
+            seconds.append(second + start)
+        if not firsts:
+            return np.empty(0, dtype=EDGE_DTYPE)
+        firsts = np.concatenate(firsts)
+        seconds = np.concatenate(seconds)
+        doc_ids = np.minimum(merged['doc_id'][firsts], merged['doc_id'][seconds])
+        other_ids = np.maximum(merged['doc_id'][firsts], merged['doc_id'][seconds])
+        distinct = doc_ids != other_ids
+        firsts, doc_ids, other_ids = \
+            firsts[distinct], doc_ids[distinct], other_ids[distinct]
+        seconds = seconds[distinct]
+
+        # count support (number of keys shared) of every pair of documents
+        order = np.lexsort((other_ids, doc_ids))
+        doc_ids, other_ids = doc_ids[order], other_ids[order]
+        pair_starts = np.flatnonzero(np.concatenate((
+            [True], (doc_ids[1:] != doc_ids[:-1]) |
+            (other_ids[1:] != other_ids[:-1]))))
+        support = np.diff(np.append(pair_starts, len(doc_ids)))
+
+        is_close = support >= self.min_support
+        if self.sketch_dist_fn is not None:
+            sketches = merged['sketch']
+            pair_rows = order[pair_starts]
+            distance = _hamming_many(sketches[firsts[pair_rows]],
+                                     sketches[seconds[pair_rows]])
+            is_close = self.sketch_operator(is_close, distance <= self.max_dist)
+
+        edges = np.empty(is_close.sum(), dtype=EDGE_DTYPE)
+        edges['doc_id'] = doc_ids[pair_starts][is_close]
+        edges['other_id'] = other_ids[pair_starts][is_close]
+        edges['support'] = support[is_close]
+        return edges
+
+    def clusters_from_blocks(self, data, block_size=10000):
+        """Find clusters in an iterable using batch mapper and reducer
+
+        Gives the same clusters as ``clusters_from_iter`` when no streaming
+        limits are configured, and serves as a local counterpart of a
+        MapReduce job built on ``batch_mapper`` and ``batch_reducer``.
+
+        :param data: input data
+        :type data: collections.Iterable
+        :param block_size: number of documents per mapped block
+        :type block_size: int
+        :rtype: list
+        """
+        data = iter(data)
+        blocks = []
+        labels = []
+        for chunk in iter(lambda: list(islice(data, block_size)), []):
+            block, block_labels = self.batch_mapper(chunk, first_id=len(labels))
+            blocks.append(block)
+            labels.extend(block_labels)
+        edges = self.batch_reducer(blocks)
+
+        union_find = UnionFind()
+        ids = [union_find.add(label) for label in labels]
+        union = union_find.union
+        for doc_id, other_id in izip(edges['doc_id'].tolist(),
+                                     edges['other_id'].tolist()):
+            union(ids[doc_id], ids[other_id])
+        return union_find.sets()
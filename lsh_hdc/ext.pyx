@@ -1,9 +1,12 @@
 #cython: infer_types=True
 
 import sys
+import numpy as np
 from struct import unpack
 from itertools import izip
 from hashlib import md5
+cimport cython
+from cpython.unicode cimport PyUnicode_AS_UNICODE, PyUnicode_GET_SIZE
 
 
 cdef extern from * nogil:
@@ -19,22 +22,110 @@ ctypedef uint64_t uint64
 
 cdef class PHashCombiner(object):
     """Use polynomial hashing to reduce a vector of hashes
+
+    For ``bits <= 64``, hashes are combined with wrapping 64-bit arithmetic
+    (negative integers are taken modulo 2 ** 64). Wider combiners fall back
+    to arbitrary-precision integers.
+
+    In "murmur" mode, hashes are instead folded together one by one with
+    ``hash_combine_murmur_64``, which gives better avalanche behavior at a
+    small cost.
+
+    >>> comb = PHashCombiner(3)
+    >>> comb.combine([1, 2, 3]) == 1 + 2 * 31 + 3 * 31 ** 2
+    True
+    >>> comb.combine_many(np.array([[1, 2, 3]], dtype=np.uint64)).tolist()
+    [2946L]
     """
 
     cdef list _coeffs
     cdef _mask
-
-    def __cinit__(self, size, prime=31, bits=64):
-        # TODO: cdef prime and i to int64 to get speedup
+    cdef uint64[:] _coeffs_64
+    cdef uint64 _mask_64
+    cdef bint _native
+    cdef bint _murmur
+
+    def __cinit__(self, size, prime=31, bits=64, mode="polynomial"):
+        if mode not in ("polynomial", "murmur"):
+            raise ValueError("Unsupported mode: %s" % mode)
+        self._murmur = mode == "murmur"
+        self._native = bits <= 64
+        if self._murmur and not self._native:
+            raise ValueError("murmur mode requires bits <= 64")
         self._coeffs = [prime ** i for i in xrange(size)]
         self._mask = (1 << bits) - 1
-
+        self._coeffs_64 = np.array(
+            [coeff & 0xffffffffffffffff for coeff in self._coeffs],
+            dtype=np.uint64)
+        self._mask_64 = self._mask & 0xffffffffffffffff
+
+    property coeffs:
+        """Polynomial coefficients (one per position in combined vector)"""
+        def __get__(self):
+            return list(self._coeffs)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
     def combine(self, hashes):
         """Combine a list of integer hashes
+
+        Only the first ``size`` hashes are used.
+        """
+        if not self._native:
+            ab = sum(h * c for h, c in izip(hashes, self._coeffs))
+            return ab & self._mask
+        cdef uint64[:] coeffs = self._coeffs_64
+        cdef Py_ssize_t size = coeffs.shape[0]
+        cdef Py_ssize_t i = 0
+        cdef uint64 h
+        cdef uint64 result = 0
+        for value in hashes:
+            if i >= size:
+                break
+            try:
+                h = value
+            except OverflowError:
+                h = value & 0xffffffffffffffff
+            if self._murmur:
+                result = hash_combine_murmur_64(result, h)
+            else:
+                result += h * coeffs[i]
+            i += 1
+        return result & self._mask_64
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def combine_many(self, uint64[:, :] hashes):
+        """Combine every row of a matrix of hashes
+
+        Gives the same results as calling ``combine`` on each row.
+
+        :param hashes: matrix of hashes
+        :type hashes: numpy.ndarray
+        :returns: a vector with one combined hash per row
+        :rtype: numpy.ndarray
         """
-        # TODO: cdef h and c to int64 to get speedup
-        ab = sum(h * c for h, c in izip(hashes, self._coeffs))
-        return ab & self._mask
+        if not self._native:
+            return np.array([self.combine(row) for row in hashes],
+                            dtype=object)
+        result = np.empty(hashes.shape[0], dtype=np.uint64)
+        cdef uint64[:] out = result
+        cdef uint64[:] coeffs = self._coeffs_64
+        cdef Py_ssize_t num_cols = min(hashes.shape[1], coeffs.shape[0])
+        cdef Py_ssize_t i, j
+        cdef uint64 acc
+        cdef uint64 mask = self._mask_64
+        cdef bint murmur = self._murmur
+        with nogil:
+            for i in range(hashes.shape[0]):
+                acc = 0
+                for j in range(num_cols):
+                    if murmur:
+                        acc = hash_combine_murmur_64(acc, hashes[i, j])
+                    else:
+                        acc += hashes[i, j] * coeffs[j]
+                out[i] = acc & mask
+        return result
 
 
 cpdef inline uint64 hash_combine_boost_64(uint64 seed, uint64 v):
@@ -51,7 +142,7 @@ cpdef inline hash_combine_boost(seed, v):
     return seed ^ (v + 0x9e3779b9 + (seed << 6) + (seed >> 2))
 
 
-cpdef inline uint64 hash_combine_murmur_64(uint64 seed, uint64 v):
+cpdef inline uint64 hash_combine_murmur_64(uint64 seed, uint64 v) nogil:
     """Hash two 64-bit integers together
     Uses a Murmur-inspired hash function
     """
@@ -122,6 +213,8 @@ cdef class VarlenHash(object):
     """Create a hash function of arbitrary output length
     """
     cdef _mask
+    cdef uint64 _mask_64
+    cdef bint _native
 
     def __cinit__(self, bits=64):
         """
@@ -130,6 +223,9 @@ cdef class VarlenHash(object):
 
         """
         self._mask = (1 << bits) - 1
+        # hashes of up to 64 bits are computed with fixed-width arithmetic
+        self._native = bits <= 64
+        self._mask_64 = self._mask & 0xffffffffffffffff
 
     def __call__(self, value, seed=0):
         """A variable-length version of Python's builtin hash
@@ -142,11 +238,14 @@ cdef class VarlenHash(object):
             value = repr(value)
         length_of_v = len(value)
         if length_of_v > 0:
-            item = ord(value[0]) << 7
-            mask = self._mask
-            for char in value:
-                item = ((item * 1000003) ^ ord(char)) & mask
-            item ^= length_of_v
+            if self._native:
+                item = _varlen_hash_64(value, length_of_v, self._mask_64)
+            else:
+                item = ord(value[0]) << 7
+                mask = self._mask
+                for char in value:
+                    item = ((item * 1000003) ^ ord(char)) & mask
+                item ^= length_of_v
             if item == -1:
                 item = -2
             return hash_combine_boost(item, seed)
@@ -154,6 +253,493 @@ cdef class VarlenHash(object):
             return 0
 
 
+cdef inline uint64 _varlen_hash_64(const char* data, Py_ssize_t length,
+                                   uint64 mask) nogil:
+    """Fixed-width version of the VarlenHash loop (for up to 64 bits)
+    """
+    cdef uint64 item = (<uint64><uint8>data[0] << 7) & mask
+    cdef Py_ssize_t i
+    for i in range(length):
+        item = ((item * 1000003ULL) ^ <uint8>data[i]) & mask
+    return item ^ <uint64>length
+
+
+# multiplier used for rolling polynomial hashes of shingles
+cdef uint64 SHINGLE_PRIME = 0x100000001b3ULL
+
+# FNV-1a parameters
+cdef uint64 FNV_OFFSET = 0xcbf29ce484222325ULL
+cdef uint64 FNV_PRIME = 0x100000001b3ULL
+
+
+cdef inline uint64 _fmix64(uint64 h) nogil:
+    """Finalization mix from MurmurHash3 (a bijection on 64-bit values)
+    """
+    h ^= h >> 33
+    h *= 0xff51afd7ed558ccdULL
+    h ^= h >> 33
+    h *= 0xc4ceb9fe1a85ec53ULL
+    h ^= h >> 33
+    return h
+
+
+cdef inline uint64 _hash_bytes(const char* data, Py_ssize_t length,
+                               uint64 seed) nogil:
+    """FNV-1a hash of a byte string with MurmurHash3 finalization
+    """
+    cdef uint64 h = FNV_OFFSET ^ seed
+    cdef Py_ssize_t i
+    for i in range(length):
+        h = (h ^ <uint8>data[i]) * FNV_PRIME
+    return _fmix64(h ^ <uint64>length)
+
+
+cpdef uint64 hash_token_64(token, uint64 seed=0):
+    """Hash a token to a 64-bit integer
+
+    Unicode strings are hashed as UTF-8, byte strings are hashed as is, and
+    other objects are hashed through their repr.
+    """
+    cdef bytes data
+    if isinstance(token, unicode):
+        data = (<unicode>token).encode("utf-8")
+    elif isinstance(token, bytes):
+        # bytes() turns subclasses (e.g. numpy.string_) into exact bytes
+        data = bytes(token)
+    else:
+        data = repr(token)
+    return _hash_bytes(data, len(data), seed)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def hash_bytes_many(const uint8[:] data, offsets, uint64 seed=0):
+    """Hash byte strings stored back to back in a single buffer
+
+    Item ``i`` spans ``data[offsets[i]:offsets[i + 1]]`` (the layout used by
+    Arrow binary and string arrays), and it is hashed the same way as
+    ``hash_token_64`` hashes a byte string. Any object supporting the buffer
+    protocol can be passed as data without copying it.
+
+    :param data: concatenated byte strings
+    :type data: bytes, bytearray, numpy.ndarray
+    :param offsets: a sequence of ``n + 1`` non-decreasing offsets
+    :type offsets: numpy.ndarray
+    :param seed: hash seed
+    :type seed: int
+    :returns: a vector of ``n`` hashes
+    :rtype: numpy.ndarray
+
+    >>> items = ["ab", "", "cde"]
+    >>> hashes = hash_bytes_many(b"abcde", np.array([0, 2, 2, 5]))
+    >>> hashes.tolist() == map(hash_token_64, items)
+    True
+    """
+    cdef long long[:] bounds = np.asarray(offsets, dtype=np.longlong)
+    if bounds.shape[0] < 1:
+        raise ValueError("offsets must contain at least one element")
+    cdef Py_ssize_t num_items = bounds.shape[0] - 1
+    cdef Py_ssize_t data_len = data.shape[0]
+    result = np.empty(num_items, dtype=np.uint64)
+    cdef uint64[:] out = result
+    cdef Py_ssize_t i, start, stop
+    cdef bint valid = True
+    cdef const char* base = b""
+    if data_len > 0:
+        base = <const char*>&data[0]
+    with nogil:
+        for i in range(num_items):
+            start = bounds[i]
+            stop = bounds[i + 1]
+            if start < 0 or stop < start or stop > data_len:
+                valid = False
+                break
+            out[i] = _hash_bytes(base + start, stop - start, seed)
+    if not valid:
+        raise ValueError("Invalid offsets at position %d" % i)
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def hash_bytes_array(values, uint64 seed=0):
+    """Hash every element of a NumPy array of fixed-width byte strings
+
+    Elements are hashed the same way as ``hash_token_64`` hashes byte strings
+    (with trailing null bytes removed, as NumPy does when returning them).
+
+    :param values: a one-dimensional array of ``S`` dtype
+    :type values: numpy.ndarray
+    :param seed: hash seed
+    :type seed: int
+    :returns: a vector of hashes
+    :rtype: numpy.ndarray
+
+    >>> values = np.array(["ab", "", "cde"])
+    >>> hash_bytes_array(values).tolist() == map(hash_token_64, values)
+    True
+    """
+    values = np.ascontiguousarray(values)
+    if values.dtype.kind != "S" or values.ndim != 1:
+        raise ValueError("Expected a one-dimensional array of byte strings")
+    cdef Py_ssize_t width = values.dtype.itemsize
+    cdef Py_ssize_t num_items = values.shape[0]
+    result = np.empty(num_items, dtype=np.uint64)
+    cdef uint64[:] out = result
+    if num_items == 0 or width == 0:
+        result.fill(_hash_bytes(b"", 0, seed))
+        return result
+    cdef const uint8[:] data = values.view(np.uint8)
+    cdef Py_ssize_t i, length
+    cdef const char* item
+    with nogil:
+        for i in range(num_items):
+            item = <const char*>&data[i * width]
+            length = width
+            while length > 0 and item[length - 1] == 0:
+                length -= 1
+            out[i] = _hash_bytes(item, length, seed)
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _roll_shingles(uint64[:] token_hashes, Py_ssize_t span,
+                               Py_ssize_t step, uint64[:] out) nogil:
+    """Write shingle hashes of a token hash sequence to out
+
+    Shingles are formed the same way as by ``shinglify``: every shingle
+    consists of tokens at offsets 0, step, 2 * step, ... (less than span)
+    from its start, and a sequence shorter than span forms one shingle made
+    of all of its tokens. Returns number of shingles written.
+    """
+    cdef Py_ssize_t num_tokens = token_hashes.shape[0]
+    cdef Py_ssize_t i, j
+    cdef uint64 h
+    if num_tokens < span:
+        h = 0
+        for j in range(num_tokens):
+            h = h * SHINGLE_PRIME + token_hashes[j]
+        out[0] = _fmix64(h)
+        return 1
+    for i in range(num_tokens - span + 1):
+        h = 0
+        j = 0
+        while j < span:
+            h = h * SHINGLE_PRIME + token_hashes[i + j]
+            j += step
+        out[i] = _fmix64(h)
+    return num_tokens - span + 1
+
+
+def hash_shingles(tokens, Py_ssize_t span, Py_ssize_t skip=0):
+    """Hash shingles of a token sequence without materializing them
+
+    Every token is hashed once with ``hash_token_64``, and shingle hashes are
+    computed from token hashes by rolling polynomial hashing.
+
+    :param tokens: token sequence
+    :type tokens: collections.Sequence
+    :param span: shingle span
+    :type span: int
+    :param skip: how many tokens to skip between shingle elements
+    :type skip: int
+    :returns: shingle hashes (in order of occurrence)
+    :rtype: numpy.ndarray
+    """
+    if span < 1:
+        raise ValueError("span must be >= 1")
+    if skip < 0:
+        raise ValueError("skip cannot be negative")
+    cdef Py_ssize_t num_tokens = len(tokens)
+    token_hashes = np.empty(num_tokens, dtype=np.uint64)
+    cdef uint64[:] token_view = token_hashes
+    cdef Py_ssize_t i = 0
+    for token in tokens:
+        token_view[i] = hash_token_64(token)
+        i += 1
+    result = np.empty(max(num_tokens - span + 1, 1), dtype=np.uint64)
+    cdef uint64[:] out = result
+    with nogil:
+        _roll_shingles(token_view, span, skip + 1, out)
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _hash_words(Py_UNICODE* chars, Py_ssize_t length,
+                            uint8[:] char_table, uint64[:] out,
+                            Py_ssize_t pos) nogil:
+    """Hash every word in a unicode buffer, writing hashes to out from pos
+
+    Words are maximal runs of characters marked in char_table, and are hashed
+    as their UTF-8 encoding (giving the same result as ``hash_token_64``)
+    without being copied out of the buffer. Returns position past the last
+    hash written.
+    """
+    cdef Py_ssize_t table_size = char_table.shape[0]
+    cdef Py_ssize_t i
+    cdef uint64 h = 0
+    cdef uint64 num_bytes = 0
+    cdef uint64 ch
+    cdef bint in_word = False
+    for i in range(length):
+        ch = <uint64>chars[i]
+        if ch < <uint64>table_size and char_table[ch]:
+            if not in_word:
+                h = FNV_OFFSET
+                num_bytes = 0
+                in_word = True
+            # feed UTF-8 bytes of the code point
+            if ch < 0x80:
+                h = (h ^ ch) * FNV_PRIME
+                num_bytes += 1
+            elif ch < 0x800:
+                h = (h ^ (0xc0 | (ch >> 6))) * FNV_PRIME
+                h = (h ^ (0x80 | (ch & 0x3f))) * FNV_PRIME
+                num_bytes += 2
+            elif ch < 0x10000:
+                h = (h ^ (0xe0 | (ch >> 12))) * FNV_PRIME
+                h = (h ^ (0x80 | ((ch >> 6) & 0x3f))) * FNV_PRIME
+                h = (h ^ (0x80 | (ch & 0x3f))) * FNV_PRIME
+                num_bytes += 3
+            else:
+                h = (h ^ (0xf0 | (ch >> 18))) * FNV_PRIME
+                h = (h ^ (0x80 | ((ch >> 12) & 0x3f))) * FNV_PRIME
+                h = (h ^ (0x80 | ((ch >> 6) & 0x3f))) * FNV_PRIME
+                h = (h ^ (0x80 | (ch & 0x3f))) * FNV_PRIME
+                num_bytes += 4
+        elif in_word:
+            out[pos] = _fmix64(h ^ num_bytes)
+            pos += 1
+            in_word = False
+    if in_word:
+        out[pos] = _fmix64(h ^ num_bytes)
+        pos += 1
+    return pos
+
+
+def hash_text_shingles(text, uint8[:] char_table, Py_ssize_t span,
+                       Py_ssize_t skip=0, prefix=None):
+    """Tokenize a text and hash its shingles in one pass
+
+    Tokens are maximal runs of characters marked in a lookup table. Given the
+    table returned by ``RegexTokenizer.get_char_table``, the result is the
+    same as that of calling ``hash_shingles`` on the output of the tokenizer
+    (with prefix prepended to it if given), but no token strings are created.
+    Byte strings are decoded as UTF-8.
+
+    :param text: input text
+    :type text: unicode
+    :param char_table: lookup table of token characters indexed by code point
+    :type char_table: numpy.ndarray
+    :param span: shingle span
+    :type span: int
+    :param skip: how many tokens to skip between shingle elements
+    :type skip: int
+    :param prefix: an object to prepend to token sequence
+    :type prefix: object
+    :returns: shingle hashes (in order of occurrence)
+    :rtype: numpy.ndarray
+    """
+    if span < 1:
+        raise ValueError("span must be >= 1")
+    if skip < 0:
+        raise ValueError("skip cannot be negative")
+    if isinstance(text, bytes):
+        text = (<bytes>text).decode("utf-8")
+    elif not isinstance(text, unicode):
+        raise TypeError("Expected a string, got %s" % type(text).__name__)
+    cdef Py_ssize_t length = PyUnicode_GET_SIZE(text)
+    cdef Py_UNICODE* chars = PyUnicode_AS_UNICODE(text)
+    # there cannot be more words than characters
+    token_hashes = np.empty(length + 1, dtype=np.uint64)
+    cdef uint64[:] token_view = token_hashes
+    cdef Py_ssize_t num_tokens = 0
+    if prefix is not None:
+        token_view[0] = hash_token_64(prefix)
+        num_tokens = 1
+    with nogil:
+        num_tokens = _hash_words(chars, length, char_table, token_view,
+                                 num_tokens)
+    result = np.empty(max(num_tokens - span + 1, 1), dtype=np.uint64)
+    cdef uint64[:] out = result
+    with nogil:
+        _roll_shingles(token_view[:num_tokens], span, skip + 1, out)
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def mix_hashes_64(uint64[:] base, uint64[:] seeds):
+    """Derive seeded hashes from a vector of base hashes
+
+    :param base: base hashes
+    :type base: numpy.ndarray
+    :param seeds: one seed per output row
+    :type seeds: numpy.ndarray
+    :returns: matrix of shape (len(seeds), len(base)) where element (i, j)
+              is ``hash_combine_murmur_64(seeds[i], base[j])``
+    :rtype: numpy.ndarray
+    """
+    result = np.empty((seeds.shape[0], base.shape[0]), dtype=np.uint64)
+    cdef uint64[:, :] out = result
+    cdef Py_ssize_t i, j
+    with nogil:
+        for i in range(seeds.shape[0]):
+            for j in range(base.shape[0]):
+                out[i, j] = hash_combine_murmur_64(seeds[i], base[j])
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def one_permutation_minhashes(uint64[:] hashes, Py_ssize_t width,
+                              uint64 seed=0):
+    """Return a densified one-permutation minhash signature
+
+    Every hash is assigned to one of ``width`` bins (by its value modulo
+    ``width``), and the smallest hash in each bin is kept. Empty bins are
+    then filled using optimal densification (Shrivastava, 2017): an empty bin
+    ``i`` probes bins ``hash_combine_murmur_64(seed + i, attempt) % width``
+    for attempt = 1, 2, ... and copies the value of the first bin that
+    received a hash.
+
+    :param hashes: feature hashes (must not be empty)
+    :type hashes: numpy.ndarray
+    :param width: number of bins
+    :type width: int
+    :param seed: seed for probing sequences
+    :type seed: int
+    :rtype: numpy.ndarray
+    """
+    if hashes.shape[0] == 0:
+        raise ValueError("Cannot compute signature of empty hash vector")
+    if width < 1:
+        raise ValueError("width must be a positive integer")
+    result = np.zeros(width, dtype=np.uint64)
+    filled = np.zeros(width, dtype=np.uint8)
+    cdef uint64[:] out = result
+    cdef uint8[:] is_filled = filled
+    cdef uint64 num_bins = width
+    cdef uint64 val, attempt
+    cdef Py_ssize_t i, j
+    with nogil:
+        for j in range(hashes.shape[0]):
+            val = hashes[j]
+            i = val % num_bins
+            if not is_filled[i] or val < out[i]:
+                out[i] = val
+                is_filled[i] = 1
+        for i in range(width):
+            if is_filled[i]:
+                continue
+            attempt = 1
+            j = hash_combine_murmur_64(seed + i, attempt) % num_bins
+            while not is_filled[j]:
+                attempt += 1
+                j = hash_combine_murmur_64(seed + i, attempt) % num_bins
+            out[i] = out[j]
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _bottom_k(uint64[:, :] hashes, Py_ssize_t start,
+                           Py_ssize_t stop, uint64[:, :] out) nogil:
+    """Write k smallest values from each row of a column range to out
+
+    Rows of out are filled in ascending order. When the column range
+    contains fewer than k values, the last value found is repeated.
+    """
+    cdef Py_ssize_t kmin = out.shape[1]
+    cdef Py_ssize_t i, j, pos, count
+    cdef uint64 val
+    for i in range(hashes.shape[0]):
+        count = 0
+        for j in range(start, stop):
+            val = hashes[i, j]
+            if count < kmin:
+                pos = count
+                count += 1
+            elif val < out[i, kmin - 1]:
+                pos = kmin - 1
+            else:
+                continue
+            # insertion sort step (k is expected to be small)
+            while pos > 0 and out[i, pos - 1] > val:
+                out[i, pos] = out[i, pos - 1]
+                pos -= 1
+            out[i, pos] = val
+        for j in range(count, kmin):
+            out[i, j] = out[i, count - 1]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def bottom_k_minhashes(uint64[:, :] hashes, Py_ssize_t kmin, out=None):
+    """Find k smallest hashes for every hash function
+
+    Equivalent to calling ``nsmallest(kmin, row)`` on every row of the input
+    matrix and padding the result with its last element, but runs without
+    holding the GIL.
+
+    :param hashes: matrix of shape (width, num_features)
+    :type hashes: numpy.ndarray
+    :param kmin: number of minima to keep
+    :type kmin: int
+    :param out: optional preallocated matrix of shape (width, kmin)
+    :type out: numpy.ndarray
+    :returns: matrix of shape (width, kmin)
+    :rtype: numpy.ndarray
+    """
+    if kmin < 1:
+        raise ValueError("kmin must be >= 1")
+    if hashes.shape[1] < 1:
+        raise ValueError("at least one hash per row required")
+    if out is None:
+        out = np.empty((hashes.shape[0], kmin), dtype=np.uint64)
+    cdef uint64[:, :] out_view = out
+    if out_view.shape[0] != hashes.shape[0] or out_view.shape[1] != kmin:
+        raise ValueError("output buffer must be of shape (width, kmin)")
+    with nogil:
+        _bottom_k(hashes, 0, hashes.shape[1], out_view)
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def bottom_k_minhashes_many(uint64[:, :] hashes, offsets, Py_ssize_t kmin):
+    """Same as bottom_k_minhashes but for column ranges of multiple documents
+
+    :param hashes: matrix of shape (width, total_features)
+    :type hashes: numpy.ndarray
+    :param offsets: starting column of every document (in increasing order)
+    :type offsets: collections.Sequence
+    :param kmin: number of minima to keep
+    :type kmin: int
+    :returns: array of shape (num_documents, width, kmin)
+    :rtype: numpy.ndarray
+    """
+    if kmin < 1:
+        raise ValueError("kmin must be >= 1")
+    cdef Py_ssize_t[:] starts = np.asarray(offsets, dtype=np.intp)
+    cdef Py_ssize_t num_docs = starts.shape[0]
+    cdef Py_ssize_t total = hashes.shape[1]
+    cdef Py_ssize_t d, stop
+    for d in range(num_docs):
+        stop = starts[d + 1] if d + 1 < num_docs else total
+        if stop <= starts[d]:
+            raise ValueError("at least one hash per document required")
+    result = np.empty((num_docs, hashes.shape[0], kmin), dtype=np.uint64)
+    cdef uint64[:, :, :] out = result
+    with nogil:
+        for d in range(num_docs):
+            stop = starts[d + 1] if d + 1 < num_docs else total
+            _bottom_k(hashes, starts[d], stop, out[d])
+    return result
+
+
 cpdef long2int(num):
     """Lossily map a long type to the range of int
 
@@ -1,9 +1,11 @@
 import random
 import sys
 import abc
+import numpy as np
 from struct import unpack
-from itertools import izip
+from itertools import izip, imap
 from hashlib import md5
+from lsh_hdc.ext import hash_combine_murmur_64, mix_hashes_64
 
 
 class IHashFamily(object):
@@ -84,6 +86,163 @@ class MultiplyHashFamily(IHashFamily):
             yield (a * (x >> 4) + b * x + c) % mod
 
 
+class UniversalHashFamily(IHashFamily):
+    """
+    A hash family that hashes each value only once with a base hash function
+    and derives the required number of hashes from the base value through
+    universal hashing of the form ``(a * x + b) mod 2 ** 64``. Because every
+    ``a`` is odd, each derived hash is a permutation of the 64-bit base space.
+
+    Unlike the other families here, this one can also hash many values at once
+    into a NumPy matrix (see ``hash_all``), which is what makes batch
+    minhashing possible.
+
+    >>> from metrohash import metrohash64
+    >>> uh = UniversalHashFamily(3, hashfun=metrohash64)
+    >>> list(uh.hashn("abc")) == uh.hash_all(["abc"])[:, 0].tolist()
+    True
+    """
+
+    def __init__(self, num_hashes, num_buckets=None, seed=0, bits=64,
+                 hashfun=None, complex_types=False):
+        if bits != 64:
+            raise ValueError("only 64-bit universal hashing is supported")
+        super(UniversalHashFamily, self).__init__(
+            num_hashes, num_buckets, seed, bits)
+        random.seed(seed)
+        self.num_buckets = num_buckets
+        self.seed = seed
+        self._hashfun = hashfun
+        self._complex_types = complex_types
+        self._params = [
+            (random.getrandbits(bits) | 1, random.getrandbits(bits))
+            for _ in xrange(num_hashes)]
+        self._coeffs_a = np.array([a for a, _ in self._params], dtype=np.uint64)
+        self._coeffs_b = np.array([b for _, b in self._params], dtype=np.uint64)
+
+    def hash_base(self, x):
+        """Hash a single value with the base hash function
+        """
+        if not self._complex_types:
+            x = hashable(x)
+        return self._hashfun(x, self.seed)
+
+    def hash_base_many(self, values):
+        """Hash a sequence of values into a vector of base hashes
+
+        :param values: values to hash
+        :type values: collections.Sequence
+        :rtype: numpy.ndarray
+        """
+        return np.fromiter(imap(self.hash_base, values), dtype=np.uint64,
+                           count=len(values))
+
+    def permute(self, base):
+        """Derive all hashes from a vector of base hashes
+
+        :param base: base hashes
+        :type base: numpy.ndarray
+        :returns: matrix of shape (num_hashes, len(base))
+        :rtype: numpy.ndarray
+        """
+        # uint64 arithmetic wraps around, giving us the modulo for free
+        result = np.outer(self._coeffs_a, base)
+        result += self._coeffs_b[:, None]
+        if self.num_buckets is not None:
+            result %= np.uint64(self.num_buckets)
+        return result
+
+    def hash_all(self, values):
+        """Hash a sequence of values with every function in the family
+
+        :param values: values to hash
+        :type values: collections.Sequence
+        :returns: matrix of shape (num_hashes, len(values))
+        :rtype: numpy.ndarray
+        """
+        return self.permute(self.hash_base_many(values))
+
+    def hashn(self, x):
+        mod = self.mod
+        num_buckets = self.num_buckets
+        base = self.hash_base(x)
+        for a, b in self._params:
+            result = (a * base + b) & mod
+            yield result if num_buckets is None else result % num_buckets
+
+    def create_hash_functions(self):
+        """Return a list of scalar hash functions, one per family member
+        """
+        def hash_factory(a, b):
+            mod = self.mod
+            num_buckets = self.num_buckets
+            hash_base = self.hash_base
+            if num_buckets is None:
+                return lambda x: (a * hash_base(x) + b) & mod
+            else:
+                return lambda x: ((a * hash_base(x) + b) & mod) % num_buckets
+        return [hash_factory(a, b) for a, b in self._params]
+
+
+class MurmurHashFamily(UniversalHashFamily):
+    """
+    A hash family that, like ``UniversalHashFamily``, hashes each value only
+    once with a base hash function, but derives the rest of the hashes by
+    mixing the base value with per-member random seeds using a Murmur-inspired
+    function (``hash_combine_murmur_64``). Unlike the affine transform of the
+    universal family, the mixing step is non-linear, and it is computed
+    natively without holding the GIL.
+
+    >>> from metrohash import metrohash64
+    >>> mh = MurmurHashFamily(3, hashfun=metrohash64)
+    >>> list(mh.hashn("abc")) == mh.hash_all(["abc"])[:, 0].tolist()
+    True
+    """
+
+    def __init__(self, num_hashes, num_buckets=None, seed=0, bits=64,
+                 hashfun=None, complex_types=False):
+        super(MurmurHashFamily, self).__init__(
+            num_hashes, num_buckets, seed=seed, bits=bits, hashfun=hashfun,
+            complex_types=complex_types)
+        random.seed(seed)
+        self._seeds = np.array(
+            [random.getrandbits(bits) for _ in xrange(num_hashes)],
+            dtype=np.uint64)
+
+    def permute(self, base):
+        """Derive all hashes from a vector of base hashes
+
+        :param base: base hashes
+        :type base: numpy.ndarray
+        :returns: matrix of shape (num_hashes, len(base))
+        :rtype: numpy.ndarray
+        """
+        result = mix_hashes_64(np.asarray(base, dtype=np.uint64), self._seeds)
+        if self.num_buckets is not None:
+            result %= np.uint64(self.num_buckets)
+        return result
+
+    def hashn(self, x):
+        num_buckets = self.num_buckets
+        base = self.hash_base(x)
+        for seed in self._seeds.tolist():
+            result = hash_combine_murmur_64(seed, base)
+            yield result if num_buckets is None else result % num_buckets
+
+    def create_hash_functions(self):
+        """Return a list of scalar hash functions, one per family member
+        """
+        def hash_factory(seed):
+            num_buckets = self.num_buckets
+            hash_base = self.hash_base
+            if num_buckets is None:
+                return lambda x: hash_combine_murmur_64(seed, hash_base(x))
+            else:
+                return lambda x: \
+                    hash_combine_murmur_64(seed, hash_base(x)) % num_buckets
+        return map(hash_factory, self._seeds.tolist())
+
+
 class HashCombiner(object):
 
     """use polynomial hashing to reduce a vector of hashes
@@ -0,0 +1,777 @@
+"""
+Persistent LSH indexes
+"""
+
+import os
+import json
+import numpy as np
+from itertools import izip
+from logging import getLogger
+from lsh_hdc import SIGNATURE_TABLE, LSHC, get_threshold
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+LOG = getLogger(__name__)
+
+
+INDEX_FORMAT_VERSION = 1
+
+# names of arrays making up a saved index (each stored as <name>.npy)
+INDEX_ARRAYS = ("keys", "doc_ids", "signatures", "labels")
+FOREST_ARRAYS = ("prefixes", "doc_ids", "rows", "labels")
+
+# maximum number of documents an index can hold (ids are 32-bit integers)
+MAX_DOCUMENTS = np.iinfo(np.int32).max
+
+
+class LSHIndex(object):
+    """A searchable table of LSH keys and minhash signatures
+
+    The index consists of a sorted array of 64-bit LSH keys with a parallel
+    array of document ids (one entry per band per document), a matrix of raw
+    minhash signatures (one row per document), and an array of document
+    labels. Lookups are done by binary search over the sorted keys, so an
+    index saved to disk can be memory-mapped and queried without loading it
+    into RAM.
+
+    Documents added to an index become searchable once ``commit`` is called.
+
+    >>> index = LSHIndex(width=12, bandwidth=3)
+    >>> index.add(set(["ab", "bc", "cd"]), "x")
+    >>> index.add(set(["xy", "yz"]), "y")
+    >>> index.commit()
+    >>> len(index)
+    2
+    >>> index.candidates(set(["ab", "bc", "cd"]))
+    ['x']
+    >>> index.query(set(["ab", "bc", "cd"]), k=1)
+    [('x', 1.0, 4)]
+    """
+
+    def __init__(self, width=12, bandwidth=3, lsh_scheme="a0",
+                 universe_size=None, kmin=1, seed=0, hashfun='metrohash',
+                 chunk_size=10000, signature='minhash', num_probes=0):
+        """
+        :param width: minhash signature width (including kmin)
+        :type width: int
+        :param bandwidth: LSH band size
+        :type bandwidth: int
+        :param lsh_scheme: LSH banding scheme (see ``LSHC``)
+        :type lsh_scheme: str
+        :param signature: signature type ("minhash", "oph", or "weighted",
+                          see ``lsh_hdc.SIGNATURE_TABLE``)
+        :type signature: str
+        :param chunk_size: number of added documents to buffer before
+                           converting them to compact arrays
+        :type chunk_size: int
+        :param num_probes: default number of perturbed signatures to look up
+                           keys of when querying (multi-probe LSH, see
+                           ``MinHashSignature.get_minhashes_with_probes``)
+        :type num_probes: int
+        """
+        self.params = dict(width=width, bandwidth=bandwidth,
+                           lsh_scheme=lsh_scheme, universe_size=universe_size,
+                           kmin=kmin, seed=seed, hashfun=hashfun,
+                           signature=signature, num_probes=num_probes)
+        lsh_hasher = LSHC(bandwidth, width=width, scheme=lsh_scheme) \
+            if bandwidth > 1 \
+            else None
+        self.signer = SIGNATURE_TABLE[signature](width,
+                                                 lsh_hasher=lsh_hasher,
+                                                 universe_size=universe_size,
+                                                 kmin=kmin,
+                                                 seed=seed,
+                                                 hashfun=hashfun)
+        if num_probes and not self.signer.multi_probe:
+            raise ValueError("Signature type %s does not support multi-probe "
+                             "LSH" % signature)
+        self.chunk_size = chunk_size
+        self.num_probes = num_probes
+
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._doc_ids = np.empty(0, dtype=np.int32)
+        self._signatures = np.empty((0, width), dtype=np.uint64)
+        self._labels = None
+
+        # documents added since last commit
+        self._pending_sigs = []
+        self._pending_labels = []
+        self._chunks = []
+
+    def __len__(self):
+        """Number of committed documents"""
+        return len(self._signatures)
+
+    def _get_keys(self, minhashes):
+        """Return LSH keys for a minhash signature
+
+        :rtype: numpy.ndarray
+        """
+        signature = np.asarray(minhashes, dtype=np.uint64)
+        return self.signer.get_keys_batch(signature.reshape(1, -1))[0]
+
+    def _get_query_keys(self, vec, num_probes):
+        """Return minhashes of a feature vector and keys to look up (including
+        keys of perturbed signatures when ``num_probes`` is non-zero)
+
+        :rtype: tuple
+        """
+        if num_probes is None:
+            num_probes = self.num_probes
+        signer = self.signer
+        if not num_probes:
+            minhashes = signer.get_minhashes(vec)
+            return minhashes, self._get_keys(minhashes)
+        minhashes, perturbations = signer.get_minhashes_with_probes(
+            vec, num_probes)
+        probe_keys = np.array(signer.get_probe_keys(minhashes, perturbations),
+                              dtype=np.uint64)
+        return minhashes, np.concatenate([self._get_keys(minhashes),
+                                          probe_keys])
+
+    def add(self, vec, label):
+        """Add a document to the index
+
+        :param vec: feature vector (e.g. a set of shingles)
+        :type vec: collections.Iterable
+        :param label: document label (labels must be either all numbers or
+                      all strings)
+        """
+        self.add_signature(self.signer.get_minhashes(vec), label)
+
+    def add_signature(self, minhashes, label):
+        """Add a document to the index given its minhash signature
+
+        :param minhashes: raw minhashes (as returned by
+                          ``MinHashSignature.get_minhashes``)
+        :type minhashes: list
+        :param label: document label
+        """
+        self._pending_sigs.append(minhashes)
+        self._pending_labels.append(label)
+        if len(self._pending_sigs) >= self.chunk_size:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        """Convert buffered documents to a chunk of arrays"""
+        if not self._pending_sigs:
+            return
+        signatures = np.array(self._pending_sigs, dtype=np.uint64)
+        keys = self.signer.get_keys_batch(signatures)
+        labels = np.asarray(self._pending_labels)
+        if labels.dtype == object:
+            raise TypeError("Labels must be either all numbers or all strings")
+        self._chunks.append((keys, signatures, labels))
+        self._pending_sigs = []
+        self._pending_labels = []
+
+    def commit(self):
+        """Merge documents added since last commit into the index
+
+        Note that committing to an index loaded from disk reads all of it
+        into memory.
+        """
+        self._flush_pending()
+        if not self._chunks:
+            return
+        chunk_keys, chunk_sigs, chunk_labels = zip(*self._chunks)
+        self._chunks = []
+
+        first_id = len(self)
+        num_new = sum(len(sigs) for sigs in chunk_sigs)
+        if first_id + num_new > MAX_DOCUMENTS:
+            raise OverflowError("Too many documents for index: %d"
+                                % (first_id + num_new))
+        new_keys = np.concatenate([keys.ravel() for keys in chunk_keys])
+        num_bands = len(new_keys) // num_new
+        new_ids = np.repeat(np.arange(first_id, first_id + num_new,
+                                      dtype=np.int32), num_bands)
+
+        # stable sort keeps entries under the same key ordered by document id
+        keys = np.concatenate([self._keys, new_keys])
+        doc_ids = np.concatenate([self._doc_ids, new_ids])
+        order = np.argsort(keys, kind='mergesort')
+        self._keys = keys[order]
+        self._doc_ids = doc_ids[order]
+        self._signatures = np.concatenate((self._signatures,) + chunk_sigs)
+        labels = chunk_labels if self._labels is None \
+            else (self._labels,) + chunk_labels
+        self._labels = np.concatenate(labels)
+        LOG.info("Committed %d documents to index (%d total)",
+                 num_new, len(self))
+
+    def _lookup(self, keys):
+        """Return ids of documents having any of the given keys
+
+        :param keys: LSH keys
+        :type keys: numpy.ndarray
+        :returns: document ids (a document is repeated once for every key
+                  it shares with the query)
+        :rtype: numpy.ndarray
+        """
+        index_keys = self._keys
+        starts = np.searchsorted(index_keys, keys, side='left')
+        stops = np.searchsorted(index_keys, keys, side='right')
+        doc_ids = self._doc_ids
+        found = [doc_ids[start:stop]
+                 for start, stop in izip(starts, stops) if stop > start]
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate(found)
+
+    def candidates(self, vec, num_probes=None):
+        """Return labels of documents sharing at least one LSH key with a
+        feature vector
+
+        :param vec: feature vector
+        :type vec: collections.Iterable
+        :param num_probes: number of perturbed signatures to also look up
+                           keys of (defaults to ``num_probes`` given to
+                           constructor)
+        :type num_probes: int
+        :rtype: list
+        """
+        _, keys = self._get_query_keys(vec, num_probes)
+        doc_ids = np.unique(self._lookup(keys))
+        if not len(doc_ids):
+            return []
+        return self._labels[doc_ids].tolist()
+
+    def query(self, vec, k=10, threshold=0.0, num_probes=None):
+        """Find indexed documents similar to a feature vector
+
+        :param vec: feature vector (e.g. a set of shingles)
+        :type vec: collections.Iterable
+        :param k: maximum number of results to return (all if None)
+        :type k: int
+        :param threshold: minimum estimated Jaccard similarity
+        :type threshold: float
+        :param num_probes: number of perturbed signatures to also look up
+                           keys of (defaults to ``num_probes`` given to
+                           constructor)
+        :type num_probes: int
+        :returns: a list of (label, similarity, support) tuples (see
+                  ``query_signature``)
+        :rtype: list
+        """
+        minhashes, keys = self._get_query_keys(vec, num_probes)
+        return self.query_signature(minhashes, k=k, threshold=threshold,
+                                    keys=keys)
+
+    def query_signature(self, minhashes, k=10, threshold=0.0, keys=None):
+        """Find indexed documents similar to a given minhash signature
+
+        Candidates are all documents sharing at least one LSH key with the
+        query. They are ranked by estimated Jaccard similarity (the fraction
+        of positions at which their minhash signatures agree with the query
+        signature), and then by support (the number of LSH keys they share
+        with the query).
+
+        :param minhashes: raw minhashes (as returned by
+                          ``MinHashSignature.get_minhashes``)
+        :type minhashes: list
+        :param k: maximum number of results to return (all if None)
+        :type k: int
+        :param threshold: minimum estimated Jaccard similarity
+        :type threshold: float
+        :param keys: LSH keys to look up (defaults to keys of the signature)
+        :type keys: numpy.ndarray
+        :returns: a list of (label, similarity, support) tuples
+        :rtype: list
+        """
+        signature = np.asarray(minhashes, dtype=np.uint64)
+        if keys is None:
+            keys = self._get_keys(signature)
+        found = self._lookup(keys)
+        if not len(found):
+            return []
+        doc_ids, support = np.unique(found, return_counts=True)
+        similarity = (self._signatures[doc_ids] == signature).mean(axis=1)
+        selected = similarity >= threshold
+        doc_ids = doc_ids[selected]
+        support = support[selected]
+        similarity = similarity[selected]
+        order = np.lexsort((doc_ids, -support, -similarity))[:k]
+        labels = self._labels[doc_ids[order]].tolist()
+        return zip(labels, similarity[order].tolist(), support[order].tolist())
+
+    def save(self, path):
+        """Save index to a directory (creating it if necessary)
+
+        Pending documents are committed first. The saved index is replaced
+        atomically (see ``_save_arrays``), so it is safe to save an index to
+        the directory it was loaded from.
+
+        :param path: directory name
+        :type path: str
+        """
+        self.commit()
+        arrays = dict(keys=self._keys,
+                      doc_ids=self._doc_ids,
+                      signatures=self._signatures,
+                      labels=self._labels
+                      if self._labels is not None
+                      else np.empty(0, dtype=np.int64))
+        _save_arrays(path, arrays, INDEX_ARRAYS,
+                     dict(self.params, num_docs=len(self)))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load index from a directory
+
+        :param path: directory name
+        :type path: str
+        :param mmap: whether to memory-map index arrays instead of reading
+                     them into memory
+        :type mmap: bool
+        :rtype: LSHIndex
+        """
+        return _load_arrays(cls, path, INDEX_ARRAYS, mmap)
+
+
+class LSHForest(object):
+    """A prefix-tree (LSH Forest) index of minhash signatures
+
+    Signatures are split into ``num_trees`` groups ("trees") of ``depth``
+    consecutive minhashes. For every tree, the index keeps the group's
+    minhashes of all documents sorted lexicographically, which is a flat
+    representation of a prefix tree: documents agreeing with a query on the
+    first ``p`` minhashes of a tree occupy a contiguous range of rows, found
+    by binary search one minhash at a time. Unlike with ``LSHIndex``, where
+    band size is fixed at construction, prefix length (the effective band
+    size) is chosen at query time. One index can therefore be queried at any
+    similarity threshold, or for the top ``k`` most similar documents by
+    shortening prefixes until enough candidates are found.
+
+    Minhashes are stored column by column, so that binary searches only touch
+    contiguous memory and an index saved to disk can be memory-mapped.
+    Signatures of candidates are read back from the trees for estimating
+    similarity, so they are not stored separately.
+
+    Documents added to an index become searchable once ``commit`` is called.
+
+    >>> forest = LSHForest(width=16, num_trees=4)
+    >>> forest.add(set(["ab", "bc", "cd", "de"]), "x")
+    >>> forest.add(set(["xy", "yz"]), "y")
+    >>> forest.commit()
+    >>> forest.query(set(["ab", "bc", "cd", "de"]), k=1)
+    [('x', 1.0, 4)]
+    >>> forest.candidates(set(["ab", "bc", "cd", "de"]), threshold=0.8)
+    ['x']
+    """
+
+    def __init__(self, width=64, num_trees=8, universe_size=None, kmin=1,
+                 seed=0, hashfun='metrohash', chunk_size=10000,
+                 signature='minhash'):
+        """
+        :param width: minhash signature width (including kmin)
+        :type width: int
+        :param num_trees: number of prefix trees (must divide width)
+        :type num_trees: int
+        :param signature: signature type ("minhash", "oph", or "weighted",
+                          see ``lsh_hdc.SIGNATURE_TABLE``)
+        :type signature: str
+        :param chunk_size: number of added documents to buffer before
+                           converting them to compact arrays
+        :type chunk_size: int
+        """
+        if width % num_trees != 0:
+            raise ValueError("width must be a multiple of num_trees")
+        self.params = dict(width=width, num_trees=num_trees,
+                           universe_size=universe_size, kmin=kmin, seed=seed,
+                           hashfun=hashfun, signature=signature)
+        self.signer = SIGNATURE_TABLE[signature](width,
+                                                 universe_size=universe_size,
+                                                 kmin=kmin,
+                                                 seed=seed,
+                                                 hashfun=hashfun)
+        self.num_trees = num_trees
+        self.depth = width // num_trees
+        self.chunk_size = chunk_size
+
+        # minhashes of every tree sorted by prefix, of shape
+        # (num_trees, depth, number of documents)
+        self._prefixes = np.empty((num_trees, self.depth, 0), dtype=np.uint64)
+        # ids of documents in every row of every tree
+        self._doc_ids = np.empty((num_trees, 0), dtype=np.int32)
+        # rows of every document in every tree (inverse of _doc_ids)
+        self._rows = np.empty((num_trees, 0), dtype=np.int32)
+        self._labels = None
+
+        # documents added since last commit
+        self._pending_sigs = []
+        self._pending_labels = []
+        self._chunks = []
+
+    def __len__(self):
+        """Number of committed documents"""
+        return self._doc_ids.shape[1]
+
+    def get_depth(self, threshold):
+        """Return prefix length approximating a similarity threshold
+
+        :param threshold: Jaccard similarity threshold
+        :type threshold: float
+        :rtype: int
+        """
+        num_trees = self.num_trees
+        return min(xrange(1, self.depth + 1), key=lambda depth: abs(
+            get_threshold(depth, num_trees) - threshold))
+
+    def add(self, vec, label):
+        """Add a document to the index
+
+        :param vec: feature vector (e.g. a set of shingles)
+        :type vec: collections.Iterable
+        :param label: document label (labels must be either all numbers or
+                      all strings)
+        """
+        self.add_signature(self.signer.get_minhashes(vec), label)
+
+    def add_signature(self, minhashes, label):
+        """Add a document to the index given its minhash signature
+
+        :param minhashes: raw minhashes (as returned by
+                          ``MinHashSignature.get_minhashes``)
+        :type minhashes: list
+        :param label: document label
+        """
+        self._pending_sigs.append(minhashes)
+        self._pending_labels.append(label)
+        if len(self._pending_sigs) >= self.chunk_size:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        """Convert buffered documents to a chunk of arrays"""
+        if not self._pending_sigs:
+            return
+        signatures = np.array(self._pending_sigs, dtype=np.uint64)
+        labels = np.asarray(self._pending_labels)
+        if labels.dtype == object:
+            raise TypeError("Labels must be either all numbers or all strings")
+        self._chunks.append((signatures, labels))
+        self._pending_sigs = []
+        self._pending_labels = []
+
+    def _get_signatures(self, doc_ids):
+        """Read minhash signatures of documents back from the trees
+
+        :returns: a matrix of shape (number of documents, width)
+        :rtype: numpy.ndarray
+        """
+        return np.concatenate([prefixes[:, rows[doc_ids]]
+                               for prefixes, rows
+                               in izip(self._prefixes, self._rows)]).T
+
+    def commit(self):
+        """Merge documents added since last commit into the index
+
+        Trees are re-sorted in full, and committing to an index loaded from
+        disk reads all of it into memory.
+        """
+        self._flush_pending()
+        if not self._chunks:
+            return
+        chunk_sigs, chunk_labels = zip(*self._chunks)
+        self._chunks = []
+
+        num_new = sum(len(sigs) for sigs in chunk_sigs)
+        num_docs = len(self) + num_new
+        if num_docs > MAX_DOCUMENTS:
+            raise OverflowError("Too many documents for index: %d" % num_docs)
+        signatures = np.concatenate(
+            (self._get_signatures(np.arange(len(self))),) + chunk_sigs)
+        depth = self.depth
+        prefixes = np.empty((self.num_trees, depth, num_docs), dtype=np.uint64)
+        doc_ids = np.empty((self.num_trees, num_docs), dtype=np.int32)
+        rows = np.empty((self.num_trees, num_docs), dtype=np.int32)
+        all_rows = np.arange(num_docs, dtype=np.int32)
+        for tree in xrange(self.num_trees):
+            columns = signatures[:, tree * depth:(tree + 1) * depth].T
+            # lexsort orders by last key first (ties keep document order)
+            order = np.lexsort(columns[::-1])
+            prefixes[tree] = columns[:, order]
+            doc_ids[tree] = order
+            rows[tree, order] = all_rows
+        self._prefixes = prefixes
+        self._doc_ids = doc_ids
+        self._rows = rows
+        labels = chunk_labels if self._labels is None \
+            else (self._labels,) + chunk_labels
+        self._labels = np.concatenate(labels)
+        LOG.info("Committed %d documents to forest (%d total)",
+                 num_new, num_docs)
+
+    def _prefix_ranges(self, tree, signature):
+        """Return row ranges of a tree matching prefixes of a signature
+
+        :returns: a list of (start, stop) tuples, one for every prefix length
+                  from zero up to the length of the longest matching prefix
+        :rtype: list
+        """
+        prefixes = self._prefixes[tree]
+        offset = tree * self.depth
+        start, stop = 0, prefixes.shape[1]
+        ranges = [(start, stop)]
+        for column in xrange(self.depth):
+            values = prefixes[column, start:stop]
+            value = signature[offset + column]
+            start, stop = (start + np.searchsorted(values, value, 'left'),
+                           start + np.searchsorted(values, value, 'right'))
+            if start == stop:
+                break
+            ranges.append((start, stop))
+        return ranges
+
+    def _match(self, all_ranges, depth):
+        """Return ids of documents matching at a prefix length and numbers of
+        trees they match in
+
+        :rtype: tuple
+        """
+        found = [doc_ids[ranges[depth][0]:ranges[depth][1]]
+                 for doc_ids, ranges in izip(self._doc_ids, all_ranges)
+                 if len(ranges) > depth]
+        if not found:
+            empty = np.empty(0, dtype=np.int32)
+            return empty, empty
+        return np.unique(np.concatenate(found), return_counts=True)
+
+    def candidates(self, vec, threshold=None, depth=None):
+        """Return labels of documents sharing a prefix with a feature vector
+        in at least one tree
+
+        :param vec: feature vector
+        :type vec: collections.Iterable
+        :param threshold: Jaccard similarity threshold to choose prefix length
+                          for (see ``get_depth``)
+        :type threshold: float
+        :param depth: prefix length (the full tree depth if neither threshold
+                      nor depth are given)
+        :type depth: int
+        :rtype: list
+        """
+        if depth is None:
+            depth = self.depth if threshold is None \
+                else self.get_depth(threshold)
+        signature = np.asarray(self.signer.get_minhashes(vec),
+                               dtype=np.uint64)
+        all_ranges = [self._prefix_ranges(tree, signature)
+                      for tree in xrange(self.num_trees)]
+        doc_ids, _ = self._match(all_ranges, depth)
+        if not len(doc_ids):
+            return []
+        return self._labels[doc_ids].tolist()
+
+    def query(self, vec, k=10, threshold=None, min_candidates=None):
+        """Find indexed documents similar to a feature vector
+
+        When ``threshold`` is given, candidates are documents sharing a prefix
+        of length ``get_depth(threshold)`` with the query in at least one tree,
+        and those with estimated similarity below threshold are dropped.
+        Otherwise prefixes are shortened starting from the full tree depth
+        until at least ``min_candidates`` documents are found (by default
+        twice ``k``). Candidates are ranked by estimated Jaccard similarity,
+        and then by support (the number of trees they were found in).
+
+        :param vec: feature vector (e.g. a set of shingles)
+        :type vec: collections.Iterable
+        :param k: maximum number of results to return (all if None)
+        :type k: int
+        :param threshold: minimum estimated Jaccard similarity
+        :type threshold: float
+        :param min_candidates: number of candidates to collect when no
+                               threshold is given
+        :type min_candidates: int
+        :returns: a list of (label, similarity, support) tuples
+        :rtype: list
+        """
+        return self.query_signature(self.signer.get_minhashes(vec), k=k,
+                                    threshold=threshold,
+                                    min_candidates=min_candidates)
+
+    def query_signature(self, minhashes, k=10, threshold=None,
+                        min_candidates=None):
+        """Find indexed documents similar to a given minhash signature
+
+        :param minhashes: raw minhashes (as returned by
+                          ``MinHashSignature.get_minhashes``)
+        :type minhashes: list
+        :returns: a list of (label, similarity, support) tuples (see
+                  ``query``)
+        :rtype: list
+        """
+        if not len(self):
+            return []
+        signature = np.asarray(minhashes, dtype=np.uint64)
+        all_ranges = [self._prefix_ranges(tree, signature)
+                      for tree in xrange(self.num_trees)]
+        if threshold is not None:
+            doc_ids, support = self._match(all_ranges, self.get_depth(threshold))
+        else:
+            threshold = 0.0
+            if min_candidates is None:
+                min_candidates = 2 * k if k is not None else len(self)
+            doc_ids = ()
+            for depth in xrange(max(map(len, all_ranges)) - 1, 0, -1):
+                doc_ids, support = self._match(all_ranges, depth)
+                if len(doc_ids) >= min_candidates:
+                    break
+        if not len(doc_ids):
+            return []
+        similarity = (self._get_signatures(doc_ids) == signature).mean(axis=1)
+        selected = similarity >= threshold
+        doc_ids = doc_ids[selected]
+        support = support[selected]
+        similarity = similarity[selected]
+        order = np.lexsort((doc_ids, -support, -similarity))[:k]
+        labels = self._labels[doc_ids[order]].tolist()
+        return zip(labels, similarity[order].tolist(), support[order].tolist())
+
+    def get_clusters(self, threshold=None, depth=None):
+        """Group indexed documents sharing a prefix in any tree
+
+        Documents sharing a prefix of given length (chosen for a similarity
+        threshold as in ``candidates``) are placed into the same cluster, as
+        are documents sharing an LSH key in ``Cluster``. This allows
+        clustering a corpus at different thresholds without re-indexing it.
+
+        :param threshold: Jaccard similarity threshold to choose prefix length
+                          for (see ``get_depth``)
+        :type threshold: float
+        :param depth: prefix length
+        :type depth: int
+        :returns: a list of clusters (lists of labels)
+        :rtype: list
+        """
+        if depth is None:
+            depth = self.depth if threshold is None \
+                else self.get_depth(threshold)
+        num_docs = len(self)
+        if not num_docs:
+            return []
+        # link every document to the first document of its prefix run
+        firsts = []
+        others = []
+        for prefixes, doc_ids in izip(self._prefixes, self._doc_ids):
+            starts = np.zeros(num_docs, dtype=bool)
+            starts[0] = True
+            for column in prefixes[:depth]:
+                starts[1:] |= column[1:] != column[:-1]
+            start_rows = np.flatnonzero(starts)
+            run_firsts = start_rows[np.cumsum(starts) - 1]
+            linked = ~starts
+            firsts.append(doc_ids[run_firsts[linked]])
+            others.append(doc_ids[linked])
+        firsts = np.concatenate(firsts)
+        graph = coo_matrix((np.ones(len(firsts), dtype=np.int8),
+                            (firsts, np.concatenate(others))),
+                           shape=(num_docs, num_docs))
+        _, cluster_ids = connected_components(graph, directed=False)
+        order = np.argsort(cluster_ids, kind='mergesort')
+        boundaries = np.flatnonzero(np.diff(cluster_ids[order])) + 1
+        labels = self._labels
+        return [labels[group].tolist() for group in np.split(order, boundaries)]
+
+    def save(self, path):
+        """Save index to a directory (creating it if necessary)
+
+        Pending documents are committed first. The saved index is replaced
+        atomically (see ``_save_arrays``), so it is safe to save an index to
+        the directory it was loaded from.
+
+        :param path: directory name
+        :type path: str
+        """
+        self.commit()
+        arrays = dict(prefixes=self._prefixes,
+                      doc_ids=self._doc_ids,
+                      rows=self._rows,
+                      labels=self._labels
+                      if self._labels is not None
+                      else np.empty(0, dtype=np.int64))
+        _save_arrays(path, arrays, FOREST_ARRAYS,
+                     dict(self.params, num_docs=len(self)))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load index from a directory
+
+        :param path: directory name
+        :type path: str
+        :param mmap: whether to memory-map index arrays instead of reading
+                     them into memory
+        :type mmap: bool
+        :rtype: LSHForest
+        """
+        return _load_arrays(cls, path, FOREST_ARRAYS, mmap)
+
+
+def _array_path(path, name, generation):
+    """Return name of the file holding an array of a given index generation
+    """
+    filename = name + ".npy" if generation is None \
+        else "%s.%d.npy" % (name, generation)
+    return os.path.join(path, filename)
+
+
+def _read_meta(path):
+    """Read index metadata from a directory
+
+    :rtype: dict
+    """
+    with open(os.path.join(path, "meta.json"), "r") as fhandle:
+        return json.load(fhandle)
+
+
+def _save_arrays(path, arrays, names, meta):
+    """Save named arrays and metadata of an index to a directory
+
+    Arrays are written to files of a new generation, and then the metadata
+    file, which records the generation, is atomically replaced by renaming.
+    Interrupted saves therefore leave the previous version of the index
+    intact. Files of the previous generation are removed afterwards.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        # saves predating generations have generation None
+        old_generation = _read_meta(path).get("generation")
+        generation = 0 if old_generation is None else old_generation + 1
+        old_paths = [_array_path(path, name, old_generation) for name in names]
+    else:
+        generation = 0
+        old_paths = []
+    for name in names:
+        with open(_array_path(path, name, generation), "wb") as fhandle:
+            np.save(fhandle, arrays[name])
+    meta = dict(meta, version=INDEX_FORMAT_VERSION, generation=generation)
+    with open(meta_path + ".tmp", "w") as fhandle:
+        json.dump(meta, fhandle, sort_keys=True)
+    os.rename(meta_path + ".tmp", meta_path)
+    for old_path in old_paths:
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+
+def _load_arrays(cls, path, names, mmap):
+    """Create an index of a given class from a directory written by
+    ``_save_arrays`` (arrays are set as attributes prefixed with underscore)
+    """
+    meta = _read_meta(path)
+    version = meta.pop("version")
+    if version != INDEX_FORMAT_VERSION:
+        raise ValueError("Unsupported index format version: %s" % version)
+    num_docs = meta.pop("num_docs")
+    generation = meta.pop("generation", None)
+    index = cls(**{str(key): value for key, value in meta.iteritems()})
+    if num_docs == 0:
+        return index
+    mmap_mode = "r" if mmap else None
+    for name in names:
+        setattr(index, "_" + name,
+                np.load(_array_path(path, name, generation),
+                        mmap_mode=mmap_mode))
+    return index
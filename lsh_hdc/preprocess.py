@@ -1,10 +1,59 @@
+import sys
+import numpy as np
 import regex as re
 
 
+# lookup tables of word characters keyed by (pattern, flags)
+_CHAR_TABLES = {}
+
+
+def get_char_table(pattern, flags=re.UNICODE):
+    """Return a lookup table of characters matched by a one-character pattern
+
+    :param pattern: regular expression matching a single character
+    :type pattern: unicode
+    :param flags: regular expression flags
+    :type flags: int
+    :returns: an array whose i-th element is 1 if pattern matches the
+              character with code point i and 0 otherwise
+    :rtype: numpy.ndarray
+
+    >>> table = get_char_table(u'\\\\w')
+    >>> table[ord(u'a')], table[ord(u'_')], table[ord(u' ')]
+    (1, 1, 0)
+    """
+    key = (pattern, flags)
+    table = _CHAR_TABLES.get(key)
+    if table is None:
+        all_chars = u''.join(map(unichr, xrange(sys.maxunicode + 1)))
+        table = np.zeros(len(all_chars), dtype=np.uint8)
+        for match in re.compile(pattern, flags).finditer(all_chars):
+            if match.end() - match.start() != 1:
+                raise ValueError("Pattern must match single characters")
+            table[match.start()] = 1
+        _CHAR_TABLES[key] = table
+    return table
+
+
 class RegexTokenizer(object):
 
     def __init__(self, pattern=u'\\w+', ignore_case=False):
         flags = re.UNICODE
         if ignore_case:
             flags |= re.IGNORECASE
+        self.pattern = pattern
+        self.flags = flags
         self.tokenize = re.compile(pattern, flags).findall
+
+    def get_char_table(self):
+        """Return lookup table of token characters (see ``get_char_table``)
+
+        Only patterns of form ``X+``, where ``X`` matches a single character,
+        are supported.
+
+        :rtype: numpy.ndarray
+        """
+        pattern = self.pattern
+        if not pattern.endswith(u'+') or pattern.endswith(u'\\+'):
+            raise ValueError("Unsupported pattern: %s" % pattern)
+        return get_char_table(pattern[:-1], self.flags)
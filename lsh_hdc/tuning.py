@@ -0,0 +1,285 @@
+"""
+Selection of LSH parameters
+
+Given a target similarity threshold, ``LSHTuner`` evaluates candidate
+signature configurations (signature width, band size, and banding scheme) in
+terms of expected false positive and false negative rates and of measured
+processing cost on a sample of documents, and returns the Pareto-optimal ones
+as configuration dictionaries for ``HDClustering``.
+"""
+
+import time
+import copy
+import numpy as np
+from itertools import product
+from logging import getLogger
+from lsh_hdc import create_sig_bands
+from lsh_hdc.cluster import HDClustering
+
+
+LOG = getLogger(__name__)
+
+
+# configuration used for keys not being tuned when no base is given
+DEFAULT_BASE_CFG = {
+    "min_support": 1,
+    "shingler": {"span": 3, "skip": 0, "unique": True},
+    "sketch": {"enabled": False},
+}
+
+
+def s_curve(similarity, rows, bands):
+    """Probability that two signatures share at least one band
+
+    Applies to non-overlapping bands (scheme "a0").
+
+    :param similarity: Jaccard similarity
+    :type similarity: float, numpy.ndarray
+    :param rows: rows per band
+    :type rows: int
+    :param bands: number of bands
+    :type bands: int
+    :rtype: float, numpy.ndarray
+
+    >>> round(s_curve(0.5, 4, 16), 4)
+    0.6439
+    """
+    return 1.0 - (1.0 - similarity ** rows) ** bands
+
+
+def collision_probability(similarities, band_matrix, min_support=1,
+                          num_trials=1000, seed=0):
+    """Estimate probability of two signatures sharing at least
+    ``min_support`` bands
+
+    Positions of two signatures are assumed to agree independently with
+    probability equal to Jaccard similarity. Works with any banding scheme,
+    including overlapping ones for which the S-curve does not apply.
+
+    :param similarities: Jaccard similarities to evaluate at
+    :type similarities: numpy.ndarray
+    :param band_matrix: matrix of signature indices (one row per band)
+    :type band_matrix: numpy.ndarray
+    :param num_trials: number of simulated signature pairs per similarity
+    :type num_trials: int
+    :rtype: numpy.ndarray
+    """
+    band_matrix = np.asarray(band_matrix, dtype=np.intp)
+    width = band_matrix.max() + 1
+    rng = np.random.RandomState(seed)
+    result = np.empty(len(similarities))
+    for idx, similarity in enumerate(similarities):
+        agree = rng.random_sample((num_trials, width)) < similarity
+        band_hits = agree[:, band_matrix].all(axis=2).sum(axis=1)
+        result[idx] = np.mean(band_hits >= min_support)
+    return result
+
+
+class LSHTuner(object):
+    """Search for LSH parameters achieving a similarity threshold cheaply
+
+    The false negative rate of a configuration is the mean probability of
+    two documents not becoming candidates over similarities above threshold,
+    and the false positive rate is the mean probability of them becoming
+    candidates over similarities below threshold (both assuming similarity
+    to be uniformly distributed). Cost is measured by signing a sample of
+    documents and inserting their keys into LSH buckets, using the settings
+    of the configuration that would be returned.
+
+    ``kmin`` is not tuned: error rates are estimated assuming every signature
+    position to agree with probability equal to Jaccard similarity, which
+    does not capture the effect of taking several minima per hash function,
+    so configurations differing only in ``kmin`` could not be told apart.
+
+    >>> tuner = LSHTuner(0.5, widths=[12], bandwidths=[2, 3], schemes=["a0"])
+    >>> sample = [set(["ab", "bc", "cd"]), set(["bc", "cd", "de"])]
+    >>> cfgs = tuner.tune(sample)
+    >>> all(cfg['sig_width'] == 12 for cfg in cfgs)
+    True
+    """
+
+    def __init__(self, threshold, max_fp_rate=0.1, max_fn_rate=0.1,
+                 widths=(32, 64, 96, 128), bandwidths=(2, 3, 4, 5, 6),
+                 schemes=("a0", "a1"), kmin=1, min_support=1,
+                 num_trials=1000, grid_size=41, seed=0):
+        """
+        :param threshold: target Jaccard similarity threshold
+        :type threshold: float
+        :param max_fp_rate: maximum acceptable false positive rate
+        :type max_fp_rate: float
+        :param max_fn_rate: maximum acceptable false negative rate
+        :type max_fn_rate: float
+        :param widths: signature widths to consider
+        :type widths: collections.Iterable
+        :param bandwidths: band sizes to consider
+        :type bandwidths: collections.Iterable
+        :param schemes: banding schemes to consider (see ``LSHC``)
+        :type schemes: collections.Iterable
+        :param kmin: kmin to use in all configurations (widths not divisible
+                     by it are skipped)
+        :type kmin: int
+        :param num_trials: number of simulated pairs per similarity value
+                           (for schemes other than "a0")
+        :type num_trials: int
+        :param grid_size: number of similarity values to evaluate at
+        :type grid_size: int
+        """
+        if not 0.0 < threshold < 1.0:
+            raise ValueError("threshold must be between 0 and 1")
+        self.threshold = threshold
+        self.max_fp_rate = max_fp_rate
+        self.max_fn_rate = max_fn_rate
+        self.widths = widths
+        self.bandwidths = bandwidths
+        self.schemes = schemes
+        self.kmin = kmin
+        self.min_support = min_support
+        self.num_trials = num_trials
+        self.seed = seed
+        self._similarities = np.linspace(0.0, 1.0, grid_size)
+        # statistics of all evaluated configurations (set by tune)
+        self.results = []
+
+    def candidates(self):
+        """Generate valid (width, bandwidth, scheme) tuples
+        """
+        for width, bandwidth, scheme in product(
+                self.widths, self.bandwidths, self.schemes):
+            if width % self.kmin != 0 or bandwidth > width:
+                continue
+            try:
+                create_sig_bands(width, bandwidth, scheme)
+            except ValueError:
+                continue
+            yield width, bandwidth, scheme
+
+    def error_rates(self, width, bandwidth, scheme):
+        """Return expected false positive and false negative rates
+
+        :rtype: tuple
+        """
+        similarities = self._similarities
+        bands = [band for _, band in create_sig_bands(width, bandwidth, scheme)]
+        if scheme == "a0" and self.min_support == 1:
+            probs = s_curve(similarities, bandwidth, len(bands))
+        else:
+            probs = collision_probability(
+                similarities, bands, min_support=self.min_support,
+                num_trials=self.num_trials, seed=self.seed)
+        above = similarities >= self.threshold
+        fp_rate = float(np.mean(probs[~above])) if (~above).any() else 0.0
+        fn_rate = float(np.mean(1.0 - probs[above])) if above.any() else 0.0
+        return fp_rate, fn_rate
+
+    def measure_cost(self, width, bandwidth, scheme, sample, base_cfg=None):
+        """Measure time (in seconds per document) of signing a sample and
+        adding its keys to LSH buckets
+
+        Signer and cluster builder are those of ``HDClustering`` configured
+        with what ``make_cfg`` returns for ``base_cfg``, so hash function,
+        signature type, and bucketing settings are taken into account. Since
+        the sample consists of feature vectors, tokenizing, shingling, and
+        sketching are not measured.
+
+        :rtype: tuple
+        """
+        result = dict(width=width, bandwidth=bandwidth, scheme=scheme,
+                      kmin=self.kmin)
+        hdc = HDClustering(self.make_cfg(result, base_cfg), seed=self.seed)
+        signer = hdc.signer
+        num_docs = float(max(len(sample), 1))
+
+        start = time.time()
+        keys = [signer.get_signature(vec) for vec in sample]
+        sign_time = (time.time() - start) / num_docs
+
+        cluster = hdc.cluster_builder
+        start = time.time()
+        for label, doc_keys in enumerate(keys):
+            cluster.add_item(doc_keys, label=label)
+        bucket_time = (time.time() - start) / num_docs
+        return sign_time, bucket_time
+
+    def evaluate(self, width, bandwidth, scheme, sample, base_cfg=None):
+        """Evaluate a configuration
+
+        :returns: a dictionary of configuration parameters, error rates, and
+                  costs
+        :rtype: dict
+        """
+        fp_rate, fn_rate = self.error_rates(width, bandwidth, scheme)
+        sign_time, bucket_time = self.measure_cost(
+            width, bandwidth, scheme, sample, base_cfg)
+        return dict(width=width, bandwidth=bandwidth, scheme=scheme,
+                    kmin=self.kmin, fp_rate=fp_rate, fn_rate=fn_rate,
+                    sign_time=sign_time, bucket_time=bucket_time,
+                    cost=sign_time + bucket_time)
+
+    @staticmethod
+    def pareto_front(results, objectives=("fp_rate", "fn_rate", "cost")):
+        """Return results not dominated by any other result
+
+        :param results: a list of dictionaries
+        :type results: list
+        :param objectives: keys of values to minimize
+        :type objectives: collections.Sequence
+        :rtype: list
+
+        >>> results = [dict(a=1, b=2), dict(a=2, b=1), dict(a=2, b=2)]
+        >>> LSHTuner.pareto_front(results, objectives=("a", "b"))
+        [{'a': 1, 'b': 2}, {'a': 2, 'b': 1}]
+        """
+        points = [tuple(result[key] for key in objectives)
+                  for result in results]
+        front = []
+        for idx, point in enumerate(points):
+            dominated = any(
+                all(o <= p for o, p in zip(other, point)) and other != point
+                for other in points)
+            if not dominated:
+                front.append(results[idx])
+        return front
+
+    def make_cfg(self, result, base_cfg=None):
+        """Create HDClustering configuration from an evaluated result
+
+        :rtype: dict
+        """
+        cfg = copy.deepcopy(DEFAULT_BASE_CFG if base_cfg is None else base_cfg)
+        cfg['kmin'] = result['kmin']
+        cfg['sig_width'] = result['width']
+        cfg['min_support'] = self.min_support
+        lsh_options = cfg.setdefault('lsh_options', {})
+        lsh_options['bandwidth'] = result['bandwidth']
+        lsh_options['scheme'] = result['scheme']
+        return cfg
+
+    def tune(self, sample, base_cfg=None):
+        """Find Pareto-optimal configurations within acceptable error rates
+
+        :param sample: feature vectors (e.g. sets of shingles) of a sample
+                       of documents
+        :type sample: collections.Sequence
+        :param base_cfg: HDClustering configuration to take settings not
+                         related to LSH from (also used for measuring cost)
+        :type base_cfg: dict
+        :returns: configuration dictionaries, cheapest first
+        :rtype: list
+        """
+        results = [self.evaluate(width, bandwidth, scheme, sample, base_cfg)
+                   for width, bandwidth, scheme in self.candidates()]
+        self.results = results
+        acceptable = [result for result in results
+                      if result['fp_rate'] <= self.max_fp_rate and
+                      result['fn_rate'] <= self.max_fn_rate]
+        if not acceptable:
+            LOG.warning("No configuration within acceptable error rates; "
+                        "returning Pareto-optimal configurations among all")
+            acceptable = results
+        front = sorted(self.pareto_front(acceptable),
+                       key=lambda result: result['cost'])
+        for result in front:
+            LOG.info("width=%(width)d bandwidth=%(bandwidth)d "
+                     "scheme=%(scheme)s kmin=%(kmin)d: fp=%(fp_rate).3f "
+                     "fn=%(fn_rate).3f cost=%(cost).2e s/doc", result)
+        return [self.make_cfg(result, base_cfg) for result in front]
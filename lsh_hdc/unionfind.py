@@ -0,0 +1,149 @@
+"""
+Array-backed union-find
+"""
+
+import numpy as np
+from array import array
+
+
+class UnionFind(object):
+    """Union-find (disjoint-set forest) over dense integer ids
+
+    Elements are identified by arbitrary hashable labels, which are interned
+    to consecutive integer ids starting from zero. Parent pointers and ranks
+    are stored in arrays of 32-bit integers, and ``find`` uses path halving.
+
+    >>> uf = UnionFind()
+    >>> a, b, c, d = map(uf.add, "abcd")
+    >>> uf.union(a, b) == uf.union(c, b)
+    True
+    >>> uf.find(a) == uf.find(c), uf.find(a) == uf.find(d)
+    (True, False)
+    >>> uf.labels()
+    array([0, 0, 0, 1])
+    >>> sorted(map(sorted, uf.sets()))
+    [['a', 'b', 'c'], ['d']]
+    """
+
+    def __init__(self):
+        self._parents = array('i')
+        self._ranks = array('i')
+        self._ids = {}
+        self._labels = []
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __contains__(self, label):
+        return label in self._ids
+
+    def add(self, label):
+        """Return id of a label, adding it as a singleton set if needed
+
+        :param label: element label
+        :returns: element id
+        :rtype: int
+        """
+        ids = self._ids
+        idx = ids.get(label)
+        if idx is None:
+            idx = ids[label] = len(self._labels)
+            self._labels.append(label)
+            self._parents.append(idx)
+            self._ranks.append(0)
+        return idx
+
+    def get_id(self, label):
+        """Return id of an existing label
+
+        :raises: KeyError
+        """
+        return self._ids[label]
+
+    def get_label(self, idx):
+        """Return label corresponding to an id"""
+        return self._labels[idx]
+
+    def find(self, idx):
+        """Return id of the root of the set containing an element
+
+        :param idx: element id
+        :type idx: int
+        :rtype: int
+        """
+        parents = self._parents
+        parent = parents[idx]
+        while parent != idx:
+            # path halving: point every other node on the path to its
+            # grandparent
+            grandparent = parents[parent]
+            parents[idx] = grandparent
+            idx = grandparent
+            parent = parents[idx]
+        return idx
+
+    def union(self, idx1, idx2):
+        """Merge sets containing two elements
+
+        :param idx1: element id
+        :type idx1: int
+        :param idx2: element id
+        :type idx2: int
+        :returns: id of the root of the merged set
+        :rtype: int
+        """
+        root1 = self.find(idx1)
+        root2 = self.find(idx2)
+        if root1 == root2:
+            return root1
+        ranks = self._ranks
+        rank1 = ranks[root1]
+        rank2 = ranks[root2]
+        if rank1 < rank2:
+            root1, root2 = root2, root1
+        elif rank1 == rank2:
+            ranks[root1] = rank1 + 1
+        self._parents[root2] = root1
+        return root1
+
+    def labels(self):
+        """Return cluster assignment for every element
+
+        Roots are found for all elements at once by pointer jumping over the
+        parent array. Clusters are numbered consecutively from zero in order
+        of their root ids.
+
+        :returns: an array whose i-th element is the cluster id of element i
+        :rtype: numpy.ndarray
+        """
+        # copy so as not to hold a view of a resizable buffer
+        roots = np.frombuffer(self._parents, dtype=np.int32).copy()
+        while True:
+            grandparents = roots[roots]
+            if np.array_equal(grandparents, roots):
+                break
+            roots = grandparents
+        _, cluster_ids = np.unique(roots, return_inverse=True)
+        return cluster_ids
+
+    def groups(self):
+        """Return ids of elements grouped by set
+
+        :returns: a list of arrays of element ids
+        :rtype: list
+        """
+        cluster_ids = self.labels()
+        if not len(cluster_ids):
+            return []
+        order = np.argsort(cluster_ids, kind='mergesort')
+        boundaries = np.flatnonzero(np.diff(cluster_ids[order])) + 1
+        return np.split(order, boundaries)
+
+    def sets(self):
+        """Return labels of elements grouped by set
+
+        :returns: a list of lists of labels
+        :rtype: list
+        """
+        labels = self._labels
+        return [[labels[idx] for idx in group] for group in self.groups()]
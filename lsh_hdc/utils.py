@@ -5,6 +5,7 @@ import string
 from math import log
 from itertools import imap
 from operator import itemgetter
+from collections import OrderedDict
 from pymaptools.iter import isiterable
 
 
@@ -153,3 +154,72 @@ def sort_by_length(els, reverse=True):
     return imap(itemgetter(0),
                 sorted(((s, len(s)) for s in els),
                        key=operator.itemgetter(1), reverse=reverse))
+
+
+class LRUCache(object):
+    """A bounded mapping that evicts least recently used entries
+
+    Keeps counters of cache hits, misses, and evictions.
+
+    >>> cache = LRUCache(2)
+    >>> cache.put("a", 1)
+    >>> cache.put("b", 2)
+    >>> cache.get("a")
+    1
+    >>> cache.put("c", 3)
+    >>> cache.get("b") is None
+    True
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size: maximum number of entries
+        :type max_size: int
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return value for a key, marking it as most recently used
+        """
+        entries = self._entries
+        try:
+            value = entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Insert or update an entry, evicting the least recently used one
+        if the cache is full
+        """
+        entries = self._entries
+        if key in entries:
+            del entries[key]
+        elif len(entries) >= self.max_size:
+            entries.popitem(last=False)
+            self.evictions += 1
+        entries[key] = value
+
+    def stats(self):
+        """Return cache counters
+
+        :returns: a dictionary containing current number of entries and
+                  numbers of hits, misses, and evictions
+        :rtype: dict
+        """
+        return dict(size=len(self._entries), hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
@@ -40,6 +40,138 @@ class TestCluster(unittest.TestCase):
         num_clusters = len(cluster.get_clusters())
         self.assertEqual(2, num_clusters)
 
+    def test_oph_signature(self):
+        """Clusters should be found with one-permutation signatures"""
+        cluster = Cluster(width=10, bandwidth=2, signature='oph')
+        cluster.add_item("abcdefg")
+        cluster.add_item("abcdefghi")
+        cluster.add_item("1234567890z")
+        self.assertEqual(2, len(cluster.get_clusters()))
+
+    def test_key_formats(self):
+        """Integer and string LSH keys should produce same clusters"""
+        sets = [randset() for _ in xrange(20)]
+        results = []
+        for key_format in ["int", "str"]:
+            cluster = Cluster(width=12, bandwidth=3, key_format=key_format)
+            for idx, s in enumerate(sets):
+                cluster.add_item(s, label=idx)
+            results.append(sorted(sorted(c) for c in cluster.get_clusters()))
+        self.assertEqual(results[0], results[1])
+
+    def test_key_types(self):
+        """LSH keys should be integers unless string format is requested"""
+        s = randset()
+        keys = Cluster(width=12, bandwidth=3).signer.get_signature(s)
+        self.assertTrue(all(isinstance(k, (int, long)) for k in keys))
+        keys = Cluster(width=12, bandwidth=3, key_format="str").signer.get_signature(s)
+        self.assertTrue(all(isinstance(k, str) for k in keys))
+
+    def test_bucket_size_cap(self):
+        """Capping bucket size should not undo merges"""
+        cluster = Cluster(width=10, bandwidth=2, max_bucket_size=2)
+        s = randset()
+        for idx in xrange(5):
+            cluster.add_item(s, label=idx)
+        self.assertEqual(1, len(cluster.get_clusters()))
+        for _, members in cluster.buckets.iteritems():
+            self.assertLessEqual(len(members), 2)
+
+    def test_flush(self):
+        """Flushing should emit clusters not added to within window"""
+        cluster = Cluster(width=10, bandwidth=2, window=5)
+        cluster.add_item("abcdefg", label="a")
+        cluster.add_item("abcdefghi", label="b")
+        for idx in xrange(10):
+            cluster.add_item(randset(), label=idx)
+        finished = [sorted(c) for c in cluster.flush()]
+        self.assertIn(["a", "b"], finished)
+        remaining = cluster.get_clusters()
+        self.assertNotIn("a", [label for c in remaining for label in c])
+
+        # flushed items should no longer be matched against
+        cluster.add_item("abcdefgh", label="c")
+        self.assertIn(["c"], cluster.get_clusters())
+
+        cluster.flush(force=True)
+        self.assertEqual([], cluster.get_clusters())
+        self.assertEqual(0, len(cluster.buckets))
+
+        # without a window, no cluster can be considered finished
+        cluster = Cluster(width=10, bandwidth=2)
+        cluster.add_item("abcdefg", label="a")
+        with self.assertRaises(ValueError):
+            cluster.flush()
+        self.assertEqual([["a"]], cluster.flush(force=True))
+
+    def test_max_buckets(self):
+        """Number of buckets should stay bounded"""
+        cluster = Cluster(width=10, bandwidth=2, max_buckets=20)
+        for idx in xrange(20):
+            cluster.add_item(randset(value_range=(0, 1000)), label=idx)
+            self.assertLessEqual(len(cluster.buckets), 20)
+
+    def test_cluster_labels(self):
+        """Cluster label array should agree with cluster sets"""
+        cluster = Cluster(width=10, bandwidth=2)
+        for idx in xrange(50):
+            cluster.add_item(randset(value_range=(0, 100)), label=idx)
+        labels, cluster_ids = cluster.get_cluster_labels()
+        self.assertEqual(50, len(labels))
+        expected = sorted(map(sorted, cluster.get_clusters()))
+        groups = {}
+        for label, cluster_id in zip(labels, cluster_ids):
+            groups.setdefault(cluster_id, []).append(label)
+        self.assertEqual(expected, sorted(map(sorted, groups.values())))
+
+    def test_dedupe(self):
+        """Exact duplicates should be merged without entering buckets"""
+        sets = [randset(value_range=(0, 100)) for _ in xrange(20)]
+        items = sets + sets[:10] + sets[:5]
+        results = []
+        for dedupe in [False, True]:
+            cluster = Cluster(width=10, bandwidth=2, dedupe=dedupe)
+            for idx, s in enumerate(items):
+                cluster.add_item(s, label=idx)
+            results.append(sorted(map(sorted, cluster.get_clusters())))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(15, cluster.duplicates_collapsed)
+        self.assertEqual(20 * 5, cluster.bucket_stats()['members'])
+
+        # duplicates of flushed items should start new clusters
+        cluster.flush(force=True)
+        cluster.add_item(sets[0], label="a")
+        cluster.add_item(sets[0], label="b")
+        self.assertEqual([["a", "b"]], map(sorted, cluster.get_clusters()))
+        self.assertEqual(16, cluster.duplicates_collapsed)
+
+    def test_multi_probe(self):
+        """Probing perturbed keys should only add to clusters found"""
+        pairs = [(set(xrange(i * 100, i * 100 + 60)),
+                  set(xrange(i * 100 + 20, i * 100 + 80))) for i in xrange(50)]
+        found = []
+        for num_probes in [0, 8]:
+            cluster = Cluster(width=12, bandwidth=4, num_probes=num_probes)
+            for idx, (s1, s2) in enumerate(pairs):
+                cluster.add_item(s1, label=(idx, 1))
+                cluster.add_item(s2, label=(idx, 2))
+            found.append(set(c[0][0] for c in cluster.get_clusters()
+                             if len(c) > 1))
+        self.assertLess(found[0], found[1])
+        with self.assertRaises(ValueError):
+            Cluster(width=12, bandwidth=4, signature='oph', num_probes=1)
+
+    def test_hot_buckets(self):
+        """Hot buckets should stop growing but still merge items"""
+        cluster = Cluster(width=10, bandwidth=2, hot_bucket_size=3)
+        for idx in xrange(10):
+            cluster.add_item("", label=idx)
+        self.assertEqual(1, len(cluster.get_clusters()))
+        stats = cluster.bucket_stats()
+        self.assertEqual(3, stats['max_size'])
+        self.assertEqual(stats['buckets'], stats['hot_buckets'])
+        self.assertEqual(7 * stats['buckets'], stats['hot_hits'])
+
     def test_cluster_threshold(self):
         """Expected error for threshold to similarity should be reasonable"""
         n_tests = 50
@@ -1,8 +1,14 @@
 import unittest
+import random
+import numpy as np
+from heapq import nsmallest
 from functools import reduce
 from lsh_hdc.ext import PHashCombiner, \
     hash_combine_murmur as hash_combine_1, \
-    hash_combine_boost as hash_combine_2
+    hash_combine_boost as hash_combine_2, \
+    bottom_k_minhashes, bottom_k_minhashes_many, hash_token_64, \
+    hash_bytes_many, hash_bytes_array, VarlenHash
+from lsh_hdc.utils import fill_with_last, random_string
 
 
 class TestCombiners(unittest.TestCase):
@@ -25,6 +31,32 @@ class TestCombiners(unittest.TestCase):
         comb = PHashCombiner(8)
         self.assertEqual(0L, comb.combine([]))
 
+    def test_hash_combiner_typed(self):
+        """Typed combiner should match arbitrary-precision arithmetic"""
+        vec = [random.getrandbits(64) for _ in xrange(8)]
+        vec[3] = -vec[3]
+        comb = PHashCombiner(8)
+        expected = sum(h * 31 ** i for i, h in enumerate(vec)) & (2 ** 64 - 1)
+        self.assertEqual(expected, comb.combine(vec))
+        comb32 = PHashCombiner(8, bits=32)
+        self.assertEqual(expected & (2 ** 32 - 1), comb32.combine(vec))
+        comb128 = PHashCombiner(8, bits=128)
+        self.assertEqual(sum(h * 31 ** i for i, h in enumerate(vec)) &
+                         (2 ** 128 - 1), comb128.combine(vec))
+
+    def test_hash_combiner_many(self):
+        """combine_many should match combine on every row"""
+        hashes = np.array([[random.getrandbits(64) for _ in xrange(5)]
+                           for _ in xrange(10)], dtype=np.uint64)
+        for mode in ["polynomial", "murmur"]:
+            comb = PHashCombiner(4, mode=mode)
+            self.assertEqual(map(comb.combine, hashes.tolist()),
+                             comb.combine_many(hashes).tolist())
+        self.assertNotEqual(PHashCombiner(4).combine_many(hashes).tolist(),
+                            comb.combine_many(hashes).tolist())
+        with self.assertRaises(ValueError):
+            PHashCombiner(4, mode="unknown")
+
     def _check_combiner(self, func):
         VEC_SIZE = 8
         vec = [hash(str(x)) for x in range(VEC_SIZE)]
@@ -44,3 +76,81 @@ class TestCombiners(unittest.TestCase):
     def test_hash_combine_2(self):
         """hash_combine_2 should work"""
         self._check_combiner(hash_combine_2)
+
+
+class TestBottomK(unittest.TestCase):
+
+    @staticmethod
+    def _reference(hashes, kmin):
+        return [fill_with_last(nsmallest(kmin, row), kmin)
+                for row in hashes.tolist()]
+
+    def test_bottom_k(self):
+        """bottom_k_minhashes should agree with nsmallest"""
+        hashes = np.array([[random.getrandbits(64) for _ in xrange(20)]
+                           for _ in xrange(5)], dtype=np.uint64)
+        for kmin in [1, 3, 20, 25]:
+            result = bottom_k_minhashes(hashes, kmin)
+            self.assertEqual(self._reference(hashes, kmin), result.tolist())
+
+    def test_bottom_k_duplicates(self):
+        """bottom_k_minhashes should keep duplicate values"""
+        hashes = np.array([[7, 3, 3, 9, 1]], dtype=np.uint64)
+        out = np.zeros((1, 3), dtype=np.uint64)
+        bottom_k_minhashes(hashes, 3, out=out)
+        self.assertEqual([[1, 3, 3]], out.tolist())
+
+    def test_bottom_k_many(self):
+        """bottom_k_minhashes_many should process each column range"""
+        hashes = np.array([[random.getrandbits(64) for _ in xrange(10)]
+                           for _ in xrange(4)], dtype=np.uint64)
+        offsets = [0, 1, 6]
+        result = bottom_k_minhashes_many(hashes, offsets, 2)
+        for doc, (start, stop) in enumerate(zip(offsets, offsets[1:] + [10])):
+            self.assertEqual(self._reference(hashes[:, start:stop], 2),
+                             result[doc].tolist())
+
+
+class TestBulkHashing(unittest.TestCase):
+
+    def test_hash_bytes_many(self):
+        """Bulk hashing of a buffer should match hashing items one by one"""
+        items = [random_string(random.randint(0, 10)) for _ in xrange(100)]
+        data = "".join(items)
+        offsets = np.cumsum([0] + map(len, items))
+        expected = [hash_token_64(item, 7) for item in items]
+        for buf in [data, bytearray(data), np.frombuffer(data, dtype=np.uint8)]:
+            self.assertEqual(expected, hash_bytes_many(buf, offsets, 7).tolist())
+        self.assertEqual(expected, hash_bytes_many(
+            data, offsets.astype(np.int32), 7).tolist())
+        self.assertEqual([], hash_bytes_many("", [0]).tolist())
+        with self.assertRaises(ValueError):
+            hash_bytes_many("abc", [0, 2, 1])
+        with self.assertRaises(ValueError):
+            hash_bytes_many("abc", [0, 4])
+
+    def test_hash_bytes_array(self):
+        """Hashing a NumPy string array should match hashing its elements"""
+        items = [random_string(random.randint(0, 10)) for _ in xrange(100)]
+        values = np.array(items)
+        self.assertEqual(map(hash_token_64, items),
+                         hash_bytes_array(values).tolist())
+        self.assertEqual(map(hash_token_64, items[::3]),
+                         hash_bytes_array(values[::3]).tolist())
+        with self.assertRaises(ValueError):
+            hash_bytes_array(np.array([u"abc"]))
+
+    def test_varlen_hash(self):
+        """Fixed-width VarlenHash should match arbitrary-precision version"""
+        def reference(value, bits, seed):
+            mask = (1 << bits) - 1
+            item = ord(value[0]) << 7
+            for char in value:
+                item = ((item * 1000003) ^ ord(char)) & mask
+            return hash_combine_2(item ^ len(value), seed)
+
+        for bits in [16, 64]:
+            hasher = VarlenHash(bits)
+            for _ in xrange(20):
+                value = random_string(random.randint(1, 20))
+                self.assertEqual(reference(value, bits, 3), hasher(value, 3))
@@ -1,12 +1,15 @@
 import unittest
 import sys
+import copy
+import time
 import yaml
 from operator import itemgetter
 from functools import partial
 from itertools import islice
 from pkg_resources import resource_filename
 from lsh_hdc import Shingler
-from lsh_hdc.cluster import MinHashCluster as Cluster, HDClustering
+from lsh_hdc.cluster import MinHashCluster as Cluster, HDClustering, \
+    MAX_CHUNKS_PER_WORKER
 from lsh_hdc.preprocess import RegexTokenizer
 
 get_resource_name = partial(resource_filename, __name__)
@@ -135,6 +138,158 @@ class TestFiles(unittest.TestCase):
         # is_label_positive = lambda lbl: ':' in lbl
         self.assertEqual(177, len([c for c in clusters if len(c) > 1]))
 
+    def test_simulated_hd_cache(self):
+        """Signature cache should not change clusters"""
+
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle]
+        # repeat recent items under new labels to produce exact duplicates
+        data.extend([label + "_dup", text] for label, text in data[-50:])
+
+        results = []
+        for cache_size in [None, 100]:
+            with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+                sim_cfg = yaml.load(fhandle)
+            sim_cfg['model']['signature_cache_size'] = cache_size
+            hdc = HDClustering(sim_cfg['model'],
+                               content_field=1,
+                               get_body=itemgetter(1),
+                               get_label=itemgetter(0),
+                               seed=SEED)
+            clusters = hdc.clusters_from_iter(data)
+            results.append(sorted(sorted(c) for c in clusters))
+        self.assertEqual(results[0], results[1])
+        stats = hdc.cache_stats()
+        self.assertEqual(len(data), stats['hits'] + stats['misses'])
+        self.assertGreaterEqual(stats['hits'], 50)
+        self.assertGreater(stats['evictions'], 0)
+        self.assertEqual(100, stats['size'])
+
+    def test_simulated_hd_streaming(self):
+        """Streaming clustering should emit every item once and require a
+        window"""
+
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle]
+        with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+            sim_cfg = yaml.load(fhandle)
+        hdc = HDClustering(copy.deepcopy(sim_cfg['model']),
+                           content_field=1,
+                           get_body=itemgetter(1),
+                           get_label=itemgetter(0),
+                           seed=SEED)
+        with self.assertRaises(ValueError):
+            hdc.iter_clusters(data)
+
+        sim_cfg['model']['streaming'] = {'window': 1000}
+        hdc = HDClustering(sim_cfg['model'],
+                           content_field=1,
+                           get_body=itemgetter(1),
+                           get_label=itemgetter(0),
+                           seed=SEED)
+        clusters = list(hdc.iter_clusters(data, flush_every=500))
+        labels = [label for cluster in clusters for label in cluster]
+        self.assertEqual(sorted(obj[0] for obj in data), sorted(labels))
+
+    def test_simulated_hd_parallel(self):
+        """Parallel mapping should produce the same clusters as serial"""
+
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle]
+
+        results = []
+        for workers in [1, 3]:
+            with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+                sim_cfg = yaml.load(fhandle)
+            hdc = HDClustering(sim_cfg['model'],
+                               content_field=1,
+                               get_body=itemgetter(1),
+                               get_label=itemgetter(0),
+                               seed=SEED,
+                               workers=workers,
+                               chunk_size=50)
+            clusters = hdc.clusters_from_iter(data)
+            results.append(sorted(sorted(c) for c in clusters))
+        self.assertEqual(results[0], results[1])
+
+    def test_simulated_hd_parallel_lazy(self):
+        """Parallel mapping should not read input ahead of consumption"""
+
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle]
+        with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+            sim_cfg = yaml.load(fhandle)
+        hdc = HDClustering(sim_cfg['model'],
+                           content_field=1,
+                           get_body=itemgetter(1),
+                           get_label=itemgetter(0),
+                           seed=SEED,
+                           workers=2,
+                           chunk_size=10)
+        num_read = [0]
+
+        def read_data():
+            for obj in data:
+                num_read[0] += 1
+                yield obj
+
+        mapped = hdc._map_iter(read_data())
+        self.assertEqual(10, len(list(islice(mapped, 10))))
+        time.sleep(0.5)
+        max_pending = MAX_CHUNKS_PER_WORKER * 2
+        self.assertEqual(max_pending * 10, num_read[0])
+        self.assertEqual(len(data) - 10, sum(1 for _ in mapped))
+        self.assertEqual(len(data), num_read[0])
+
+    def test_simulated_hd_batch(self):
+        """Batch mapper and reducer should produce the same clusters as
+        streaming clustering"""
+
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle]
+
+        for options in [{}, {'min_support': 2},
+                        {'hot_bucket_size': 3, 'hot_sample_size': 2},
+                        {'sketch': {'enabled': False}}]:
+            with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+                sim_cfg = yaml.load(fhandle)
+            sim_cfg['model'].update(options)
+            results = []
+            for batch in [False, True]:
+                hdc = HDClustering(copy.deepcopy(sim_cfg['model']),
+                                   content_field=1,
+                                   get_body=itemgetter(1),
+                                   get_label=itemgetter(0),
+                                   seed=SEED)
+                clusters = hdc.clusters_from_blocks(data, block_size=300) \
+                    if batch else hdc.clusters_from_iter(data)
+                results.append(sorted(sorted(c) for c in clusters))
+            self.assertEqual(results[0], results[1])
+
+        block, labels = hdc.batch_mapper(data[:10], first_id=5)
+        self.assertEqual([obj[0] for obj in data[:10]], labels)
+        self.assertEqual(sorted(block['key']), block['key'].tolist())
+        self.assertEqual(range(5, 15), sorted(set(block['doc_id'])))
+        edges = hdc.batch_reducer([block])
+        self.assertTrue((edges['doc_id'] < edges['other_id']).all())
+
+    def test_simulated_hd_batch_default_labels(self):
+        """Default labels should be distinct across mapped blocks"""
+
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle]
+        with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+            sim_cfg = yaml.load(fhandle)
+        results = []
+        for batch in [False, True]:
+            hdc = HDClustering(copy.deepcopy(sim_cfg['model']),
+                               content_field=1, seed=SEED)
+            clusters = hdc.clusters_from_blocks(data, block_size=300) \
+                if batch else hdc.clusters_from_iter(data)
+            results.append(sorted(sorted(c) for c in clusters))
+        self.assertEqual(len(data), sum(map(len, results[1])))
+        self.assertEqual(results[0], results[1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,240 @@
+import os
+import unittest
+import shutil
+import tempfile
+import yaml
+import numpy as np
+from operator import itemgetter
+from functools import partial
+from pkg_resources import resource_filename
+from lsh_hdc import Shingler
+from lsh_hdc.cluster import HDClustering
+from lsh_hdc.index import LSHIndex, LSHForest, INDEX_ARRAYS, _save_arrays
+from lsh_hdc.utils import randset
+
+get_resource_name = partial(resource_filename, __name__)
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_candidates(self):
+        """Documents should be found by their own features"""
+        index = LSHIndex(width=12, bandwidth=3)
+        sets = [randset() for _ in xrange(50)]
+        for idx, features in enumerate(sets):
+            index.add(features, idx)
+        self.assertEqual(0, len(index.candidates(sets[0])))
+        index.commit()
+        self.assertEqual(50, len(index))
+        for idx, features in enumerate(sets):
+            self.assertIn(idx, index.candidates(features))
+
+    def test_query(self):
+        """Query should rank candidates by estimated similarity"""
+        index = LSHIndex(width=20, bandwidth=2)
+        base = set(xrange(100))
+        index.add(base, "same")
+        index.add(set(xrange(10, 110)), "close")
+        index.add(set(xrange(50, 150)), "far")
+        index.add(set(xrange(1000, 1100)), "unrelated")
+        index.commit()
+
+        results = index.query(base, k=None)
+        labels = [label for label, _, _ in results]
+        self.assertEqual(["same", "close"], labels[:2])
+        self.assertNotIn("unrelated", labels)
+        self.assertEqual(("same", 1.0, 10), results[0])
+        similarities = [sim for _, sim, _ in results]
+        self.assertEqual(sorted(similarities, reverse=True), similarities)
+
+        self.assertEqual(["same"], [label for label, _, _
+                                    in index.query(base, k=1)])
+        self.assertTrue(all(sim >= 0.6 for _, sim, _
+                            in index.query(base, threshold=0.6)))
+        minhashes = index.signer.get_minhashes(base)
+        self.assertEqual(results, index.query_signature(minhashes, k=None))
+
+    def test_multi_probe(self):
+        """Probing perturbed keys should find more candidates"""
+        pairs = [(set(xrange(i * 100, i * 100 + 60)),
+                  set(xrange(i * 100 + 20, i * 100 + 80))) for i in xrange(50)]
+        index = LSHIndex(width=12, bandwidth=4, num_probes=8)
+        for idx, (features, _) in enumerate(pairs):
+            index.add(features, idx)
+        index.commit()
+        found = [0, 0]
+        for idx, (_, features) in enumerate(pairs):
+            plain = index.candidates(features, num_probes=0)
+            probed = index.candidates(features)
+            self.assertLessEqual(set(plain), set(probed))
+            found[0] += idx in plain
+            found[1] += idx in probed
+            labels = [label for label, _, _ in index.query(features, k=None)]
+            self.assertEqual(sorted(probed), sorted(labels))
+        self.assertLess(found[0], found[1])
+        with self.assertRaises(ValueError):
+            LSHIndex(width=12, bandwidth=4, signature='weighted', num_probes=8)
+
+    def test_save_load(self):
+        """Loaded index should return same candidates as the original"""
+        index = LSHIndex(width=20, bandwidth=5, kmin=2, chunk_size=7)
+        shingler = Shingler(3)
+        names = ["John Smith", "Jon Smith", "Jane Smyth", "Bob Jones"]
+        for name in names:
+            index.add(shingler.get_shingles(name), name)
+        index.save(self.tmpdir)
+        loaded = LSHIndex.load(self.tmpdir)
+        self.assertEqual(index.params, loaded.params)
+        self.assertIsInstance(loaded._keys, np.memmap)
+        for name in names:
+            features = shingler.get_shingles(name)
+            self.assertEqual(index.candidates(features),
+                             loaded.candidates(features))
+
+        # documents can be added to a loaded index and saved in place
+        loaded.add(shingler.get_shingles("Bob Jonas"), "Bob Jonas")
+        loaded.save(self.tmpdir)
+        reloaded = LSHIndex.load(self.tmpdir, mmap=False)
+        self.assertEqual(5, len(reloaded))
+        self.assertIn("Bob Jonas", reloaded.candidates(
+            shingler.get_shingles("Bob Jonas")))
+        # files of the previous save should have been removed
+        self.assertEqual(len(INDEX_ARRAYS) + 1, len(os.listdir(self.tmpdir)))
+
+        # an interrupted save should leave the saved index intact
+        with self.assertRaises(KeyError):
+            _save_arrays(self.tmpdir, dict(keys=reloaded._keys), INDEX_ARRAYS,
+                         dict(reloaded.params, num_docs=0))
+        self.assertEqual(5, len(LSHIndex.load(self.tmpdir)))
+
+    def test_save_load_probes(self):
+        """Number of probes should be saved with an index"""
+        index = LSHIndex(width=12, bandwidth=4, num_probes=3)
+        index.add(randset(), 0)
+        index.save(self.tmpdir)
+        self.assertEqual(3, LSHIndex.load(self.tmpdir).num_probes)
+
+    def test_empty(self):
+        """Empty index should be saveable and queryable"""
+        index = LSHIndex()
+        index.save(self.tmpdir)
+        loaded = LSHIndex.load(self.tmpdir)
+        self.assertEqual(0, len(loaded))
+        self.assertEqual([], loaded.candidates(randset()))
+
+    def test_build_from_model(self):
+        """Index built from a model should find every indexed document"""
+        with open(get_resource_name('test_files.simulated.yaml'), 'r') as fhandle:
+            sim_cfg = yaml.load(fhandle)
+        with open(get_resource_name('data/simulated.txt'), 'r') as fhandle:
+            data = [line.rstrip().split(' ') for line in fhandle][:200]
+        hdc = HDClustering(sim_cfg['model'],
+                           content_field=1,
+                           get_body=itemgetter(1),
+                           get_label=itemgetter(0))
+        index = hdc.build_index(data)
+        self.assertEqual(len(data), len(index))
+        for obj in data[:20]:
+            _, features = hdc._get_features(obj)
+            self.assertIn(obj[0], index.candidates(features))
+
+
+class TestForest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_candidates(self):
+        """Documents should be found by their own features at any depth"""
+        forest = LSHForest(width=24, num_trees=4, chunk_size=7)
+        sets = [randset() for _ in xrange(50)]
+        for idx, features in enumerate(sets[:30]):
+            forest.add(features, idx)
+        forest.commit()
+        for idx, features in enumerate(sets[30:], 30):
+            forest.add(features, idx)
+        self.assertEqual(30, len(forest))
+        forest.commit()
+        self.assertEqual(50, len(forest))
+        for idx, features in enumerate(sets):
+            for depth in [1, 3, 6]:
+                self.assertIn(idx, forest.candidates(features, depth=depth))
+
+    def test_thresholds(self):
+        """Lower thresholds should use shorter prefixes and find more"""
+        forest = LSHForest(width=64, num_trees=8)
+        self.assertEqual([2, 4, 8], map(forest.get_depth, [0.35, 0.6, 0.77]))
+        base = set(xrange(100))
+        for idx in xrange(10):
+            forest.add(set(xrange(idx * 10, idx * 10 + 100)), idx)
+        forest.commit()
+        found = [forest.candidates(base, threshold=threshold)
+                 for threshold in [0.2, 0.5, 0.8]]
+        self.assertEqual(sorted(found[0]), found[0])
+        self.assertTrue(set(found[0]) >= set(found[1]) >= set(found[2]))
+        self.assertIn(0, found[2])
+        results = forest.query(base, k=None, threshold=0.5)
+        self.assertTrue(all(sim >= 0.5 for _, sim, _ in results))
+        self.assertEqual(0, results[0][0])
+
+    def test_query_top_k(self):
+        """Top-k query should rank candidates by estimated similarity"""
+        forest = LSHForest(width=32, num_trees=4)
+        base = set(xrange(100))
+        forest.add(base, "same")
+        forest.add(set(xrange(10, 110)), "close")
+        forest.add(set(xrange(50, 150)), "far")
+        forest.add(set(xrange(1000, 1100)), "unrelated")
+        forest.commit()
+        results = forest.query(base, k=2)
+        self.assertEqual(["same", "close"], [label for label, _, _ in results])
+        self.assertEqual(("same", 1.0, 4), results[0])
+        self.assertNotIn("unrelated", [label for label, _, _
+                                       in forest.query(base, k=None)])
+        self.assertEqual([], forest.query(set(xrange(5000, 5100))))
+
+    def test_clusters(self):
+        """Longer prefixes should split clusters found with shorter ones"""
+        forest = LSHForest(width=32, num_trees=4)
+        sets = [set(xrange(start, start + 50))
+                for start in [0, 5, 300, 310, 1000]]
+        for idx, features in enumerate(sets):
+            forest.add(features, idx)
+        forest.commit()
+        coarse = sorted(forest.get_clusters(depth=1))
+        self.assertEqual([[0, 1], [2, 3], [4]], coarse)
+        for cluster in forest.get_clusters(threshold=0.9):
+            self.assertTrue(any(set(cluster) <= set(group) for group in coarse))
+
+    def test_save_load(self):
+        """Loaded forest should give the same query results"""
+        forest = LSHForest(width=24, num_trees=4)
+        sets = [randset() for _ in xrange(30)]
+        for idx, features in enumerate(sets):
+            forest.add(features, "doc%d" % idx)
+        forest.save(self.tmpdir)
+        for mmap in [True, False]:
+            loaded = LSHForest.load(self.tmpdir, mmap=mmap)
+            self.assertEqual(forest.params, loaded.params)
+            for features in sets[:5]:
+                self.assertEqual(forest.query(features),
+                                 loaded.query(features))
+        self.assertEqual(0, len(LSHForest.load(self._save_empty())))
+
+    def _save_empty(self):
+        path = self.tmpdir + "/empty"
+        LSHForest().save(path)
+        return path
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 import unittest
+import numpy as np
+from math import log1p
+from collections import Counter
 from pymaptools.bitwise import hamming
 from lsh_hdc import MinHashSignature, SimHashSignature, \
-    MinHashSketchSignature, Shingler
+    MinHashSketchSignature, OnePermutationSignature, \
+    WeightedMinHashSignature, Shingler, LSHC, TextSigner
 from lsh_hdc.metrics import jaccard_similarity
 from lsh_hdc.utils import randset, sigsim
 from lsh_hdc.preprocess import RegexTokenizer
@@ -38,6 +42,121 @@ class TestSig(unittest.TestCase):
         s = randset()
         self.assertEqual(mh.get_signature(s), mh.get_signature(s))
 
+    def test_batch_signature(self):
+        """Batch signatures should match one-by-one signatures"""
+        mh = MinHashSignature(10 * 10, hashfun='universal')
+        sets = [randset() for _ in xrange(10)] + [()]
+        self.assertEqual(map(mh.get_signature, sets),
+                         mh.get_signatures_batch(sets))
+
+    def test_batch_signature_kmin(self):
+        """Batch LSH keys should match one-by-one keys when kmin > 1"""
+        lsh = LSHC(3, width=30, scheme="a0")
+        mh = MinHashSignature(30, lsh_hasher=lsh, kmin=3, hashfun='universal')
+        sets = [randset(), (1,), (), randset()]
+        self.assertEqual(map(mh.get_signature, sets),
+                         mh.get_signatures_batch(sets))
+
+    def test_batch_signature_murmur(self):
+        """Murmur-mixed family should give same signatures in batch mode"""
+        lsh = LSHC(3, width=30, scheme="a0")
+        mh = MinHashSignature(30, lsh_hasher=lsh, kmin=3, hashfun='murmur')
+        sets = [randset() for _ in xrange(5)] + [()]
+        self.assertEqual(map(mh.get_signature, sets),
+                         mh.get_signatures_batch(sets))
+
+    def test_batch_signature_fallback(self):
+        """Batch signing should work for hash functions without a family"""
+        mh = MinHashSignature(10 * 10)
+        sets = [randset() for _ in xrange(3)]
+        self.assertEqual(map(mh.get_signature, sets),
+                         mh.get_signatures_batch(sets))
+
+    def test_hashed_shingler(self):
+        """Hashed shingles should correspond one-to-one to tuple shingles"""
+        text = "the quick brown fox jumps over a lazy dog the quick fox"
+        for span, skip in [(3, 0), (5, 1), (20, 0)]:
+            s = Shingler(span=span, skip=skip, tokenizer=RegexTokenizer())
+            h = Shingler(span=span, skip=skip, tokenizer=RegexTokenizer(),
+                         hashed=True)
+            hashes = h.get_shingles(text)
+            self.assertEqual(np.uint64, hashes.dtype)
+            self.assertEqual(sorted(set(hashes)), hashes.tolist())
+            self.assertEqual(len(s.get_shingles(text)), len(hashes))
+        t = Shingler(span=3, unique=False, hashed=True)
+        self.assertEqual(9, len(t.get_shingles("abracadabra")))
+        self.assertEqual(1, len(t.get_shingles("")))
+
+    def test_hashed_signature_similarity(self):
+        """Signatures of hashed shingles should approximate Jaccard
+        similarity
+        """
+        n_tests = 50
+        expected_error = 1.0 / 10  # Expected error is O(1/sqrt(dim))
+        shingler = Shingler(span=1, hashed=True)
+        for hashfun in ['metrohash', 'universal', 'murmur']:
+            mh = MinHashSignature(10 * 10, hashfun=hashfun)
+            err = 0.0
+            for _ in xrange(n_tests):
+                sets = (randset(), randset())
+                jsim = len(set(sets[0]) & set(sets[1])) / \
+                    float(len(set(sets[0]) | set(sets[1])))
+                hashed = [shingler.get_shingles(map(str, x)) for x in sets]
+                sigs = map(mh.get_signature, hashed)
+                err += abs(jsim - sigsim(*sigs, dim=100))
+            avg_err = err / n_tests
+            self.assertGreaterEqual(
+                expected_error,
+                avg_err,
+                msg="Accuracy test failed. (avg error: %f)" % avg_err)
+            self.assertEqual(map(mh.get_signature, hashed),
+                             mh.get_signatures_batch(hashed))
+
+    def test_text_signer(self):
+        """Fused text signer should agree with tokenizer, shingler, and
+        signer run one after another
+        """
+        texts = [u"", u"  ", u"word", u"Hello, world! foo_bar 123 caf\xe9",
+                 u"\u043f\u0440\u0438\u0432\u0435\u0442 \u4e2d\u6587 a\u0301b",
+                 u"\u0928\u092e\u0938\u094d\u0924\u0947 \u0926\u0941\u0928\u093f\u092f\u093e",
+                 "byte string", u"the quick brown fox jumps over a lazy dog"]
+        for tokenizer in [RegexTokenizer(), RegexTokenizer(u"[a-z]+", True)]:
+            lsh = LSHC(3, width=30, scheme="a0")
+            signer = MinHashSignature(30, lsh_hasher=lsh, kmin=3,
+                                      hashfun='universal')
+            text_signer = TextSigner(signer, span=2, skip=1,
+                                     tokenizer=tokenizer)
+            shingler = Shingler(span=2, skip=1, tokenizer=tokenizer,
+                                hashed=True)
+            for text in texts:
+                utext = text.decode("utf-8") if isinstance(text, str) else text
+                for prefix in [None, "prefix"]:
+                    shingles = shingler.get_shingles(utext, prefix=prefix)
+                    self.assertEqual(
+                        shingles.tolist(),
+                        text_signer.get_shingles(text, prefix).tolist())
+                    self.assertEqual(
+                        signer.get_signature(shingles),
+                        text_signer.get_signature(text, prefix))
+            keys = text_signer.get_keys_batch(texts)
+            self.assertEqual(map(text_signer.get_signature, texts),
+                             keys.tolist())
+
+    def test_lsh_hash_batch(self):
+        """Batch LSH hashing should give the same keys as hashing one by one"""
+        for scheme, bandwidth in [("a0", 4), ("a1", 3), ("a2", 3), ("b3", 3)]:
+            lsh = LSHC(bandwidth, width=24, scheme=scheme)
+            mh = MinHashSignature(24)
+            sigs = [mh.get_minhashes(randset()) for _ in xrange(5)]
+            keys = lsh.hash_batch(np.array(sigs, dtype=np.uint64))
+            self.assertEqual(keys.dtype, np.uint64)
+            self.assertEqual([list(lsh.hash(sig)) for sig in sigs],
+                             keys.tolist())
+        lsh = LSHC(3, width=24, scheme="a0", combine_mode="murmur")
+        keys = lsh.hash_batch(np.array(sigs, dtype=np.uint64))
+        self.assertEqual([list(lsh.hash(sig)) for sig in sigs],
+                         keys.tolist())
+
     def test_simhash64_1(self):
         sh = SimHashSignature(64)
         sig1 = sh.get_signature("")
@@ -170,6 +289,29 @@ class TestSig(unittest.TestCase):
         dist = hamming(sig1, sig2)
         self.assertEqual(0, dist)
 
+    def test_simhash_batch(self):
+        """Vectorized SimHash should match bit-by-bit accumulation"""
+
+        def simhash(sh, tokens):
+            bit_depth = len(sh.bits)
+            vec = [0] * bit_depth
+            for token in tokens:
+                weight = log1p(log1p(len(token)))
+                feature = sh.hashfun(token, sh.seed) % (1 << bit_depth)
+                for i in xrange(bit_depth):
+                    if feature & (1 << i):
+                        vec[i] += weight
+                    else:
+                        vec[i] -= weight
+            return sum(1 << i for i in xrange(bit_depth) if vec[i] > 0)
+
+        docs = [[str(x) for x in randset()] for _ in xrange(20)] + [[]]
+        for bit_depth in [16, 64, 128, 200]:
+            sh = SimHashSignature(bit_depth)
+            expected = [simhash(sh, doc) for doc in docs]
+            self.assertEqual(expected, [sh.get_signature(doc) for doc in docs])
+            self.assertEqual(expected, sh.get_signatures_batch(docs))
+
     def test_signature_similarity(self):
         """The probability that two sets' signatures match at some index are
         equal is equal to the Jaccard similarity between the two
@@ -198,6 +340,135 @@ class TestSig(unittest.TestCase):
             avg_err,
             msg="Accuracy test failed. (avg error: %f)" % avg_err)
 
+    def test_signature_similarity_oph(self):
+        """One-permutation signatures should approximate Jaccard similarity
+        """
+        n_tests = 100
+        expected_error = 1.0 / 10
+        mh = OnePermutationSignature(10 * 10)
+        err = 0.0
+        for _ in xrange(n_tests):
+            sets = (randset(), randset())
+            sigs = map(mh.get_signature, sets)
+            err += abs(jaccard_similarity(*sets) - sigsim(*sigs, dim=100))
+        avg_err = err / n_tests
+        self.assertGreaterEqual(
+            expected_error,
+            avg_err,
+            msg="Accuracy test failed. (avg error: %f)" % avg_err)
+
+    def test_oph_signature(self):
+        """One-permutation signatures should be consistent across inputs"""
+        lsh = LSHC(3, width=30, scheme="a0")
+        mh = OnePermutationSignature(30, lsh_hasher=lsh)
+        sets = [randset() for _ in xrange(5)] + [()]
+        self.assertEqual(map(mh.get_signature, sets),
+                         mh.get_signatures_batch(sets))
+        self.assertEqual(10, len(mh.get_signature(sets[0])))
+        shingler = Shingler(span=1, hashed=True)
+        hashed = shingler.get_shingles(["a", "b", "c"])
+        self.assertEqual(mh.get_signature(hashed),
+                         mh.get_signature(np.array(hashed)))
+        with self.assertRaises(ValueError):
+            OnePermutationSignature(30, kmin=3)
+
+    def test_probe_keys(self):
+        """Probe keys should be keys of perturbed signatures"""
+        for kmin, bandwidth, hashfun in [(1, 3, 'metrohash'), (2, 3, 'universal'),
+                                         (1, 1, 'metrohash')]:
+            lsh = LSHC(bandwidth, width=24, scheme="a1") if bandwidth > 1 else None
+            mh = MinHashSignature(24, lsh_hasher=lsh, kmin=kmin, hashfun=hashfun)
+            vec = randset()
+            minhashes, perturbations = mh.get_minhashes_with_probes(vec, 5)
+            self.assertEqual(mh.get_minhashes(vec), minhashes)
+            self.assertEqual(5, len(set(pos for pos, _ in perturbations)))
+            original = mh.get_signature(vec)
+            expected = []
+            for pos, value in perturbations:
+                self.assertLess(minhashes[pos], value)
+                perturbed = list(minhashes)
+                perturbed[pos] = value
+                keys = mh._signature_from_minhashes(perturbed)
+                expected.extend(key for key, orig in zip(keys, original)
+                                if key != orig)
+            self.assertEqual(expected, mh.get_probe_keys(minhashes, perturbations))
+        # string-format keys take the non-vectorized path
+        lsh = LSHC(3, width=24, scheme="a1", key_format="str")
+        original = list(lsh.hash(minhashes))
+        expected = []
+        for pos, value in perturbations:
+            perturbed = list(minhashes)
+            perturbed[pos] = value
+            expected.extend(key for key, orig in zip(lsh.hash(perturbed), original)
+                            if key != orig)
+        self.assertEqual(expected, lsh.hash_probes(minhashes, perturbations))
+        self.assertEqual([], lsh.hash_probes(minhashes, []))
+        # a single feature has no runner-up hash values
+        self.assertEqual([], mh.get_minhashes_with_probes(["a"], 5)[1])
+        self.assertFalse(OnePermutationSignature.multi_probe)
+        with self.assertRaises(ValueError):
+            OnePermutationSignature(24).get_minhashes_with_probes(vec, 5)
+
+    def test_signature_similarity_weighted(self):
+        """Weighted minhash signatures should approximate weighted Jaccard
+        similarity
+        """
+        n_tests = 100
+        expected_error = 1.0 / 10
+        mh = WeightedMinHashSignature(10 * 10)
+        err = 0.0
+        for _ in xrange(n_tests):
+            vecs = [Counter(randset()) + Counter(randset()) for _ in xrange(2)]
+            features = set(vecs[0]) | set(vecs[1])
+            wjsim = sum(min(vecs[0][f], vecs[1][f]) for f in features) / \
+                float(sum(max(vecs[0][f], vecs[1][f]) for f in features))
+            sigs = map(mh.get_signature, vecs)
+            err += abs(wjsim - sigsim(*sigs, dim=100))
+        avg_err = err / n_tests
+        self.assertGreaterEqual(
+            expected_error,
+            avg_err,
+            msg="Accuracy test failed. (avg error: %f)" % avg_err)
+
+    def test_weighted_signature(self):
+        """Weights given as mappings should match feature multiplicity"""
+        lsh = LSHC(3, width=30, scheme="a0")
+        mh = WeightedMinHashSignature(30, lsh_hasher=lsh)
+        tokens = ["a", "b", "c", "a", "b", "a"]
+        sig = mh.get_signature(tokens)
+        self.assertEqual(10, len(sig))
+        self.assertEqual(sig, mh.get_signature({"a": 3, "b": 2, "c": 1}))
+        self.assertEqual(sig, mh.get_signature({"a": 3, "b": 2, "c": 1,
+                                                "d": 0}))
+        self.assertNotEqual(sig, mh.get_signature(set(tokens)))
+        self.assertEqual(mh.get_signature([]), mh.get_signature({}))
+        shingler = Shingler(span=1, hashed=True, unique=False)
+        hashed = shingler.get_shingles(tokens)
+        self.assertNotEqual(mh.get_signature(hashed),
+                            mh.get_signature(np.unique(hashed)))
+
+    def test_signature_similarity_universal(self):
+        """Signatures from universal hash family should approximate Jaccard
+        similarity
+        """
+        n_tests = 100
+        expected_error = 1.0 / 10  # Expected error is O(1/sqrt(dim))
+        mh = MinHashSignature(10 * 10, hashfun='universal')
+        err = 0.0
+
+        for _ in xrange(n_tests):
+            sets = (randset(), randset())
+            sigs = mh.get_signatures_batch(sets)
+            jsim = jaccard_similarity(*sets)
+            ssim = sigsim(*sigs, dim=100)
+            err += abs(jsim - ssim)
+
+        avg_err = err / n_tests
+        self.assertGreaterEqual(
+            expected_error,
+            avg_err,
+            msg="Accuracy test failed. (avg error: %f)" % avg_err)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+import copy
+import unittest
+import numpy as np
+from lsh_hdc import create_sig_bands
+from lsh_hdc.cluster import HDClustering
+from lsh_hdc.tuning import LSHTuner, DEFAULT_BASE_CFG, s_curve, \
+    collision_probability
+from lsh_hdc.utils import randset
+
+
+class TestTuning(unittest.TestCase):
+
+    def test_collision_probability(self):
+        """Simulated collision probability should agree with S-curve"""
+        similarities = np.linspace(0.0, 1.0, 11)
+        bands = [band for _, band in create_sig_bands(24, 3, "a0")]
+        expected = s_curve(similarities, 3, 8)
+        result = collision_probability(similarities, bands, num_trials=5000)
+        self.assertTrue(np.allclose(expected, result, atol=0.03))
+
+    def test_overlapping_schemes(self):
+        """Overlapping bands should make collisions more likely"""
+        tuner = LSHTuner(0.5)
+        fp_a0, fn_a0 = tuner.error_rates(24, 3, "a0")
+        fp_a1, fn_a1 = tuner.error_rates(24, 3, "a1")
+        self.assertGreater(fp_a1, fp_a0)
+        self.assertLess(fn_a1, fn_a0)
+
+    def test_tune(self):
+        """Tuner should return usable non-dominated configurations"""
+        sample = [randset() for _ in xrange(50)]
+        tuner = LSHTuner(0.6, max_fp_rate=0.2, max_fn_rate=0.2,
+                         widths=[24, 48], bandwidths=[2, 3, 4],
+                         schemes=["a0", "a1", "b2"], kmin=2)
+        cfgs = tuner.tune(sample)
+        self.assertGreater(len(cfgs), 0)
+        self.assertGreater(len(tuner.results), len(cfgs))
+        front = LSHTuner.pareto_front(tuner.results)
+        for cfg in cfgs:
+            matches = [result for result in front
+                       if result['width'] == cfg['sig_width'] and
+                       result['bandwidth'] == cfg['lsh_options']['bandwidth'] and
+                       result['scheme'] == cfg['lsh_options']['scheme'] and
+                       result['kmin'] == cfg['kmin']]
+            self.assertEqual(1, len(matches))
+            self.assertLessEqual(matches[0]['fp_rate'], 0.2)
+            self.assertLessEqual(matches[0]['fn_rate'], 0.2)
+            hdc = HDClustering(cfg, content_field=0)
+            self.assertEqual(cfg['sig_width'], hdc.signer.width * hdc.signer.kmin)
+            self.assertEqual(2, cfg['kmin'])
+
+    def test_cost_base_cfg(self):
+        """Cost should be measured with settings of base configuration"""
+        sample = [randset() for _ in xrange(20)]
+        tuner = LSHTuner(0.6, widths=[24], bandwidths=[3], schemes=["a0"])
+        base_cfg = copy.deepcopy(DEFAULT_BASE_CFG)
+        base_cfg['hashfun'] = 'universal'
+        cfgs = tuner.tune(sample, base_cfg=base_cfg)
+        self.assertEqual(['universal'], [cfg['hashfun'] for cfg in cfgs])
+        base_cfg['signature'] = 'no_such_signature'
+        with self.assertRaises(KeyError):
+            tuner.measure_cost(24, 3, "a0", sample, base_cfg)
+
+
+if __name__ == '__main__':
+    unittest.main()
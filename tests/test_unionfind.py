@@ -1,7 +1,9 @@
 __author__ = 'escherba'
 
 import unittest
+import random
 from pymaptools.unionfind import UnionFind
+from lsh_hdc.unionfind import UnionFind as ArrayUnionFind
 
 
 class TestUnionFind(unittest.TestCase):
@@ -13,5 +15,39 @@ class TestUnionFind(unittest.TestCase):
         self.assertEqual(uf.sets(), [[0, 1, 2, 3]])
 
 
+class TestArrayUnionFind(unittest.TestCase):
+    def test_simple_cluster(self):
+        uf = ArrayUnionFind()
+        ids = [uf.add(label) for label in range(4)]
+        uf.union(ids[0], ids[1])
+        uf.union(ids[2], ids[3])
+        uf.union(ids[3], ids[0])
+        self.assertEqual(uf.sets(), [[0, 1, 2, 3]])
+        self.assertEqual([0, 0, 0, 0], uf.labels().tolist())
+
+    def test_empty(self):
+        uf = ArrayUnionFind()
+        self.assertEqual([], uf.sets())
+        self.assertEqual(0, len(uf.labels()))
+
+    def test_against_dict_backend(self):
+        """Should produce same sets as dict-backed union-find"""
+        random.seed(0)
+        reference = UnionFind()
+        uf = ArrayUnionFind()
+        for _ in xrange(2000):
+            label1 = random.randint(0, 999)
+            label2 = random.randint(0, 999)
+            reference.union(label1, label2)
+            uf.union(uf.add(label1), uf.add(label2))
+        expected = sorted(map(sorted, reference.sets()))
+        self.assertEqual(expected, sorted(map(sorted, uf.sets())))
+        labels = uf.labels()
+        for cluster in expected:
+            ids = [uf.get_id(label) for label in cluster]
+            self.assertEqual(1, len(set(labels[ids])))
+            self.assertEqual(1, len(set(map(uf.find, ids))))
+
+
 if __name__ == '__main__':
     unittest.main()
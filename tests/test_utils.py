@@ -1,10 +1,16 @@
 __author__ = 'escherba'
 
 import unittest
+import shutil
+import tempfile
+import os
+import collections
 import numpy as np
+from itertools import combinations, izip
 from lsh_hdc.fent import minmaxr
 from lsh_hdc.utils import sort_by_length
-from lsh_hdc import create_sig_selectors
+from lsh_hdc import create_sig_selectors, create_sig_bands, \
+    lsh_combinations, save_sig_bands, load_sig_bands
 
 
 class TestUtils(unittest.TestCase):
@@ -58,6 +64,37 @@ class TestUtils(unittest.TestCase):
         selectors = create_sig_selectors(8, 3, "a3")
         self.assertEqual(len(selectors), 56)
 
+    def test_lsh_combinations(self):
+        """Direct construction should match enumeration of all bands"""
+        def reference(width, bandwidth, ramp):
+            left_cols = list(combinations(range(bandwidth), ramp))
+            right_cols = [tuple(sorted(set(range(bandwidth)) - set(cols)))
+                          for cols in left_cols]
+            mapping = collections.defaultdict(list)
+            for left, right in izip(left_cols, right_cols):
+                for band in combinations(range(width), bandwidth):
+                    key = tuple(band[i] for i in left)
+                    mapping[key].append(tuple(band[i] for i in right))
+            return sorted(set(tuple(sorted(k + v[0]))
+                              for k, v in mapping.iteritems()))
+
+        for width in xrange(3, 11):
+            for bandwidth in xrange(2, 5):
+                for ramp in xrange(1, bandwidth + 1):
+                    self.assertEqual(reference(width, bandwidth, ramp),
+                                     lsh_combinations(width, bandwidth, ramp))
+
+    def test_save_load_sig_bands(self):
+        """Saved bands should be loaded back unchanged"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "bands.npz")
+            save_sig_bands(filename, 12, 3, "a2")
+            self.assertEqual(create_sig_bands(12, 3, "a2"),
+                             load_sig_bands(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()